@@ -0,0 +1,214 @@
+import json
+import platform
+import statistics
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, Any, Callable, List
+import click
+import constants
+from content_store import BlobIndex, SharedContentStore
+from drive_data_manager import DriveDataManager
+from drive_manifest import cull_metadata
+from drive_tree import DriveNode, render_tree
+from fake_drive import FakeDriveTree, FakeDriveService, FakeDrive
+from gdrive_utils import create_root_dir, dir_dive, dir_enumerate
+from pull_utils import download_drive_files, get_export_formats
+from repo_sync import RepositorySync
+from utils import no_stdout
+
+
+DEADLOCK_TIMEOUT_SECONDS = 60
+EXPORT_DEFAULTS = {key: value['default_export'] for (key, value) in constants.DRIVE_EXPORT_MIMETYPES.items()}
+
+
+def _new_ddm(service: FakeDriveService) -> DriveDataManager:
+    return DriveDataManager(drive=FakeDrive(service), export_defaults=EXPORT_DEFAULTS)
+
+
+def _select(ddm: DriveDataManager, full_scan: bool = False) -> DriveNode:
+    root_dir = create_root_dir(ddm.drive_files)
+    home_dir = root_dir.children['~']
+    dir_enumerate(home_dir, home_dir, root_dir, ddm, '', full_scan)
+    return home_dir
+
+
+def _bench_enumerate(service: FakeDriveService, full_scan: bool) -> Dict[str, Any]:
+    ddm = _new_ddm(service)
+    home_dir = _select(ddm, full_scan)
+    ddm.close()
+    return {'entries': sum(1 for _ in home_dir.walk())}
+
+
+def _bench_repl_cd(service: FakeDriveService, depth: int) -> Dict[str, Any]:
+    ddm = _new_ddm(service)
+    root_dir = create_root_dir(ddm.drive_files)
+    home_dir = root_dir.children['~']
+    target_dir = home_dir
+    for _ in range(depth): # one `cd` per level, each into a folder that hasn't been listed yet
+        target_dir = dir_dive(target_dir, home_dir, root_dir, ddm, 'folder0')
+    ddm.close()
+    return {'levels': depth}
+
+
+def _bench_repl_ls_recursive(service: FakeDriveService) -> Dict[str, Any]:
+    ddm = _new_ddm(service)
+    home_dir = _select(ddm)
+    with no_stdout():
+        render_tree(home_dir)
+    ddm.close()
+    return {'entries': sum(1 for _ in home_dir.walk())}
+
+
+def _bench_select(service: FakeDriveService) -> Dict[str, Any]:
+    ddm = _new_ddm(service)
+    home_dir = _select(ddm)
+    data = {node.path[len(home_dir.path):]: cull_metadata(node.drive_file.metadata) for node in home_dir.walk()}
+    ddm.close()
+    return {'entries': len(data)}
+
+
+def _bench_pull(service: FakeDriveService, jobs: int) -> Dict[str, Any]:
+    ddm = _new_ddm(service)
+    home_dir = _select(ddm)
+    drive_files = {node.path[len(home_dir.path):]: cull_metadata(node.drive_file.metadata) for node in home_dir.walk()}
+    export_formats = get_export_formats({'export_types': EXPORT_DEFAULTS})
+    with tempfile.TemporaryDirectory() as pull_dir:
+        start = time.perf_counter()
+        failures = ddm.client.run(download_drive_files(ddm.client, drive_files, Path(pull_dir), export_formats, jobs))
+        seconds = time.perf_counter() - start
+        pulled_bytes = sum(path.stat().st_size for path in Path(pull_dir).rglob('*') if path.is_file())
+    ddm.close()
+    file_count = sum(metadata['mimeType'] != constants.FOLDER_MIMETYPE for metadata in drive_files.values())
+    return {
+        'files': file_count,
+        'failures': len(failures),
+        'bytes': pulled_bytes,
+        'download_seconds': seconds,
+        'files_per_second': file_count / seconds if seconds else None,
+        'bytes_per_second': pulled_bytes / seconds if seconds else None
+    }
+
+
+def _bench_pull_fetch(service: FakeDriveService, jobs: int) -> Dict[str, Any]:
+    # listing and downloading overlap, so this should approach the download time alone rather than select + pull
+    ddm = _new_ddm(service)
+    sdr_config = {
+        'export_types': EXPORT_DEFAULTS,
+        constants.CHOSEN_GDRIVE_DIR_ID_KEY: 'root'
+    }
+    with tempfile.TemporaryDirectory() as pull_dir:
+        (Path(pull_dir) / constants.SDR_RELPATH).mkdir()
+        (Path(pull_dir) / constants.SDR_CONFIG_RELPATH).write_text(json.dumps(sdr_config))
+        sync = RepositorySync(Path(pull_dir), sdr_config, jobs)
+        _, stale_count, failures = sync.pull(ddm, fetch=True)
+        sync.close()
+    ddm.close()
+    return {'files': stale_count, 'failures': len(failures)}
+
+
+def _bench_pull_shared_blobs(service: FakeDriveService, jobs: int) -> Dict[str, Any]:
+    # two repositories holding the same blobs in opposite order, as `pull-all` runs them: each waits on the other's claims
+    ddm = _new_ddm(service)
+    home_dir = _select(ddm)
+    drive_files = {node.path[len(home_dir.path):]: cull_metadata(node.drive_file.metadata) for node in home_dir.walk()}
+    export_formats = get_export_formats({'export_types': EXPORT_DEFAULTS})
+    blob_index = BlobIndex()
+    with tempfile.TemporaryDirectory() as first_dir, tempfile.TemporaryDirectory() as second_dir:
+        pulls = [(Path(first_dir), drive_files), (Path(second_dir), dict(reversed(list(drive_files.items()))))]
+        executor = ThreadPoolExecutor(max_workers=len(pulls))
+        try:
+            futures = [
+                executor.submit(ddm.client.run, download_drive_files(
+                    ddm.client, repo_files, pull_dir, export_formats, jobs, content_store=SharedContentStore(blob_index, None)
+                ))
+                for (pull_dir, repo_files) in pulls
+            ]
+            failures = [future.result(timeout=DEADLOCK_TIMEOUT_SECONDS) for future in futures]
+        finally: # a deadlocked pull never finishes, so it is reported rather than waited for
+            executor.shutdown(wait=False)
+    ddm.close()
+    return {
+        'files': sum(metadata['mimeType'] != constants.FOLDER_MIMETYPE for metadata in drive_files.values()),
+        'failures': sum(len(repo_failures) for repo_failures in failures)
+    }
+
+
+def _run(service: FakeDriveService, repeat: int, bench: Callable[[], Dict[str, Any]]) -> Dict[str, Any]:
+    seconds: List[float] = []
+    details: Dict[str, Any] = {}
+    for _ in range(repeat):
+        service.request_counts = {}
+        start = time.perf_counter()
+        try:
+            details = bench()
+        except Exception as e:
+            return {'error': repr(e)}
+        seconds.append(time.perf_counter() - start)
+    return {
+        'seconds_median': statistics.median(seconds),
+        'seconds': seconds,
+        'requests': dict(service.request_counts),
+        **details
+    }
+
+
+@click.command()
+@click.option('--depth', default=3, show_default=True)
+@click.option('--fan-out', default=4, show_default=True)
+@click.option('--files-per-dir', default=8, show_default=True)
+@click.option('--file-size', default=64 * 1024, show_default=True)
+@click.option('--native-ratio', default=0.1, show_default=True)
+@click.option('--latency', default=0.02, show_default=True, help='Seconds added to every fake Drive request')
+@click.option('--error-rate', default=0.0, show_default=True, help='Fraction of fake Drive requests that are rate limited')
+@click.option('-j', '--jobs', default=constants.DEFAULT_PULL_JOBS, show_default=True)
+@click.option('-r', '--repeat', default=3, show_default=True)
+@click.option('-o', '--output', 'output_path', type=click.Path(dir_okay=False), help='Write results as JSON to this file')
+def benchmark(
+        depth: int,
+        fan_out: int,
+        files_per_dir: int,
+        file_size: int,
+        native_ratio: float,
+        latency: float,
+        error_rate: float,
+        jobs: int,
+        repeat: int,
+        output_path: str
+    ) -> None:
+    """
+    Benchmark SourceDrive against a local fake Google Drive with a synthetic file tree.
+    """
+    parameters = {
+        'depth': depth, 'fan_out': fan_out, 'files_per_dir': files_per_dir, 'file_size': file_size,
+        'native_ratio': native_ratio, 'latency': latency, 'error_rate': error_rate, 'jobs': jobs, 'repeat': repeat
+    }
+    service = FakeDriveService(FakeDriveTree(depth, fan_out, files_per_dir, file_size, native_ratio), latency, error_rate)
+
+    results = {
+        'dir_enumerate': _run(service, repeat, lambda: _bench_enumerate(service, False)),
+        'dir_enumerate_full_scan': _run(service, repeat, lambda: _bench_enumerate(service, True)),
+        'repl_cd': _run(service, repeat, lambda: _bench_repl_cd(service, depth)),
+        'repl_ls_recursive': _run(service, repeat, lambda: _bench_repl_ls_recursive(service)),
+        'select': _run(service, repeat, lambda: _bench_select(service)),
+        'pull': _run(service, repeat, lambda: _bench_pull(service, jobs)),
+        'pull_fetch': _run(service, repeat, lambda: _bench_pull_fetch(service, jobs)),
+        # more jobs than the default executor has threads, which used to deadlock on shared blobs
+        'pull_shared_blobs': _run(service, repeat, lambda: _bench_pull_shared_blobs(service, max(jobs, 32)))
+    }
+
+    report = json.dumps({
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'python': platform.python_version(),
+        'parameters': parameters,
+        'results': results
+    }, indent=4)
+    if output_path:
+        Path(output_path).write_text(report)
+    else:
+        click.echo(report)
+
+
+if __name__ == '__main__':
+    benchmark()
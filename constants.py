@@ -1,5 +1,5 @@
-from pydrive.auth import GoogleAuth
-import yaml
+import os
+from pathlib import Path
 
 FOLDER_MIMETYPE = 'application/vnd.google-apps.folder'
 
@@ -62,15 +62,93 @@ DRIVE_EXPORT_MIMETYPES = {
 }
 
 SDR_RELPATH = '.sdr'
-TEMP_DIR_RELPATH = SDR_RELPATH + '/temp'
-DRIVE_FILES_RELPATH = SDR_RELPATH + '/gdrive.json'
+MANIFEST_DB_RELPATH = SDR_RELPATH + '/manifest.db'
+DRIVE_FILES_RELPATH = SDR_RELPATH + '/gdrive.json' # legacy, migrated into the manifest database
 SDR_CONFIG_RELPATH = SDR_RELPATH + '/config.json'
 GAUTH_CREDENTIALS_RELPATH = SDR_RELPATH + '/gauth_credentials.json'
 GAUTH_SETTINGS_RELPATH = SDR_RELPATH + '/gauth_settings.yaml'
-GAUTH_SETTINGS: str = yaml.dump({**GoogleAuth.DEFAULT_SETTINGS, **{'client_config_file': GAUTH_CREDENTIALS_RELPATH}})
+GAUTH_SAVED_CREDENTIALS_RELPATH = SDR_RELPATH + '/gauth_saved_credentials.json'
+GAUTH_SAVED_CREDENTIALS_SETTINGS = {
+    'save_credentials': True,
+    'save_credentials_backend': 'file',
+    'save_credentials_file': GAUTH_SAVED_CREDENTIALS_RELPATH,
+    'get_refresh_token': True
+}
 
 GDRIVE_QUERY = '\'{}\' in parents and trashed=false'
+GDRIVE_PARENT_CLAUSE = '\'{}\' in parents'
+GDRIVE_BATCH_QUERY = '({}) and trashed=false'
+GDRIVE_CORPUS_QUERY = 'trashed=false'
+GDRIVE_TITLE_SEARCH_QUERY = 'title contains \'{}\' and trashed=false'
+GDRIVE_LIST_PAGE_SIZE = 1000
+GDRIVE_FILE_KEYS = ('id', 'title', 'mimeType', 'parents', 'md5Checksum', 'modifiedDate', 'fileSize', 'version')
+GDRIVE_FILE_FIELDS = 'id,title,mimeType,parents(id,isRoot),md5Checksum,modifiedDate,fileSize,version'
+GDRIVE_LIST_FIELDS = f'nextPageToken,items({GDRIVE_FILE_FIELDS})'
+GDRIVE_ABOUT_FIELDS = 'user(permissionId)'
+GDRIVE_CHANGES_FIELDS = f'nextPageToken,newStartPageToken,items(fileId,deleted,file({GDRIVE_FILE_FIELDS},labels/trashed))'
+GDRIVE_NATIVE_MIMETYPE_PREFIX = 'application/vnd.google-apps.'
+GDRIVE_DOWNLOAD_URL = 'https://www.googleapis.com/drive/v2/files/{}?alt=media'
+GDRIVE_EXPORT_URL = 'https://www.googleapis.com/drive/v2/files/{}/export?mimeType={}'
+GDRIVE_INSERT_UPLOAD_URL = 'https://www.googleapis.com/upload/drive/v2/files?uploadType=resumable'
+GDRIVE_UPDATE_UPLOAD_URL = 'https://www.googleapis.com/upload/drive/v2/files/{}?uploadType=resumable'
+ENUMERATION_BATCH_SIZE = 40
+ENUMERATION_JOBS = 8
+PIPELINE_QUEUE_SIZE = 64 # files listed but not yet picked up by a download worker
+SEARCH_RESULT_LIMIT = 20
+SEARCH_MAX_PARENT_DEPTH = 32
+MAX_DRIVE_CONNECTIONS = 64
 DIRECTORY_EXPECTED_ERROR_MSG = 'Error: Directory `{}` does not exist.'
 INVALID_BACKREFERENCE_ERROR_MSG = 'Error: Targeted directory is outside of the file system.'
 
 CHOSEN_GDRIVE_DIR_PATH_KEY = 'chosen_gdrive_dir'
+CHOSEN_GDRIVE_DIR_ID_KEY = 'chosen_gdrive_dir_id'
+CHANGES_PAGE_TOKEN_KEY = 'changes_page_token'
+PULL_JOBS_KEY = 'jobs'
+DEFAULT_PULL_JOBS = 8
+PULL_MANIFEST_RELPATH = SDR_RELPATH + '/pull_manifest.json' # legacy, migrated into the manifest database
+PARTIAL_DOWNLOADS_RELPATH = SDR_RELPATH + '/partial'
+DOWNLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+# how identical contents are shared: 'reflink' (copy-on-write clones, falling back to copies), 'copy', or 'hardlink'.
+# Hardlinked files share an inode with the content store's blob and with every other repository's copy, so they are
+# made read-only; replace such a file (e.g. write a new one and move it over) rather than editing it in place
+DEDUP_MODE_KEY = 'dedup_mode'
+DEFAULT_DEDUP_MODE = 'reflink'
+CONTENT_STORE_KEY = 'content_store'
+CONTENT_STORE_RELPATH = SDR_RELPATH + '/objects'
+EXTRA_EXPORT_TYPES_KEY = 'extra_export_types'
+EXPORT_CACHE_RELPATH = SDR_RELPATH + '/exports'
+WATCH_INTERVAL_KEY = 'watch_interval'
+DEFAULT_WATCH_INTERVAL = 5
+WATCH_MAX_INTERVAL_KEY = 'watch_max_interval'
+DEFAULT_WATCH_MAX_INTERVAL = 60
+WATCH_STATUS_RELPATH = SDR_RELPATH + '/watch_status.json'
+PULL_FILTERS_KEY = 'filters'
+PARALLEL_HASH_THRESHOLD = 32
+HASH_CHUNK_SIZE = 16
+UPLOADS_RELPATH = SDR_RELPATH + '/uploads'
+UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024 # must be a multiple of 256 KiB
+DEFAULT_UPLOAD_MIMETYPE = 'application/octet-stream'
+REVISION_KEYS = ('id', 'md5Checksum', 'modifiedDate', 'version')
+LAZY_PULL_KEY = 'lazy'
+STUB_HEADER = b'# SourceDrive placeholder: run `sdr hydrate` on this path to download it\n'
+STUB_MAX_SIZE = 4096
+
+LISTING_CACHE_PATH = Path(os.environ.get('XDG_CACHE_HOME', '~/.cache')).expanduser() / 'sourcedrive' / 'listings.db'
+LISTING_CACHE_TTL_KEY = 'listing_cache_ttl'
+DEFAULT_LISTING_CACHE_TTL = 60 * 60
+LISTING_CACHE_MAX_ENTRIES_KEY = 'listing_cache_max_entries'
+DEFAULT_LISTING_CACHE_MAX_ENTRIES = 10000
+PREFETCH_DEPTH_KEY = 'prefetch_depth'
+DEFAULT_PREFETCH_DEPTH = 1
+PREFETCH_BUDGET_KEY = 'prefetch_budget'
+DEFAULT_PREFETCH_BUDGET = 20
+
+REQUESTS_PER_SECOND_KEY = 'requests_per_second'
+DEFAULT_REQUESTS_PER_SECOND = 100
+REQUEST_BURST_KEY = 'request_burst'
+DEFAULT_REQUEST_BURST = 100
+MAX_CONCURRENCY_KEY = 'max_concurrency'
+DEFAULT_MAX_CONCURRENCY = 32
+REQUEST_RETRIES = 8
+MAX_BACKOFF_SECONDS = 32
+RATE_LIMIT_REASONS = ('rateLimitExceeded', 'userRateLimitExceeded')
@@ -0,0 +1,142 @@
+import asyncio
+import os
+import shutil
+import stat
+import threading
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+import constants
+
+
+_FICLONE = 0x40049409 # linux ioctl that shares a file's extents on copy-on-write filesystems
+
+
+def _reflink(source_path: Path, destination_path: Path) -> None:
+    try:
+        import fcntl
+        with source_path.open('rb') as source_file, destination_path.open('wb') as destination_file:
+            fcntl.ioctl(destination_file.fileno(), _FICLONE, source_file.fileno())
+    except (ImportError, OSError):
+        shutil.copyfile(source_path, destination_path)
+
+
+def materialise_file(source_path: Path, file_path: Path, dedup_mode: str) -> None:
+    file_path.parent.mkdir(parents=True, exist_ok=True)
+    temp_file_path = file_path.with_name(f'.{file_path.name}.sdr-tmp')
+    temp_file_path.unlink(missing_ok=True)
+    if dedup_mode == 'hardlink':
+        try:
+            os.link(source_path, temp_file_path)
+        except OSError: # e.g. across devices
+            shutil.copyfile(source_path, temp_file_path)
+        else:
+            # every link shares one inode, so an edit in place would change the store's blob and every other copy;
+            # read-only links make such edits fail instead, while editors that save by replacing the file still work
+            os.chmod(temp_file_path, stat.S_IMODE(temp_file_path.stat().st_mode) & ~(stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH))
+    elif dedup_mode == 'reflink':
+        _reflink(source_path, temp_file_path)
+    else:
+        shutil.copyfile(source_path, temp_file_path)
+    os.replace(temp_file_path, file_path)
+
+
+class ContentStore:
+    # blobs are named by their Drive md5Checksum, so one store can back any number of repositories
+    def __init__(self, store_path: Path, dedup_mode: str):
+        self._store_path = store_path
+        self._dedup_mode = dedup_mode
+
+    def _get_blob_path(self, md5_checksum: str) -> Path:
+        return self._store_path / md5_checksum[:2] / md5_checksum
+
+    async def get(self, md5_checksum: str) -> Optional[Path]:
+        blob_path = self._get_blob_path(md5_checksum)
+        return blob_path if await asyncio.to_thread(blob_path.exists) else None
+
+    def add(self, md5_checksum: str, file_path: Path) -> None:
+        blob_path = self._get_blob_path(md5_checksum)
+        if not blob_path.exists():
+            materialise_file(file_path, blob_path, self._dedup_mode)
+
+    def release(self, md5_checksum: str) -> None:
+        pass
+
+
+def _wake(waiter: 'asyncio.Future[None]') -> None:
+    if not waiter.done():
+        waiter.set_result(None)
+
+
+class BlobIndex:
+    """
+    Shared by repositories pulled in one process: the first to need a blob downloads it while the others wait for it.
+    Each repository runs its own event loop, so waiters are futures on their own loop that the claimant wakes from
+    wherever it finishes; a waiting download holds no thread, leaving the executors free for the download it waits on.
+    """
+    def __init__(self):
+        self._blob_paths: Dict[str, Path] = {}
+        self._pending: Dict[str, List[Tuple[asyncio.AbstractEventLoop, 'asyncio.Future[None]']]] = {}
+        self._lock = threading.Lock()
+
+    async def claim(self, md5_checksum: str) -> Optional[Path]:
+        """Returns a local copy of the blob, or None once the caller is responsible for fetching it."""
+        loop = asyncio.get_running_loop()
+        while True:
+            with self._lock:
+                blob_path = self._blob_paths.get(md5_checksum, None)
+                if blob_path is not None and blob_path.exists():
+                    return blob_path
+                waiters = self._pending.get(md5_checksum, None)
+                if waiters is None:
+                    self._pending[md5_checksum] = []
+                    return None
+                waiter: 'asyncio.Future[None]' = loop.create_future()
+                waiters.append((loop, waiter))
+            await waiter
+
+    def _resolve(self, md5_checksum: str, blob_path: Optional[Path]) -> None:
+        with self._lock:
+            if blob_path is not None:
+                self._blob_paths[md5_checksum] = blob_path
+            waiters = self._pending.pop(md5_checksum, [])
+        for loop, waiter in waiters:
+            if not loop.is_closed():
+                loop.call_soon_threadsafe(_wake, waiter)
+
+    def add(self, md5_checksum: str, file_path: Path) -> None:
+        self._resolve(md5_checksum, file_path)
+
+    def release(self, md5_checksum: str) -> None:
+        # waiters retry, and the first of them claims the blob in turn
+        self._resolve(md5_checksum, None)
+
+
+class SharedContentStore:
+    def __init__(self, blob_index: BlobIndex, content_store: Optional[ContentStore]):
+        self._blob_index = blob_index
+        self._content_store = content_store
+
+    async def get(self, md5_checksum: str) -> Optional[Path]:
+        blob_path = await self._blob_index.claim(md5_checksum)
+        if blob_path is None and self._content_store:
+            blob_path = await self._content_store.get(md5_checksum)
+            if blob_path is not None:
+                self._blob_index.add(md5_checksum, blob_path)
+        return blob_path
+
+    def add(self, md5_checksum: str, file_path: Path) -> None:
+        if self._content_store:
+            self._content_store.add(md5_checksum, file_path)
+        self._blob_index.add(md5_checksum, file_path)
+
+    def release(self, md5_checksum: str) -> None:
+        self._blob_index.release(md5_checksum)
+
+
+def get_content_store(target_dir_path: Path, content_store: Any, dedup_mode: str) -> Optional[ContentStore]:
+    # `true` keeps the store inside the repository; a path shares it between repositories
+    if not content_store:
+        return None
+    if content_store is True:
+        return ContentStore(target_dir_path / constants.CONTENT_STORE_RELPATH, dedup_mode)
+    return ContentStore(Path(content_store).expanduser(), dedup_mode)
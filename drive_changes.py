@@ -0,0 +1,119 @@
+import os
+from pathlib import Path
+from typing import Dict, Any, List, Optional, Tuple
+import constants
+from drive_manifest import ManifestStore, cull_metadata
+from utils import get_local_file_path, get_virtual_file_name
+
+
+def _get_parent_ids(metadata: Dict[str, Any]) -> List[str]:
+    parent_ids = []
+    for parent in metadata.get('parents', []):
+        parent_ids.append(parent['id'])
+        if parent.get('isRoot', False):
+            parent_ids.append('root')
+    return parent_ids
+
+
+def get_changed_rows(
+        store: ManifestStore,
+        changes: List[Dict[str, Any]],
+        chosen_dir_id: str,
+        export_defaults: Dict[str, str]
+    ) -> Tuple[Dict[str, Dict[str, Any]], List[str], Dict[str, Dict[str, Any]]]:
+    """
+    Works out which manifest rows the changes touch, looking files up by ID instead of loading the whole manifest.
+    Returns the rows to upsert, the paths to delete, and the rows that left their path as they were before the changes.
+    """
+    # changes arrive oldest first, so later entries for the same file win
+    changed: Dict[str, Optional[Dict[str, Any]]] = {}
+    for change in changes:
+        file: Optional[Dict[str, Any]] = change.get('file', None)
+        if change.get('deleted', False) or file is None or file.get('labels', {}).get('trashed', False):
+            changed[change['fileId']] = None
+        else:
+            changed[change['fileId']] = cull_metadata(file)
+
+    rows: Dict[str, Optional[Tuple[str, Dict[str, Any]]]] = {}
+    def get_row(file_id: str) -> Optional[Tuple[str, Dict[str, Any]]]:
+        if file_id not in rows:
+            rows[file_id] = store.get_file_by_id(file_id)
+        return rows[file_id]
+
+    # paths are rebuilt from the parent chain, so a file also follows its folders' moves
+    paths: Dict[str, Optional[str]] = {chosen_dir_id: ''}
+    def resolve_path(file_id: str) -> Optional[str]:
+        if file_id in paths:
+            return paths[file_id]
+        paths[file_id] = None
+        row = get_row(file_id)
+        metadata = changed[file_id] if file_id in changed else (row[1] if row else None)
+        if metadata is None: # deleted, or never under the chosen folder
+            return None
+        for parent_id in _get_parent_ids(metadata):
+            parent_path = resolve_path(parent_id)
+            if parent_path is not None:
+                paths[file_id] = f'{parent_path}/{get_virtual_file_name(metadata, export_defaults)}'
+                break
+        return paths[file_id]
+
+    upserts: Dict[str, Dict[str, Any]] = {}
+    old_rows: Dict[str, Dict[str, Any]] = {}
+    for file_id, metadata in changed.items():
+        if file_id == chosen_dir_id:
+            continue
+        new_path = resolve_path(file_id)
+        if metadata is not None and new_path is not None:
+            upserts[new_path] = metadata
+        row = get_row(file_id)
+        if row is None or row[0] == new_path:
+            continue
+        old_path, old_metadata = row
+        old_rows[old_path] = old_metadata
+        if old_metadata['mimeType'] == constants.FOLDER_MIMETYPE:
+            # the rest of a moved or removed folder's subtree is only found by its path
+            for path, child_metadata in store.get_files(old_path).items():
+                if path == old_path or child_metadata['id'] in changed:
+                    continue
+                old_rows[path] = child_metadata
+                if new_path is not None:
+                    upserts[f'{new_path}{path[len(old_path):]}'] = child_metadata
+    return (upserts, [path for path in old_rows if path not in upserts], old_rows)
+
+
+def move_local_file(target_dir_path: Path, old_path: str, new_path: Optional[str]) -> None:
+    old_local_path = get_local_file_path(target_dir_path, old_path)
+    if new_path is None: # deleted, trashed or moved out of the chosen folder
+        old_local_path.unlink(missing_ok=True)
+    elif old_local_path.exists():
+        new_local_path = get_local_file_path(target_dir_path, new_path)
+        new_local_path.parent.mkdir(parents=True, exist_ok=True)
+        os.replace(old_local_path, new_local_path)
+
+
+def apply_local_changes(
+        old_drive_files: Dict[str, Dict[str, Any]],
+        new_drive_files: Dict[str, Dict[str, Any]],
+        target_dir_path: Path
+    ) -> Dict[str, Optional[str]]:
+
+    new_paths = {metadata['id']: path for (path, metadata) in new_drive_files.items()}
+    moves: Dict[str, Optional[str]] = {}
+    for old_path, metadata in old_drive_files.items():
+        new_path = new_paths.get(metadata['id'], None)
+        if metadata['mimeType'] == constants.FOLDER_MIMETYPE or new_path == old_path:
+            continue
+        move_local_file(target_dir_path, old_path, new_path)
+        moves[old_path] = new_path
+
+    # clean up folders that were removed or renamed, deepest first
+    stale_dir_paths = [
+        path for (path, metadata) in old_drive_files.items()
+        if metadata['mimeType'] == constants.FOLDER_MIMETYPE and new_drive_files.get(path, {}).get('id', None) != metadata['id']
+    ]
+    for path in sorted(stale_dir_paths, key=lambda path: path.count('/'), reverse=True):
+        try:
+            get_local_file_path(target_dir_path, path).rmdir()
+        except OSError: # missing, or still holds local files
+            pass
+    return moves
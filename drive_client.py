@@ -0,0 +1,429 @@
+import asyncio
+import functools
+import threading
+import hashlib
+import json
+import os
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, Any, Optional, List, Tuple, Callable, Awaitable, TypeVar
+import httplib2
+from pydrive.auth import GoogleAuth
+from pydrive.drive import GoogleDrive
+import constants
+import stats
+from request_scheduler import RequestScheduler, ThrottledError, TransientError
+
+
+_thread_local = threading.local()
+_scheduler = RequestScheduler(
+    constants.DEFAULT_REQUESTS_PER_SECOND, constants.DEFAULT_REQUEST_BURST, constants.DEFAULT_MAX_CONCURRENCY
+)
+T = TypeVar('T')
+
+
+class DriveRequestError(Exception):
+    pass
+
+
+class DriveTransientError(DriveRequestError, TransientError):
+    pass
+
+
+class DriveThrottledError(DriveTransientError, ThrottledError):
+    pass
+
+
+def set_request_scheduler(scheduler: RequestScheduler) -> None:
+    # one scheduler per process, so every Drive request shares the same rate and concurrency budget
+    global _scheduler
+    _scheduler = scheduler
+
+
+def get_request_scheduler() -> RequestScheduler:
+    return _scheduler
+
+
+def _execute(kind: str, request: Any, drive: GoogleDrive) -> Any:
+    def execute() -> Any:
+        with stats.request(kind):
+            return request.execute(http=get_http(drive))
+    return _scheduler.execute(kind, execute)
+
+
+def get_gauth_settings() -> Dict[str, Any]:
+    return {
+        **GoogleAuth.DEFAULT_SETTINGS,
+        'client_config_file': constants.GAUTH_CREDENTIALS_RELPATH,
+        **constants.GAUTH_SAVED_CREDENTIALS_SETTINGS
+    }
+
+
+def get_drive_instance(target_dir_path: Path = Path('.')) -> GoogleDrive:
+    gauth = GoogleAuth(settings_file=str(target_dir_path / constants.GAUTH_SETTINGS_RELPATH))
+    # older repositories' settings files predate saved credentials
+    gauth.settings.update(constants.GAUTH_SAVED_CREDENTIALS_SETTINGS)
+    gauth.settings.update({
+        'client_config_file': str(target_dir_path / constants.GAUTH_CREDENTIALS_RELPATH),
+        'save_credentials_file': str(target_dir_path / constants.GAUTH_SAVED_CREDENTIALS_RELPATH)
+    })
+    # reuses (and silently refreshes) the saved token, only opening the browser when there is none
+    gauth.LocalWebserverAuth()
+    return GoogleDrive(gauth)
+
+
+def get_http(drive: GoogleDrive) -> httplib2.Http:
+    # httplib2.Http is not thread-safe, so every worker thread authorises its own connection, one per signed-in session
+    if not hasattr(_thread_local, 'https'):
+        _thread_local.https = {}
+    https: Dict[GoogleDrive, httplib2.Http] = _thread_local.https
+    if drive not in https:
+        https[drive] = drive.auth.Get_Http_Object()
+    return https[drive]
+
+
+def list_files(drive: GoogleDrive, query: str) -> List[Dict[str, Any]]:
+    files: List[Dict[str, Any]] = []
+    page_token: Optional[str] = None
+    while True:
+        response = _execute('files.list', drive.auth.service.files().list(
+            q=query,
+            maxResults=constants.GDRIVE_LIST_PAGE_SIZE,
+            pageToken=page_token,
+            fields=constants.GDRIVE_LIST_FIELDS
+        ), drive)
+        files.extend(response.get('items', []))
+        page_token = response.get('nextPageToken', None)
+        if not page_token:
+            return files
+
+
+def index_by_parent(files: List[Dict[str, Any]], parent_ids: List[str] = None) -> Dict[str, List[Dict[str, Any]]]:
+    children: Dict[str, List[Dict[str, Any]]] = {parent_id: [] for parent_id in (parent_ids or [])}
+    for file in files:
+        for parent in file.get('parents', []):
+            # the REPL addresses the user's root folder by its 'root' alias
+            for parent_id in ({parent['id'], 'root'} if parent.get('isRoot', False) else {parent['id']}):
+                if parent_ids is None or parent_id in children:
+                    children.setdefault(parent_id, []).append(file)
+    return children
+
+
+def list_children(drive: GoogleDrive, parent_ids: List[str], query_clause: str = '') -> Dict[str, List[Dict[str, Any]]]:
+    query = constants.GDRIVE_BATCH_QUERY.format(
+        ' or '.join(constants.GDRIVE_PARENT_CLAUSE.format(parent_id) for parent_id in parent_ids)
+    )
+    if query_clause:
+        query = f'{query} and ({query_clause})'
+    return index_by_parent(list_files(drive, query), parent_ids)
+
+
+def get_file_metadata(drive: GoogleDrive, file_id: str) -> Dict[str, Any]:
+    return _execute('files.get', drive.auth.service.files().get(fileId=file_id, fields=constants.GDRIVE_FILE_FIELDS), drive)
+
+
+def get_start_page_token(drive: GoogleDrive) -> str:
+    return _execute('changes.getStartPageToken', drive.auth.service.changes().getStartPageToken(), drive)['startPageToken']
+
+
+def get_account_id(drive: GoogleDrive) -> str:
+    # stable for the signed-in Google account, whichever OAuth client it signed in through
+    about = _execute('about.get', drive.auth.service.about().get(fields=constants.GDRIVE_ABOUT_FIELDS), drive)
+    return about['user']['permissionId']
+
+
+def list_changes(drive: GoogleDrive, page_token: str) -> Tuple[List[Dict[str, Any]], str]:
+    changes: List[Dict[str, Any]] = []
+    while True:
+        response = _execute('changes.list', drive.auth.service.changes().list(
+            pageToken=page_token,
+            maxResults=constants.GDRIVE_LIST_PAGE_SIZE,
+            includeDeleted=True,
+            fields=constants.GDRIVE_CHANGES_FIELDS
+        ), drive)
+        changes.extend(response.get('items', []))
+        if 'newStartPageToken' in response:
+            return (changes, response['newStartPageToken'])
+        page_token = response['nextPageToken']
+
+
+def get_download_url(metadata: Dict[str, Any], export_mimetype: Optional[str] = None) -> str:
+    # built from the ID so manifests don't need to keep the (large) link fields
+    if not metadata['mimeType'].startswith(constants.GDRIVE_NATIVE_MIMETYPE_PREFIX):
+        return constants.GDRIVE_DOWNLOAD_URL.format(metadata['id'])
+    if export_mimetype:
+        return constants.GDRIVE_EXPORT_URL.format(metadata['id'], urllib.parse.quote(export_mimetype, safe=''))
+    raise DriveRequestError(f'No download link available for `{metadata["title"]}`')
+
+
+def _get_partial_file_path(partial_dir_path: Path, metadata: Dict[str, Any], export_mimetype: Optional[str]) -> Path:
+    # partial downloads are only resumable against the same revision and export format
+    revision = metadata.get('md5Checksum', None) or metadata.get('version', '')
+    key = f'{metadata["id"]}:{revision}:{export_mimetype}'
+    return partial_dir_path / f'{hashlib.md5(key.encode()).hexdigest()}.part'
+
+
+def _request_chunk(http: httplib2.Http, url: str, start: int) -> Tuple[httplib2.Response, bytes]:
+    try:
+        with stats.request('media'):
+            response, content = http.request(
+                url, headers={'Range': f'bytes={start}-{start + constants.DOWNLOAD_CHUNK_SIZE - 1}'}
+            )
+    except (httplib2.HttpLib2Error, OSError) as e:
+        raise DriveTransientError(str(e))
+    stats.add_bytes(len(content))
+    is_rate_limited = response.status == 403 and any(
+        reason.encode() in content for reason in constants.RATE_LIMIT_REASONS
+    )
+    if response.status == 429 or is_rate_limited:
+        raise DriveThrottledError(f'HTTP {response.status}')
+    if response.status >= 500:
+        raise DriveTransientError(f'HTTP {response.status}')
+    if response.status not in (200, 206, 416):
+        raise DriveRequestError(f'HTTP {response.status}')
+    return (response, content)
+
+
+def _download_to_partial_file(http: httplib2.Http, url: str, partial_file_path: Path) -> None:
+    partial_file_path.touch(exist_ok=True)
+    with partial_file_path.open('r+b') as partial_file:
+        partial_file.seek(0, os.SEEK_END)
+        while True:
+            # each chunk is retried on its own, resuming from the last byte written
+            start = partial_file.tell()
+            response, content = _scheduler.execute('media', functools.partial(_request_chunk, http, url, start))
+            if response.status == 416: # nothing left past the bytes already written
+                return
+            if response.status == 200: # ranges unsupported (e.g. exports), so the whole body was sent
+                partial_file.seek(0)
+                partial_file.truncate()
+                partial_file.write(content)
+                return
+            partial_file.write(content)
+            total_size = response.get('content-range', '').split('/')[-1]
+            if not content or (total_size.isdigit() and partial_file.tell() >= int(total_size)):
+                return
+
+
+def _get_md5_checksum(file_path: Path) -> str:
+    md5 = hashlib.md5()
+    with file_path.open('rb') as file:
+        for chunk in iter(lambda: file.read(constants.DOWNLOAD_CHUNK_SIZE), b''):
+            md5.update(chunk)
+    return md5.hexdigest()
+
+
+def download_file(
+        drive: GoogleDrive,
+        metadata: Dict[str, Any],
+        file_path: Path,
+        partial_dir_path: Path,
+        export_mimetype: Optional[str] = None
+    ) -> None:
+
+    url = get_download_url(metadata, export_mimetype)
+    partial_dir_path.mkdir(parents=True, exist_ok=True)
+    partial_file_path = _get_partial_file_path(partial_dir_path, metadata, export_mimetype)
+    try:
+        _download_to_partial_file(get_http(drive), url, partial_file_path)
+    except DriveTransientError as e: # the partial file is kept so the next pull resumes it
+        raise DriveRequestError(f'Could not download `{metadata["title"]}` ({e})')
+    except DriveRequestError as e:
+        partial_file_path.unlink(missing_ok=True)
+        raise DriveRequestError(f'Could not download `{metadata["title"]}` ({e})')
+
+    if 'md5Checksum' in metadata and _get_md5_checksum(partial_file_path) != metadata['md5Checksum']:
+        partial_file_path.unlink()
+        raise DriveRequestError(f'Checksum mismatch for `{metadata["title"]}`')
+    file_path.parent.mkdir(parents=True, exist_ok=True)
+    os.replace(partial_file_path, file_path)
+
+
+def create_folder(drive: GoogleDrive, title: str, parent_id: str) -> Dict[str, Any]:
+    return _execute('files.insert', drive.auth.service.files().insert(
+        body={'title': title, 'mimeType': constants.FOLDER_MIMETYPE, 'parents': [{'id': parent_id}]},
+        fields=constants.GDRIVE_FILE_FIELDS
+    ), drive)
+
+
+def _check_upload_response(response: httplib2.Response, content: bytes) -> None:
+    is_rate_limited = response.status == 403 and any(
+        reason.encode() in content for reason in constants.RATE_LIMIT_REASONS
+    )
+    if response.status == 429 or is_rate_limited:
+        raise DriveThrottledError(f'HTTP {response.status}')
+    if response.status >= 500:
+        raise DriveTransientError(f'HTTP {response.status}')
+    if response.status not in (200, 201, 308):
+        raise DriveRequestError(f'HTTP {response.status}')
+
+
+def _request_upload(http: httplib2.Http, url: str, method: str, body: Any = None, headers: Dict[str, str] = None) -> Tuple[httplib2.Response, bytes]:
+    try:
+        with stats.request('upload'):
+            response, content = http.request(url, method=method, body=body, headers=headers or {})
+    except (httplib2.HttpLib2Error, OSError) as e:
+        raise DriveTransientError(str(e))
+    if response.status in (404, 410): # the upload session expired
+        return (response, content)
+    _check_upload_response(response, content)
+    return (response, content)
+
+
+def _get_upload_offset(response: httplib2.Response) -> int:
+    # a 308 reports the bytes received so far as `Range: bytes=0-<last>`, or no header when nothing arrived
+    byte_range = response.get('range', '')
+    return int(byte_range.rsplit('-', 1)[-1]) + 1 if byte_range else 0
+
+
+def _start_upload_session(
+        http: httplib2.Http,
+        file_metadata: Dict[str, Any],
+        file_id: Optional[str],
+        mimetype: str,
+        size: int
+    ) -> str:
+
+    url = constants.GDRIVE_UPDATE_UPLOAD_URL.format(file_id) if file_id else constants.GDRIVE_INSERT_UPLOAD_URL
+    response, _ = _scheduler.execute('upload', functools.partial(
+        _request_upload,
+        http,
+        f'{url}&fields={urllib.parse.quote(constants.GDRIVE_FILE_FIELDS)}',
+        'PUT' if file_id else 'POST',
+        json.dumps(file_metadata),
+        {
+            'Content-Type': 'application/json; charset=UTF-8',
+            'X-Upload-Content-Type': mimetype,
+            'X-Upload-Content-Length': str(size)
+        }
+    ))
+    if response.status in (404, 410):
+        raise DriveRequestError(f'HTTP {response.status}')
+    return response['location']
+
+
+def upload_file(
+        drive: GoogleDrive,
+        file_path: Path,
+        upload_state_dir_path: Path,
+        file_metadata: Dict[str, Any],
+        file_id: Optional[str] = None
+    ) -> Dict[str, Any]:
+    """
+    Uploads `file_path` as a new file (described by `file_metadata`) or as a new revision of `file_id`, in resumable
+    chunks. The session URL is kept in `upload_state_dir_path`, so an interrupted upload of the same local state resumes.
+    """
+    http = get_http(drive)
+    local_stat = file_path.stat()
+    size = local_stat.st_size
+    mimetype = file_metadata.get('mimeType', None) or constants.DEFAULT_UPLOAD_MIMETYPE
+    key = f'{file_id or json.dumps(file_metadata, sort_keys=True)}:{size}:{local_stat.st_mtime_ns}'
+    upload_state_dir_path.mkdir(parents=True, exist_ok=True)
+    session_file_path = upload_state_dir_path / f'{hashlib.md5(key.encode()).hexdigest()}.session'
+
+    offset = 0
+    session_url = session_file_path.read_text() if session_file_path.exists() else None
+    if session_url: # ask how much of the interrupted upload arrived
+        response, content = _scheduler.execute('upload', functools.partial(
+            _request_upload, http, session_url, 'PUT', None, {'Content-Range': f'bytes */{size}', 'Content-Length': '0'}
+        ))
+        if response.status in (200, 201):
+            session_file_path.unlink()
+            return json.loads(content)
+        if response.status == 308:
+            offset = _get_upload_offset(response)
+        else:
+            session_url = None
+    if not session_url:
+        session_url = _start_upload_session(http, file_metadata, file_id, mimetype, size)
+        session_file_path.write_text(session_url)
+
+    status_headers = {'Content-Range': f'bytes */{size}', 'Content-Length': '0'}
+    with file_path.open('rb') as file:
+        def send_chunk() -> Tuple[httplib2.Response, bytes, int]:
+            nonlocal offset, is_retry
+            if is_retry: # part of the failed chunk may have arrived, so resume from what the server reports
+                response, content = _request_upload(http, session_url, 'PUT', None, status_headers)
+                if response.status != 308:
+                    return (response, content, 0)
+                offset = _get_upload_offset(response)
+            is_retry = True
+            file.seek(offset)
+            chunk = file.read(constants.UPLOAD_CHUNK_SIZE)
+            headers = {'Content-Length': str(len(chunk))}
+            headers['Content-Range'] = f'bytes {offset}-{offset + len(chunk) - 1}/{size}' if size else f'bytes */{size}'
+            response, content = _request_upload(http, session_url, 'PUT', chunk, headers)
+            is_retry = False
+            return (response, content, len(chunk))
+
+        while True:
+            is_retry = False
+            response, content, chunk_size = _scheduler.execute('upload', send_chunk)
+            if response.status in (404, 410):
+                session_file_path.unlink(missing_ok=True)
+                raise DriveTransientError(f'Upload session for `{file_path.name}` expired')
+            stats.add_bytes(chunk_size)
+            if response.status in (200, 201):
+                session_file_path.unlink(missing_ok=True)
+                return json.loads(content)
+            offset = _get_upload_offset(response)
+
+
+class AsyncDriveClient:
+    # every pool thread keeps its own keep-alive connection, so requests in flight are bounded by the pool size
+    def __init__(self, drive: GoogleDrive, max_connections: int = constants.MAX_DRIVE_CONNECTIONS):
+        self._drive = drive
+        self._executor = ThreadPoolExecutor(max_workers=max_connections, thread_name_prefix='sdr-drive')
+
+    async def _call(self, function: Callable[..., T], *args: Any) -> T:
+        return await asyncio.get_running_loop().run_in_executor(
+            self._executor, functools.partial(function, self._drive, *args)
+        )
+
+    async def list_files(self, query: str) -> List[Dict[str, Any]]:
+        return await self._call(list_files, query)
+
+    async def list_children(self, parent_ids: List[str], query_clause: str = '') -> Dict[str, List[Dict[str, Any]]]:
+        return await self._call(list_children, parent_ids, query_clause)
+
+    async def get_metadata(self, file_id: str) -> Dict[str, Any]:
+        return await self._call(get_file_metadata, file_id)
+
+    async def get_start_page_token(self) -> str:
+        return await self._call(get_start_page_token)
+
+    async def get_account_id(self) -> str:
+        return await self._call(get_account_id)
+
+    async def list_changes(self, page_token: str) -> Tuple[List[Dict[str, Any]], str]:
+        return await self._call(list_changes, page_token)
+
+    async def download(
+            self,
+            metadata: Dict[str, Any],
+            file_path: Path,
+            partial_dir_path: Path,
+            export_mimetype: Optional[str] = None
+        ) -> None:
+
+        await self._call(download_file, metadata, file_path, partial_dir_path, export_mimetype)
+
+    async def create_folder(self, title: str, parent_id: str) -> Dict[str, Any]:
+        return await self._call(create_folder, title, parent_id)
+
+    async def upload(
+            self,
+            file_path: Path,
+            upload_state_dir_path: Path,
+            file_metadata: Dict[str, Any],
+            file_id: Optional[str] = None
+        ) -> Dict[str, Any]:
+
+        return await self._call(upload_file, file_path, upload_state_dir_path, file_metadata, file_id)
+
+    def run(self, awaitable: Awaitable[T]) -> T:
+        return asyncio.run(awaitable)
+
+    def close(self) -> None:
+        self._executor.shutdown()
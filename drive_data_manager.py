@@ -1,14 +1,35 @@
 
-from gdrive_utils import get_drive_instance
+from drive_client import get_drive_instance, AsyncDriveClient
+from listing_cache import ListingCache
+from prefetcher import Prefetcher
 from utils import no_stdout
+import stats
 from pydrive.drive import GoogleDrive, GoogleDriveFile
-from typing import Dict
+from pathlib import Path
+from typing import Dict, Optional
 
 class DriveDataManager:
-    def __init__(self):
-        with no_stdout():
-            self._drive = get_drive_instance()
+    def __init__(
+            self, 
+            listing_cache: Optional[ListingCache] = None, 
+            prefetch_depth: int = 0, 
+            prefetch_budget: int = 0,
+            drive: Optional[GoogleDrive] = None,
+            target_dir_path: Path = Path('.'),
+            export_defaults: Optional[Dict[str, str]] = None
+        ):
+
+        if drive is None: # signs in with the repository's own credentials, wherever it is run from
+            with stats.phase('auth'), no_stdout():
+                drive = get_drive_instance(target_dir_path)
+        self._drive = drive
+        self._export_defaults = export_defaults or {}
+        self._client = AsyncDriveClient(self._drive)
         self._drive_files = {}
+        self._listing_cache = listing_cache
+        self._prefetcher = None
+        if prefetch_depth > 0 and prefetch_budget > 0:
+            self._prefetcher = Prefetcher(self._client, prefetch_depth, prefetch_budget, listing_cache)
 
     @property
     def drive_files(self) -> Dict[str, GoogleDriveFile]:
@@ -17,3 +38,26 @@ class DriveDataManager:
     @property
     def drive(self) -> GoogleDrive:
         return self._drive
+
+    @property
+    def export_defaults(self) -> Dict[str, str]:
+        return self._export_defaults
+
+    @property
+    def client(self) -> AsyncDriveClient:
+        return self._client
+
+    @property
+    def listing_cache(self) -> Optional[ListingCache]:
+        return self._listing_cache
+
+    @property
+    def prefetcher(self) -> Optional[Prefetcher]:
+        return self._prefetcher
+
+    def close(self) -> None:
+        if self._prefetcher:
+            self._prefetcher.close()
+        self._client.close()
+        if self._listing_cache:
+            self._listing_cache.close()
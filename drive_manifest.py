@@ -0,0 +1,135 @@
+import json
+import sqlite3
+from pathlib import Path
+from typing import Dict, Any, Iterable, List, Optional, Tuple
+import click
+import constants
+
+
+_SCHEMA_VERSION = 1
+
+
+def cull_metadata(metadata: Dict[str, Any]) -> Dict[str, Any]:
+    culled = {key: metadata[key] for key in constants.GDRIVE_FILE_KEYS if key in metadata}
+    if 'parents' in culled:
+        culled['parents'] = [
+            {key: parent[key] for key in ('id', 'isRoot') if key in parent} for parent in culled['parents']
+        ]
+    return culled
+
+
+def diff_rows(
+        old_rows: Dict[str, Dict[str, Any]],
+        new_rows: Dict[str, Dict[str, Any]]
+    ) -> Tuple[Dict[str, Dict[str, Any]], List[str]]:
+
+    upserts = {path: row for (path, row) in new_rows.items() if old_rows.get(path, None) != row}
+    deletions = [path for path in old_rows if path not in new_rows]
+    return (upserts, deletions)
+
+
+def _get_prefix_bounds(path_prefix: str) -> Tuple[str, str]:
+    # every descendant of `prefix` sorts between `prefix/` and `prefix0` ('0' follows '/')
+    return (f'{path_prefix}/', f'{path_prefix}0')
+
+
+class ManifestStore:
+    def __init__(self, target_dir_path: Path):
+        self._target_dir_path = target_dir_path
+        self._connection = sqlite3.connect(str(target_dir_path / constants.MANIFEST_DB_RELPATH))
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        schema_version: int = self._connection.execute('PRAGMA user_version').fetchone()[0]
+        if schema_version > _SCHEMA_VERSION:
+            self._connection.close()
+            raise click.ClickException(
+                f'The manifest at `{target_dir_path / constants.MANIFEST_DB_RELPATH}` was written by a newer version of '
+                'SourceDrive. Upgrade SourceDrive to use this repository.'
+            )
+        with self._connection:
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, id TEXT NOT NULL, metadata TEXT NOT NULL)'
+            )
+            self._connection.execute('CREATE INDEX IF NOT EXISTS files_id ON files (id)')
+            self._connection.execute('CREATE TABLE IF NOT EXISTS pulled (path TEXT PRIMARY KEY, entry TEXT NOT NULL)')
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS hashes (path TEXT PRIMARY KEY, size INTEGER, mtime INTEGER, inode INTEGER, md5 TEXT)'
+            )
+            self._connection.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)')
+            if schema_version < _SCHEMA_VERSION: # unversioned databases already hold the version 1 tables
+                self._connection.execute(f'PRAGMA user_version = {_SCHEMA_VERSION}')
+        self._migrate_json_manifests()
+
+    def _migrate_json_manifests(self) -> None:
+        drive_files_path = self._target_dir_path / constants.DRIVE_FILES_RELPATH
+        if drive_files_path.exists():
+            with drive_files_path.open('r') as drive_files_file:
+                data: Dict[str, Any] = json.load(drive_files_file)
+            # unversioned manifests hold full file resources keyed by path
+            self.update_files(data['files'] if 'version' in data else data, [])
+            drive_files_path.rename(drive_files_path.with_name(drive_files_path.name + '.migrated'))
+        pull_manifest_path = self._target_dir_path / constants.PULL_MANIFEST_RELPATH
+        if pull_manifest_path.exists():
+            with pull_manifest_path.open('r') as pull_manifest_file:
+                self.update_pulled(json.load(pull_manifest_file), [])
+            pull_manifest_path.rename(pull_manifest_path.with_name(pull_manifest_path.name + '.migrated'))
+
+    def get_files(self, path_prefix: str = '') -> Dict[str, Dict[str, Any]]:
+        lower_bound, upper_bound = _get_prefix_bounds(path_prefix)
+        rows = self._connection.execute(
+            'SELECT path, metadata FROM files WHERE path = ? OR (path >= ? AND path < ?)',
+            (path_prefix, lower_bound, upper_bound)
+        )
+        return {path: json.loads(metadata) for (path, metadata) in rows}
+
+    def get_file_by_id(self, file_id: str) -> Optional[Tuple[str, Dict[str, Any]]]:
+        row = self._connection.execute('SELECT path, metadata FROM files WHERE id = ?', (file_id,)).fetchone()
+        return None if row is None else (row[0], json.loads(row[1]))
+
+    def update_files(self, upserts: Dict[str, Dict[str, Any]], deletions: Iterable[str]) -> None:
+        with self._connection:
+            self._connection.executemany('DELETE FROM files WHERE path = ?', ((path,) for path in deletions))
+            self._connection.executemany(
+                'INSERT OR REPLACE INTO files VALUES (?, ?, ?)',
+                ((path, metadata['id'], json.dumps(cull_metadata(metadata))) for (path, metadata) in upserts.items())
+            )
+
+    def get_pulled(self, path_prefix: str = '') -> Dict[str, Dict[str, Any]]:
+        lower_bound, upper_bound = _get_prefix_bounds(path_prefix)
+        rows = self._connection.execute(
+            'SELECT path, entry FROM pulled WHERE path = ? OR (path >= ? AND path < ?)',
+            (path_prefix, lower_bound, upper_bound)
+        )
+        return {path: json.loads(entry) for (path, entry) in rows}
+
+    def update_pulled(self, upserts: Dict[str, Dict[str, Any]], deletions: Iterable[str]) -> None:
+        with self._connection:
+            self._connection.executemany('DELETE FROM pulled WHERE path = ?', ((path,) for path in deletions))
+            self._connection.executemany(
+                'INSERT OR REPLACE INTO pulled VALUES (?, ?)',
+                ((path, json.dumps(entry)) for (path, entry) in upserts.items())
+            )
+
+    def get_hashes(self) -> Dict[str, Tuple[Tuple[int, int, int], str]]:
+        # local md5s keyed by path, valid while the file's (size, mtime, inode) is unchanged
+        rows = self._connection.execute('SELECT path, size, mtime, inode, md5 FROM hashes')
+        return {path: ((size, mtime, inode), md5) for (path, size, mtime, inode, md5) in rows}
+
+    def update_hashes(self, upserts: Dict[str, Tuple[Tuple[int, int, int], str]], deletions: Iterable[str]) -> None:
+        with self._connection:
+            self._connection.executemany('DELETE FROM hashes WHERE path = ?', ((path,) for path in deletions))
+            self._connection.executemany(
+                'INSERT OR REPLACE INTO hashes VALUES (?, ?, ?, ?, ?)',
+                ((path, *file_stat, md5) for (path, (file_stat, md5)) in upserts.items())
+            )
+
+    def get_page_token(self) -> Optional[str]:
+        # the changes feed position the files table is current as of
+        row = self._connection.execute('SELECT value FROM meta WHERE key = ?', ('page_token',)).fetchone()
+        return None if row is None else row[0]
+
+    def update_page_token(self, page_token: str) -> None:
+        with self._connection:
+            self._connection.execute('INSERT OR REPLACE INTO meta VALUES (?, ?)', ('page_token', page_token))
+
+    def close(self) -> None:
+        self._connection.close()
@@ -0,0 +1,62 @@
+from typing import Dict, Iterator, List, Optional
+import click
+from pydrive.files import GoogleDriveFile
+
+
+class DriveNode:
+    __slots__ = ('name', 'drive_file', 'parent', 'children', 'is_dir', 'is_populated', '_path')
+
+    def __init__(
+            self,
+            name: str,
+            drive_file: GoogleDriveFile,
+            parent: Optional['DriveNode'] = None,
+            is_dir: bool = True
+        ):
+
+        self.name = name
+        self.drive_file = drive_file
+        self.parent = parent
+        self.children: Dict[str, DriveNode] = {}
+        self.is_dir = is_dir
+        self.is_populated = False
+        self._path: Optional[str] = None
+
+    @property
+    def path(self) -> str:
+        if self._path is None:
+            self._path = '' if self.parent is None else f'{self.parent.path}/{self.name}'
+        return self._path
+
+    def add_child(self, name: str, drive_file: GoogleDriveFile, is_dir: bool) -> 'DriveNode':
+        child = DriveNode(name, drive_file, self, is_dir)
+        self.children[name] = child
+        return child
+
+    def get_child_dir(self, name: str) -> Optional['DriveNode']:
+        child = self.children.get(name, None)
+        return child if child is not None and child.is_dir else None
+
+    def sub_dirs(self) -> List['DriveNode']:
+        return [child for child in self.children.values() if child.is_dir]
+
+    def clear(self) -> None:
+        self.children = {}
+        self.is_populated = False
+
+    def walk(self) -> Iterator['DriveNode']:
+        for child in self.children.values():
+            yield child
+            if child.is_dir:
+                yield from child.walk()
+
+
+def render_tree(node: DriveNode, max_levels: Optional[int] = None, levels: List[bool] = None) -> None:
+    levels = levels or []
+    entries = sorted(node.children.values(), key=lambda child: (not child.is_dir, child.name.lower()))
+    for i, child in enumerate(entries):
+        is_last_entry = i == len(entries) - 1
+        prefix = ''.join('    ' if last else '│   ' for last in levels) + ('└──' if is_last_entry else '├──')
+        click.echo(f'{prefix} {click.style(child.name, fg="blue", bold=True) if child.is_dir else child.name}')
+        if child.is_dir and (max_levels is None or len(levels) < max_levels):
+            render_tree(child, max_levels, levels + [is_last_entry])
@@ -0,0 +1,39 @@
+import hashlib
+import shutil
+from pathlib import Path
+from typing import Dict, Any, Optional, Iterable
+from content_store import materialise_file
+
+
+def _get_revision(metadata: Dict[str, Any]) -> str:
+    return str(metadata.get('version', None) or metadata.get('modifiedDate', ''))
+
+
+class ExportCache:
+    # exports are stored as `<id>/<revision>-<mimetype hash>`, so each document's stale revisions can be pruned together
+    def __init__(self, cache_path: Path, dedup_mode: str):
+        self._cache_path = cache_path
+        self._dedup_mode = dedup_mode
+
+    def _get_export_path(self, metadata: Dict[str, Any], export_mimetype: str) -> Path:
+        mimetype_key = hashlib.md5(export_mimetype.encode()).hexdigest()[:12]
+        return self._cache_path / metadata['id'] / f'{_get_revision(metadata)}-{mimetype_key}'
+
+    def get(self, metadata: Dict[str, Any], export_mimetype: str) -> Optional[Path]:
+        export_path = self._get_export_path(metadata, export_mimetype)
+        return export_path if export_path.exists() else None
+
+    def add(self, metadata: Dict[str, Any], export_mimetype: str, file_path: Path) -> None:
+        materialise_file(file_path, self._get_export_path(metadata, export_mimetype), self._dedup_mode)
+
+    def prune(self, drive_files: Iterable[Dict[str, Any]]) -> None:
+        revisions = {metadata['id']: _get_revision(metadata) for metadata in drive_files}
+        if not self._cache_path.exists():
+            return
+        for file_dir_path in self._cache_path.iterdir():
+            if file_dir_path.name not in revisions:
+                shutil.rmtree(file_dir_path, ignore_errors=True)
+                continue
+            for export_path in file_dir_path.iterdir():
+                if export_path.name.rsplit('-', 1)[0] != revisions[file_dir_path.name]:
+                    export_path.unlink(missing_ok=True)
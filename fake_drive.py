@@ -0,0 +1,273 @@
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+import urllib.parse
+from typing import Dict, Any, List, Optional, Tuple
+import httplib2
+from googleapiclient.errors import HttpError
+import constants
+
+
+_RATE_LIMIT_ERROR_CONTENT = json.dumps(
+    {'error': {'code': 403, 'errors': [{'reason': 'rateLimitExceeded'}], 'message': 'Rate Limit Exceeded'}}
+).encode()
+
+
+class FakeDriveTree:
+    def __init__(
+            self,
+            depth: int,
+            fan_out: int,
+            files_per_dir: int,
+            file_size: int,
+            native_ratio: float = 0.0,
+            seed: int = 0
+        ):
+
+        self.files: Dict[str, Dict[str, Any]] = {}
+        self.children: Dict[str, List[str]] = {'root': []}
+        self.contents: Dict[str, bytes] = {} # uploaded files, which replace the generated content
+        self.change_log: List[str] = [] # IDs of files added or written, in order; page tokens index into it
+        self._random = random.Random(seed)
+        self._file_size = file_size
+        self._build('root', depth, fan_out, files_per_dir, native_ratio)
+
+    def add(self, parent_id: str, title: str, mimetype: str) -> str:
+        file_id = f'fake{len(self.files):08d}'
+        metadata = {
+            'id': file_id,
+            'title': title,
+            'mimeType': mimetype,
+            'parents': [{'id': parent_id, 'isRoot': parent_id == 'root'}],
+            'modifiedDate': '2020-01-01T00:00:00.000Z',
+            'version': '1'
+        }
+        if mimetype == 'application/octet-stream':
+            metadata['fileSize'] = str(self._file_size)
+            metadata['md5Checksum'] = hashlib.md5(get_fake_content(file_id, self._file_size)).hexdigest()
+        self.files[file_id] = metadata
+        self.children.setdefault(parent_id, []).append(file_id)
+        self.change_log.append(file_id)
+        return file_id
+
+    def write(self, file_id: str, content: bytes) -> None:
+        metadata = self.files[file_id]
+        metadata['fileSize'] = str(len(content))
+        metadata['md5Checksum'] = hashlib.md5(content).hexdigest()
+        metadata['version'] = str(int(metadata['version']) + 1)
+        metadata['modifiedDate'] = time.strftime('%Y-%m-%dT%H:%M:%S.000Z', time.gmtime())
+        self.contents[file_id] = content
+        self.change_log.append(file_id)
+
+    def _build(self, parent_id: str, depth: int, fan_out: int, files_per_dir: int, native_ratio: float) -> None:
+        for i in range(files_per_dir):
+            if self._random.random() < native_ratio:
+                self.add(parent_id, f'doc{i}', 'application/vnd.google-apps.document')
+            else:
+                self.add(parent_id, f'file{i}.bin', 'application/octet-stream')
+        if depth == 0:
+            return
+        for i in range(fan_out):
+            folder_id = self.add(parent_id, f'folder{i}', constants.FOLDER_MIMETYPE)
+            self._build(folder_id, depth - 1, fan_out, files_per_dir, native_ratio)
+
+
+def get_fake_content(file_id: str, size: int) -> bytes:
+    pattern = f'{file_id}:'.encode()
+    return (pattern * (size // len(pattern) + 1))[:size]
+
+
+class FakeDriveService:
+    def __init__(self, tree: FakeDriveTree, latency: float = 0.0, error_rate: float = 0.0, account_id: str = 'fake-account'):
+        self.tree = tree
+        self.account_id = account_id
+        self.latency = latency
+        self.error_rate = error_rate
+        self.request_counts: Dict[str, int] = {}
+        self.upload_sessions: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        self._random = random.Random(0)
+
+    def record_request(self, kind: str) -> None:
+        with self._lock:
+            self.request_counts[kind] = self.request_counts.get(kind, 0) + 1
+            is_throttled = self._random.random() < self.error_rate
+        time.sleep(self.latency)
+        if is_throttled:
+            raise HttpError(httplib2.Response({'status': 403}), _RATE_LIMIT_ERROR_CONTENT)
+
+    def files(self) -> '_FakeFilesResource':
+        return _FakeFilesResource(self)
+
+    def changes(self) -> '_FakeChangesResource':
+        return _FakeChangesResource(self)
+
+    def about(self) -> '_FakeAboutResource':
+        return _FakeAboutResource(self)
+
+
+class _FakeRequest:
+    def __init__(self, service: FakeDriveService, kind: str, response: Any):
+        self._service = service
+        self._kind = kind
+        self._response = response
+
+    def execute(self, http: Optional[httplib2.Http] = None) -> Any:
+        self._service.record_request(self._kind)
+        return self._response() if callable(self._response) else self._response
+
+
+class _FakeFilesResource:
+    def __init__(self, service: FakeDriveService):
+        self._service = service
+
+    def list(self, q: str, maxResults: int = 100, pageToken: Optional[str] = None, **kwargs: Any) -> _FakeRequest:
+        def respond() -> Dict[str, Any]:
+            parent_ids = re.findall(r"'([^']+)' in parents", q)
+            if parent_ids:
+                file_ids = [file_id for parent_id in parent_ids for file_id in self._service.tree.children.get(parent_id, [])]
+            else:
+                file_ids = list(self._service.tree.files)
+            title = re.search(r"title contains '((?:[^'\\]|\\.)*)'", q)
+            if title:
+                file_ids = [
+                    file_id for file_id in file_ids
+                    if title.group(1).replace('\\', '').lower() in self._service.tree.files[file_id]['title'].lower()
+                ]
+            start = int(pageToken or 0)
+            response: Dict[str, Any] = {
+                'items': [self._service.tree.files[file_id] for file_id in file_ids[start:start + maxResults]]
+            }
+            if start + maxResults < len(file_ids):
+                response['nextPageToken'] = str(start + maxResults)
+            return response
+        return _FakeRequest(self._service, 'files.list', respond)
+
+    def get(self, fileId: str, **kwargs: Any) -> _FakeRequest:
+        def respond() -> Dict[str, Any]:
+            if fileId not in self._service.tree.files:
+                raise HttpError(httplib2.Response({'status': 404}), b'')
+            return self._service.tree.files[fileId]
+        return _FakeRequest(self._service, 'files.get', respond)
+
+    def insert(self, body: Dict[str, Any], **kwargs: Any) -> _FakeRequest:
+        def respond() -> Dict[str, Any]:
+            tree = self._service.tree
+            with self._service._lock:
+                return tree.files[tree.add(body['parents'][0]['id'], body['title'], body['mimeType'])]
+        return _FakeRequest(self._service, 'files.insert', respond)
+
+
+class _FakeChangesResource:
+    def __init__(self, service: FakeDriveService):
+        self._service = service
+
+    def getStartPageToken(self, **kwargs: Any) -> _FakeRequest:
+        return _FakeRequest(
+            self._service, 'changes.getStartPageToken', lambda: {'startPageToken': str(len(self._service.tree.change_log))}
+        )
+
+    def list(self, pageToken: str, **kwargs: Any) -> _FakeRequest:
+        def respond() -> Dict[str, Any]:
+            tree = self._service.tree
+            change_log = list(tree.change_log)
+            return {
+                'items': [{'fileId': file_id, 'file': dict(tree.files[file_id])} for file_id in change_log[int(pageToken):]],
+                'newStartPageToken': str(len(change_log))
+            }
+        return _FakeRequest(self._service, 'changes.list', respond)
+
+
+class _FakeAboutResource:
+    def __init__(self, service: FakeDriveService):
+        self._service = service
+
+    def get(self, **kwargs: Any) -> _FakeRequest:
+        return _FakeRequest(self._service, 'about.get', lambda: {'user': {'permissionId': self._service.account_id}})
+
+
+class FakeHttp:
+    def __init__(self, service: FakeDriveService):
+        self._service = service
+
+    def request(self, uri: str, method: str = 'GET', body: Any = None, headers: Dict[str, str] = None, **kwargs: Any) -> Tuple[httplib2.Response, bytes]:
+        url = urllib.parse.urlparse(uri)
+        try:
+            self._service.record_request('upload' if url.path.startswith('/upload/') else 'media')
+        except HttpError:
+            return (httplib2.Response({'status': 429}), b'')
+        if url.path.startswith('/upload/'):
+            return self._request_upload(url, method, body, headers or {})
+        file_id = url.path.split('/')[4]
+        metadata = self._service.tree.files.get(file_id, None)
+        if metadata is None:
+            return (httplib2.Response({'status': 404}), b'')
+        if url.path.endswith('/export'):
+            return (httplib2.Response({'status': 200}), get_fake_content(file_id, self._service.tree._file_size))
+        content = self._service.tree.contents.get(file_id, None) or get_fake_content(file_id, int(metadata['fileSize']))
+        byte_range = re.match(r'bytes=(\d+)-(\d+)', (headers or {}).get('Range', ''))
+        if byte_range is None:
+            return (httplib2.Response({'status': 200}), content)
+        start, end = int(byte_range.group(1)), int(byte_range.group(2))
+        if start >= len(content):
+            return (httplib2.Response({'status': 416}), b'')
+        chunk = content[start:end + 1]
+        return (
+            httplib2.Response({'status': 206, 'content-range': f'bytes {start}-{start + len(chunk) - 1}/{len(content)}'}),
+            chunk
+        )
+
+
+    def _request_upload(self, url: urllib.parse.ParseResult, method: str, body: Any, headers: Dict[str, str]) -> Tuple[httplib2.Response, bytes]:
+        sessions = self._service.upload_sessions
+        if url.path.startswith('/upload/session/'):
+            session = sessions.get(url.path.rsplit('/', 1)[-1], None)
+            if session is None:
+                return (httplib2.Response({'status': 404}), b'')
+            content_range = re.match(r'bytes (?:(\d+)-\d+|\*)/(\d+)', headers.get('Content-Range', ''))
+            if body and content_range and content_range.group(1) is not None:
+                del session['data'][int(content_range.group(1)):]
+                session['data'] += body
+            if len(session['data']) < session['size']:
+                received = {'range': f'bytes=0-{len(session["data"]) - 1}'} if session['data'] else {}
+                return (httplib2.Response({'status': 308, **received}), b'')
+            tree = self._service.tree
+            with self._service._lock:
+                file_id = session['file_id'] or tree.add(
+                    session['metadata']['parents'][0]['id'], session['metadata']['title'], 'application/octet-stream'
+                )
+                tree.files[file_id]['mimeType'] = session['metadata'].get('mimeType', tree.files[file_id]['mimeType'])
+                tree.write(file_id, bytes(session['data']))
+                return (httplib2.Response({'status': 200}), json.dumps(tree.files[file_id]).encode())
+
+        # starting a session: POST creates a file, PUT adds a revision to an existing one
+        path_parts = url.path.split('/')
+        file_id = path_parts[5] if method == 'PUT' else None
+        if file_id is not None and file_id not in self._service.tree.files:
+            return (httplib2.Response({'status': 404}), b'')
+        with self._service._lock:
+            session_id = str(len(sessions))
+            sessions[session_id] = {
+                'file_id': file_id,
+                'metadata': json.loads(body or '{}'),
+                'size': int(headers['X-Upload-Content-Length']),
+                'data': bytearray()
+            }
+        return (httplib2.Response({'status': 200, 'location': f'https://fake.invalid/upload/session/{session_id}'}), b'')
+
+
+class FakeAuth:
+    def __init__(self, service: FakeDriveService):
+        self.service = service
+
+    def Get_Http_Object(self) -> FakeHttp:
+        return FakeHttp(self.service)
+
+
+class FakeDrive:
+    # stands in for pydrive's GoogleDrive wherever only `drive.auth` is used
+    def __init__(self, service: FakeDriveService):
+        self.auth = FakeAuth(service)
@@ -1,27 +1,39 @@
 import constants
 from pathlib import Path
+import re
 import shlex
-from typing import Dict, Any, Tuple
+from typing import Dict, Any, List, Optional, Set, Tuple
 import click
 from click.core import Context
 from click.formatting import HelpFormatter
 from click.exceptions import UsageError
 import copy
-import fs.tree
-from fs.base import FS
-from fs.tempfs import TempFS
-from fs.subfs import SubFS
-from pydrive.drive import GoogleDrive
-from pydrive.files import GoogleDriveFile
-from gdrive_utils import get_drive_instance, generate_files, dir_dive, dir_enumerate
-from utils import get_input, get_sub_dir_path, no_stdout
+from gdrive_utils import generate_files, dir_dive, dir_enumerate, refresh_dir, create_root_dir
+from drive_data_manager import DriveDataManager
+from drive_client import set_request_scheduler, get_drive_instance, get_account_id
+from request_scheduler import create_request_scheduler
+from listing_cache import ListingCache
+from drive_tree import DriveNode, render_tree
+from drive_manifest import ManifestStore, cull_metadata
+from search_index import SearchIndex, SearchHit, search_drive
+from utils import get_input, update_sdr_config, no_stdout
+import stats
+from pull_filter import PullFilter, filter_options
+import json
 
 
-drive: GoogleDrive
-root_dir: TempFS
-previous_dir: SubFS[FS]
-current_dir: SubFS[FS]
-drive_files: Dict[str, GoogleDriveFile] = {}
+ddm: DriveDataManager
+root_dir: DriveNode
+previous_dir: DriveNode
+current_dir: DriveNode
+pull_filter: PullFilter
+export_defaults: Dict[str, str]
+search_index: Optional[SearchIndex] = None
+manifest_store: Optional[ManifestStore] = None
+manifest_base_path = ''
+indexed_manifest_prefixes: Set[str] = set()
+search_hits: List[SearchHit] = []
+start_page_token: Optional[str] = None
 
 
 class ReplExitSignal(Exception):
@@ -53,19 +65,98 @@ def _parentless(context: Context) -> Context:
     return ctx
 
 
-def run_repl(target_dir_path: Path) -> Tuple[str, Dict[str, Dict[str, Any]]]:
-    global drive, root_dir, current_dir, previous_dir, drive_files
-    with no_stdout():
-        drive = get_drive_instance()
-    temp_dir_path = (target_dir_path / constants.TEMP_DIR_RELPATH)
-    temp_dir_path.mkdir()
-    root_dir = TempFS(temp_dir=str(temp_dir_path.resolve()))
-    current_dir = root_dir.makedir('~')
-    drive_files[current_dir._sub_dir] = GoogleDriveFile(metadata={'id': 'root'})
-    generate_files(current_dir, drive, drive_files)
+def _echo_hits(hits: List[SearchHit], start: int) -> None:
+    for i, hit in enumerate(hits, start + 1):
+        click.echo(f'@{i} {click.style(hit.path, fg="blue", bold=True) if hit.is_dir else hit.path}')
+
+
+def _update_search_index() -> SearchIndex:
+    global search_index
+    # listings fetched since the last search are added to what was already indexed
+    for path, drive_file in ddm.drive_files.items():
+        search_index.add(path, drive_file.metadata)
+    search_index.mark_listed(node.drive_file['id'] for node in root_dir.walk() if node.is_dir and node.is_populated)
+    return search_index
+
+
+def _index_manifest_subtree(dir: DriveNode) -> None:
+    # folders under the repository's chosen folder are in its manifest, so their subtree is searchable without listing it
+    if manifest_store is None or not (dir.path == manifest_base_path or dir.path.startswith(f'{manifest_base_path}/')):
+        return
+    path_prefix = dir.path[len(manifest_base_path):]
+    if any(path_prefix == prefix or path_prefix.startswith(f'{prefix}/') for prefix in indexed_manifest_prefixes):
+        return
+    search_index.add_files(manifest_store.get_files(path_prefix), manifest_base_path)
+    indexed_manifest_prefixes.add(path_prefix)
+
+
+def _close_manifest_store() -> None:
+    global manifest_store
+    if manifest_store is not None:
+        manifest_store.close()
+        manifest_store = None
+
+
+def _resolve_hit_reference(dir: Optional[str]) -> Optional[str]:
+    # `@N` names the Nth hit of the last search: the folder itself, or the folder holding a file
+    reference = re.fullmatch(r'@(\d+)', dir or '')
+    if reference is None:
+        return dir
+    hit_number = int(reference.group(1))
+    if not 1 <= hit_number <= len(search_hits):
+        raise UsageError(f'No search result `@{hit_number}`. Run `find` first.')
+    hit = search_hits[hit_number - 1]
+    return hit.path if hit.is_dir else hit.path.rsplit('/', 1)[0]
+
+
+def run_repl(target_dir_path: Path) -> Tuple[str, str, Dict[str, Dict[str, Any]], Optional[str]]:
+    """
+    Returns the chosen folder's path and ID, its culled listing, and the changes feed token taken before it was listed.
+    """
+    global ddm, root_dir, current_dir, previous_dir, pull_filter, export_defaults, search_index, manifest_store, manifest_base_path
+    with (target_dir_path / constants.SDR_CONFIG_RELPATH).open('r') as sdr_config_file:
+        sdr_config: Dict[str, Any] = json.load(sdr_config_file)
+    set_request_scheduler(create_request_scheduler(sdr_config))
+    pull_filter = PullFilter.from_config(sdr_config)
+    export_defaults = sdr_config['export_types']
+    with stats.phase('auth'), no_stdout():
+        drive = get_drive_instance(target_dir_path)
+    # the listing cache is shared between repositories, but only those signed in to the same account
+    ddm = DriveDataManager(
+        ListingCache(
+            constants.LISTING_CACHE_PATH,
+            get_account_id(drive),
+            sdr_config.get(constants.LISTING_CACHE_TTL_KEY, constants.DEFAULT_LISTING_CACHE_TTL),
+            sdr_config.get(constants.LISTING_CACHE_MAX_ENTRIES_KEY, constants.DEFAULT_LISTING_CACHE_MAX_ENTRIES)
+        ),
+        sdr_config.get(constants.PREFETCH_DEPTH_KEY, constants.DEFAULT_PREFETCH_DEPTH),
+        sdr_config.get(constants.PREFETCH_BUDGET_KEY, constants.DEFAULT_PREFETCH_BUDGET),
+        drive,
+        target_dir_path,
+        export_defaults
+    )
+    root_dir = create_root_dir(ddm.drive_files)
+    current_dir = root_dir.children['~']
+    generate_files(current_dir, ddm)
     previous_dir = current_dir
 
+    # searches start from whatever earlier sessions listed, plus the repository's own manifest
+    search_index = SearchIndex()
+    if ddm.listing_cache:
+        search_index.add_listings(ddm.listing_cache.get_all(), 'root', current_dir.path, export_defaults)
+    indexed_manifest_prefixes.clear()
+    if constants.CHOSEN_GDRIVE_DIR_PATH_KEY in sdr_config:
+        manifest_store = ManifestStore(target_dir_path)
+        manifest_base_path = sdr_config[constants.CHOSEN_GDRIVE_DIR_PATH_KEY]
+        _index_manifest_subtree(current_dir)
+
     while True:
+        if ddm.prefetcher: # list the likely next targets while waiting for input
+            ddm.prefetcher.prefetch([
+                dir.drive_file['id'] 
+                for dir in current_dir.sub_dirs() + previous_dir.sub_dirs() 
+                if not dir.is_populated
+            ])
         user_input = get_input()
         user_args = shlex.split(user_input)
         before_dir = current_dir
@@ -75,26 +166,27 @@ def run_repl(target_dir_path: Path) -> Tuple[str, Dict[str, Dict[str, Any]]]:
         except SystemExit:
             pass
         except ReplExitSignal:
-            return ''
+            _close_manifest_store()
+            ddm.close()
+            return ('', '', {}, None)
         except ReplFinishSignal:
             break
         
         if before_dir != current_dir:
             previous_dir = before_dir
 
-    chosen_dir = get_sub_dir_path(current_dir)
-    data = { # TODO: cull data we don't need
-        (key[len(chosen_dir):]) : value.metadata
-        for (key, value) in drive_files.items() 
-        if chosen_dir in key 
-           and chosen_dir != key
-           and value['mimeType'] != constants.FOLDER_MIMETYPE
+    chosen_dir = current_dir.path
+    data = {
+        (node.path[len(chosen_dir):]) : cull_metadata(node.drive_file.metadata)
+        for node in current_dir.walk()
+        if pull_filter.matches(node.path[len(chosen_dir):], node.drive_file.metadata)
     }
 
-    root_dir.close()
-    temp_dir_path.rmdir()
+    _close_manifest_store()
+    ddm.close()
+    update_sdr_config(target_dir_path, {constants.PULL_FILTERS_KEY: pull_filter.to_config()})
 
-    return (chosen_dir, data)
+    return (chosen_dir, current_dir.drive_file['id'], data, start_page_token)
 
 
 @click.group(cls=ReplGroup)
@@ -105,26 +197,39 @@ def repl():
 @repl.command()
 def pwd() -> None:
     global current_dir
-    click.echo(get_sub_dir_path(current_dir))
+    click.echo(current_dir.path)
 
 
 @repl.command(cls=ReplCommand)
 @click.argument('dir', required=False)
 @click.option('-r', '--recursive', 'is_recursive', is_flag=True)
 def ls(dir: str, is_recursive: bool) -> None:
-    global current_dir, previous_dir, root_dir, drive_files, drive
+    global current_dir, previous_dir, root_dir, ddm
+    dir = _resolve_hit_reference(dir)
     target_dir = current_dir
-    target_dir = dir_dive(current_dir, previous_dir, root_dir, drive, drive_files, dir)
+    target_dir = dir_dive(current_dir, previous_dir, root_dir, ddm, dir)
     if dir and target_dir == current_dir:
         return
-    fs.tree.render(target_dir, max_levels=(None if is_recursive else 0))
+    render_tree(target_dir, max_levels=(None if is_recursive else 0))
     
 
 @repl.command(cls=ReplCommand)
 @click.argument('dir', required=True)
 def cd(dir: str) -> None:
-    global current_dir, previous_dir, root_dir, drive_files, drive
-    current_dir = dir_dive(current_dir, previous_dir, root_dir, drive, drive_files, dir)
+    global current_dir, previous_dir, root_dir, ddm
+    current_dir = dir_dive(current_dir, previous_dir, root_dir, ddm, _resolve_hit_reference(dir))
+    _index_manifest_subtree(current_dir)
+
+
+@repl.command(cls=ReplCommand)
+@click.argument('dir', required=False)
+def refresh(dir: str) -> None:
+    global current_dir, previous_dir, root_dir, ddm
+    dir = _resolve_hit_reference(dir)
+    target_dir = dir_dive(current_dir, previous_dir, root_dir, ddm, dir)
+    if dir and target_dir == current_dir:
+        return
+    refresh_dir(target_dir, ddm)
 
 
 @repl.command(cls=ReplCommand)
@@ -134,11 +239,64 @@ def exit() -> None:
 
 @repl.command(cls=ReplCommand)
 @click.argument('dir', required=False)
-def select(dir: str) -> None:
-    global current_dir, previous_dir, root_dir, drive_files, drive
-    if not dir_enumerate(current_dir, previous_dir, root_dir, drive, drive_files, dir):
+@click.option('--full-scan', 'full_scan', is_flag=True)
+@filter_options
+def select(
+        dir: str,
+        full_scan: bool,
+        include: Tuple[str, ...],
+        exclude: Tuple[str, ...],
+        mimetypes: Tuple[str, ...],
+        exclude_mimetypes: Tuple[str, ...],
+        max_size: Optional[int],
+        is_filter_reset: bool
+    ) -> None:
+
+    global current_dir, previous_dir, root_dir, ddm, pull_filter, start_page_token
+    dir = _resolve_hit_reference(dir)
+    pull_filter = pull_filter.updated(include, exclude, mimetypes, exclude_mimetypes, max_size, is_filter_reset)
+    target_dir = dir_dive(current_dir, previous_dir, root_dir, ddm, dir)
+    if dir and target_dir == current_dir:
         click.echo('Aborting selection...')
         return
-    current_dir = dir_dive(current_dir, previous_dir, root_dir, drive, drive_files, dir)
+
+    # the first pull reads the changes feed from here, so everything selected is listed after this token was taken;
+    # listings from earlier in the session or from the listing cache could miss edits made before it. A prefetch still in
+    # flight could store such a listing after refresh_dir has dropped them, so it is waited for first
+    if ddm.prefetcher:
+        ddm.prefetcher.close()
+    start_page_token = ddm.client.run(ddm.client.get_start_page_token())
+    refresh_dir(target_dir, ddm)
+    dir_enumerate(target_dir, previous_dir, root_dir, ddm, '', full_scan, pull_filter, is_fresh=True)
+    current_dir = target_dir
     raise ReplFinishSignal()
-    
\ No newline at end of file
+
+
+@repl.command(cls=ReplCommand)
+@click.argument('query', nargs=-1, required=True)
+@click.option('-n', '--limit', default=constants.SEARCH_RESULT_LIMIT, show_default=True, type=click.IntRange(min=1))
+@click.option('--local', 'is_local', is_flag=True, help='Only search folders that have already been listed')
+def find(query: Tuple[str, ...], limit: int, is_local: bool) -> None:
+    """
+    Find files and folders whose name contains QUERY (or whose path does, if QUERY contains `/`).
+    Go to a result with `cd @N`, or select it with `select @N`.
+    """
+    global search_hits, root_dir, ddm, export_defaults
+    query_text = ' '.join(query)
+    index = _update_search_index()
+    search_hits = index.search(query_text, limit)
+    _echo_hits(search_hits, 0)
+
+    # folders nobody has listed yet can only be searched on Drive
+    if not is_local and len(search_hits) < limit and not index.is_complete:
+        click.echo('Searching Google Drive...')
+        remote_hits = ddm.client.run(search_drive(
+            ddm.client, query_text, index, root_dir.children['~'].path, export_defaults, limit - len(search_hits)
+        ))
+        _echo_hits(remote_hits, len(search_hits))
+        search_hits = search_hits + remote_hits
+    if not search_hits:
+        click.echo('No matches.')
+
+
+repl.add_command(find, name='search')
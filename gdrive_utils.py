@@ -1,98 +1,81 @@
-from utils import get_sub_dir_path, sanitise_fname
-from fs.subfs import SubFS
-from typing import List, Dict
-from fs.tempfs import TempFS
-from fs.base import FS
-from pydrive.auth import GoogleAuth
+from utils import sanitise_fname, get_export_extension
+from typing import List, Dict, Any, Optional
 from pydrive.drive import GoogleDrive
 from pydrive.files import GoogleDriveFile
 import constants
-import json
-from pathlib import Path
 import click
-from fs.errors import DirectoryExpected
 import os
+import asyncio
+from drive_client import index_by_parent
+from drive_data_manager import DriveDataManager
+from drive_tree import DriveNode
+from pull_filter import PullFilter
+import stats
 
 
-def _build_virtual_file(parent_dir: SubFS[TempFS], drive_file: GoogleDriveFile, ext: str) -> Dict[str, str]:
+def _build_virtual_file(parent_dir: DriveNode, drive_file: GoogleDriveFile, ext: str) -> Dict[str, GoogleDriveFile]:
     df_meta = drive_file.metadata
     file_name: str = df_meta['title']
     file_name = sanitise_fname(file_name)
-    if df_meta['mimeType'] == constants.FOLDER_MIMETYPE:
-        parent_dir.makedir(file_name)
-    else:
-        parent_dir.touch(f'{file_name}{ext}')
-    return {f'{get_sub_dir_path(parent_dir)}/{file_name}{ext}': drive_file}
-
-
-def _get_export_extension(file_mimetype: str, file_export_format_defaults: Dict[str, str]) -> str:
-    if file_mimetype == constants.FOLDER_MIMETYPE:
-        return ''
-    export_extension = (constants.DRIVE_EXPORT_MIMETYPES 
-        .get(file_mimetype, {}) 
-        .get('exports', {}) 
-        .get(file_export_format_defaults.get(file_mimetype, None), ''))
-    return (f'.{export_extension}' if export_extension else '')
+    node = parent_dir.add_child(
+        f'{file_name}{ext}', drive_file, is_dir=(df_meta['mimeType'] == constants.FOLDER_MIMETYPE)
+    )
+    return {node.path: drive_file}
 
 
 def _populate_dir_if_empty(
-        parent_dir: SubFS[FS], 
-        drive: GoogleDrive, 
-        drive_files: Dict[str, GoogleDriveFile]
+        parent_dir: DriveNode, 
+        ddm: DriveDataManager
     ) -> None:
 
-    if parent_dir.isempty('/'):
-        generate_files(parent_dir, drive, drive_files)
+    if not parent_dir.is_populated:
+        generate_files(parent_dir, ddm)
 
 
-def _safe_open_direct_child(parent_dir: SubFS[FS], target_sub_dir: str) -> SubFS[FS]:
-    children = [dir.name for dir in parent_dir.filterdir('/', exclude_files=['*'])]
-    if target_sub_dir in children: # ensure case sensistivity
-        return parent_dir.opendir(target_sub_dir)
-    raise DirectoryExpected(path='', msg=constants.DIRECTORY_EXPECTED_ERROR_MSG.format(target_sub_dir))
+def create_root_dir(drive_files: Dict[str, GoogleDriveFile]) -> DriveNode:
+    root_dir = DriveNode('', GoogleDriveFile(metadata={'id': None}))
+    root_dir.is_populated = True
+    home_dir = root_dir.add_child('~', GoogleDriveFile(metadata={'id': 'root'}), is_dir=True)
+    drive_files[home_dir.path] = home_dir.drive_file
+    return root_dir
 
 
-def get_drive_instance() -> GoogleDrive:
-    gauth = GoogleAuth(settings_file=constants.GAUTH_SETTINGS_RELPATH)
-    gauth.LocalWebserverAuth()
-    return GoogleDrive(gauth)
+def get_files_in_drive_dir(ddm: DriveDataManager, dir_drive_id: str) -> List[GoogleDriveFile]:
+    items = ddm.client.run(list_children_batched(ddm, [dir_drive_id]))[dir_drive_id]
+    return _as_drive_files(ddm.drive, items)
 
 
-def get_files_in_drive_dir(drive: GoogleDrive, dir_drive_id: str) -> List[GoogleDriveFile]:
-    query = constants.GDRIVE_QUERY.format(dir_drive_id)
-    return drive.ListFile({'q': query}).GetList()
+def add_drive_files_to_dir(
+        parent_dir: DriveNode,
+        files: List[GoogleDriveFile],
+        file_export_format_defaults: Dict[str, str]
+    ) -> Dict[str, GoogleDriveFile]:
 
-
-def add_drive_files_to_sub_fs(parent_dir: SubFS[TempFS], files: List[GoogleDriveFile]) -> Dict[str, str]:
     google_ids = {}
-    file_export_format_defaults: Dict[str, str] = {}
-    with Path(constants.SDR_CONFIG_RELPATH).open('r') as sdr_config_file:
-        file_export_format_defaults = json.load(sdr_config_file)['export_types']
     for file in files:
-        google_ids.update(_build_virtual_file(parent_dir, file, _get_export_extension(
+        google_ids.update(_build_virtual_file(parent_dir, file, get_export_extension(
             file.metadata['mimeType'], file_export_format_defaults)
         ))
+    parent_dir.is_populated = True
     return google_ids
 
 
 def generate_files(
-        parent_dir: SubFS[FS], 
-        drive: GoogleDrive, 
-        drive_files: Dict[str, GoogleDriveFile]
+        parent_dir: DriveNode, 
+        ddm: DriveDataManager
     ) -> None:
 
-    files = get_files_in_drive_dir(drive, drive_files[get_sub_dir_path(parent_dir)]['id'])
-    drive_files.update(add_drive_files_to_sub_fs(parent_dir, files))
+    files = get_files_in_drive_dir(ddm, parent_dir.drive_file['id'])
+    ddm.drive_files.update(add_drive_files_to_dir(parent_dir, files, ddm.export_defaults))
 
 
 def dir_dive(
-        start_dir: SubFS[FS], 
-        previous_dir: SubFS[FS], 
-        root_dir: FS, 
-        drive: GoogleDrive, 
-        drive_files: Dict[str, GoogleDriveFile], 
+        start_dir: DriveNode, 
+        previous_dir: DriveNode, 
+        root_dir: DriveNode, 
+        ddm: DriveDataManager, 
         target_dir_path: str
-    ) -> SubFS[FS]:
+    ) -> DriveNode:
 
     if not target_dir_path:
         return start_dir
@@ -108,7 +91,7 @@ def dir_dive(
     elif target_dir_path[0] == '~':
         if len(target_dir_path) > 1:
             if target_dir_path[1] == '/':
-                current_dir = root_dir.opendir('~')
+                current_dir = root_dir.children['~']
                 target_dir_path = target_dir_path[2:]
 
     target_dir_path = target_dir_path.rstrip(os.sep) 
@@ -122,47 +105,133 @@ def dir_dive(
         return start_dir
 
     while dir_path:
-        _populate_dir_if_empty(current_dir, drive, drive_files)
+        _populate_dir_if_empty(current_dir, ddm)
         target_sub_dir = dir_path[0]
         if target_sub_dir == '..':
-            try:
-                current_dir = current_dir._wrap_fs
-                del dir_path[0]
-                continue
-            except AttributeError:
+            if current_dir.parent is None:
                 click.echo(constants.INVALID_BACKREFERENCE_ERROR_MSG)
                 return start_dir
-        try:
-            current_dir = _safe_open_direct_child(current_dir, target_sub_dir)
-        except DirectoryExpected as de:
-            click.echo(de._msg)
+            current_dir = current_dir.parent
+            del dir_path[0]
+            continue
+        child_dir = current_dir.get_child_dir(target_sub_dir)
+        if child_dir is None:
+            click.echo(constants.DIRECTORY_EXPECTED_ERROR_MSG.format(target_sub_dir))
             return start_dir
+        current_dir = child_dir
         del dir_path[0]
-    _populate_dir_if_empty(current_dir, drive, drive_files)
+    _populate_dir_if_empty(current_dir, ddm)
 
     return current_dir
 
 
+def _as_drive_files(drive: GoogleDrive, items: List[Dict[str, Any]]) -> List[GoogleDriveFile]:
+    return [GoogleDriveFile(auth=drive.auth, metadata=item, uploaded=True) for item in items]
+
+
+async def list_children_batched(
+        ddm: DriveDataManager,
+        parent_ids: List[str],
+        children_index: Optional[Dict[str, List[Dict[str, Any]]]] = None,
+        query_clause: str = '',
+        is_fresh: bool = False
+    ) -> Dict[str, List[Dict[str, Any]]]:
+
+    if children_index is not None: # the whole corpus has already been listed
+        children = {parent_id: children_index.get(parent_id, []) for parent_id in parent_ids}
+        if ddm.listing_cache and not query_clause: # kept for later sessions and searches
+            ddm.listing_cache.put_many(children)
+        return children
+    children: Dict[str, List[Dict[str, Any]]] = {}
+    for parent_id in ([] if is_fresh else parent_ids): # fresh listings skip anything fetched earlier
+        cached_items = ddm.prefetcher.get(parent_id) if ddm.prefetcher else None
+        if ddm.prefetcher:
+            stats.count_cache_lookup('prefetch', cached_items is not None)
+        if cached_items is None and ddm.listing_cache:
+            cached_items = ddm.listing_cache.get(parent_id)
+            stats.count_cache_lookup('listing_cache', cached_items is not None)
+        if cached_items is not None:
+            children[parent_id] = cached_items
+    uncached_parent_ids = [parent_id for parent_id in parent_ids if parent_id not in children]
+    batches = [
+        uncached_parent_ids[i:i + constants.ENUMERATION_BATCH_SIZE] 
+        for i in range(0, len(uncached_parent_ids), constants.ENUMERATION_BATCH_SIZE)
+    ]
+    for batch_children in await asyncio.gather(*(ddm.client.list_children(batch, query_clause) for batch in batches)):
+        children.update(batch_children)
+        if ddm.listing_cache and not query_clause: # filtered listings are incomplete
+            ddm.listing_cache.put_many(batch_children)
+    return children
+
+
 def dir_enumerate(
-        start_dir: SubFS[FS],
-        previous_dir: SubFS[FS],
-        root_dir: FS,
-        drive: GoogleDrive,
-        drive_files: Dict[str, GoogleDriveFile], 
-        target_dir_path: str = ''
+        start_dir: DriveNode,
+        previous_dir: DriveNode,
+        root_dir: DriveNode,
+        ddm: DriveDataManager,
+        target_dir_path: str = '',
+        full_scan: bool = False,
+        pull_filter: Optional[PullFilter] = None,
+        is_fresh: bool = False
     ) -> bool:
 
     target_dir = start_dir
     if target_dir_path:
-        target_dir = dir_dive(start_dir, previous_dir, root_dir, drive, drive_files, target_dir_path)
+        target_dir = dir_dive(start_dir, previous_dir, root_dir, ddm, target_dir_path)
         if target_dir == start_dir:
             return False
-    for sub_dir_info in target_dir.filterdir('/', exclude_files=['*']):
-        dir_enumerate(
-            dir_dive(target_dir, previous_dir, root_dir, drive, drive_files, sub_dir_info.name), 
-            previous_dir, 
-            root_dir, 
-            drive, 
-            drive_files
+    with stats.phase('enumeration'):
+        return ddm.client.run(enumerate_dir(target_dir, ddm, full_scan, pull_filter, is_fresh))
+
+
+async def enumerate_dir(
+        target_dir: DriveNode,
+        ddm: DriveDataManager,
+        full_scan: bool = False,
+        pull_filter: Optional[PullFilter] = None,
+        is_fresh: bool = False
+    ) -> bool:
+
+    query_clause = pull_filter.get_query_clause() if pull_filter else ''
+    children_index = None
+    if full_scan: # list the whole drive once and rebuild the subtree locally
+        corpus_query = f'{constants.GDRIVE_CORPUS_QUERY} and ({query_clause})' if query_clause else constants.GDRIVE_CORPUS_QUERY
+        children_index = index_by_parent(await ddm.client.list_files(corpus_query))
+
+    # breadth-first, listing every unpopulated folder of a level in a few batched queries
+    level = [target_dir]
+    while level:
+        unpopulated_dirs = [dir for dir in level if not dir.is_populated]
+        children = await list_children_batched(
+            ddm, 
+            list({dir.drive_file['id'] for dir in unpopulated_dirs}), 
+            children_index,
+            query_clause,
+            is_fresh
         )
+        for dir in unpopulated_dirs:
+            ddm.drive_files.update(add_drive_files_to_dir(
+                dir, _as_drive_files(ddm.drive, children[dir.drive_file['id']]), ddm.export_defaults
+            ))
+        # excluded subtrees are never listed
+        level = [
+            sub_dir for dir in level for sub_dir in dir.sub_dirs()
+            if not (pull_filter and pull_filter.is_excluded_dir(sub_dir.path[len(target_dir.path):]))
+        ]
     return True
+
+
+def refresh_dir(
+        target_dir: DriveNode,
+        ddm: DriveDataManager
+    ) -> None:
+
+    for folder_id in [target_dir.drive_file['id']] + [node.drive_file['id'] for node in target_dir.walk() if node.is_dir]:
+        if ddm.listing_cache:
+            ddm.listing_cache.invalidate(folder_id)
+        if ddm.prefetcher:
+            ddm.prefetcher.invalidate(folder_id)
+    for node in target_dir.walk():
+        ddm.drive_files.pop(node.path, None)
+    target_dir.clear()
+    generate_files(target_dir, ddm)
@@ -0,0 +1,56 @@
+import json
+import os
+from pathlib import Path
+from typing import Dict, Any, Iterable, List, Optional
+import constants
+from pull_filter import PullFilter
+
+
+def is_hydrated(manifest_entry: Dict[str, Any]) -> bool:
+    # entries written before lazy pulls existed always describe real contents
+    return manifest_entry.get('hydrated', True)
+
+
+def write_stub(file_path: Path, metadata: Dict[str, Any]) -> None:
+    """
+    Writes a placeholder recording what `sdr hydrate` needs to fetch the real file. The stub replaces whatever was at
+    `file_path` without writing through it, since a hydrated file may share its blob with the content store.
+    """
+    stub = {key: metadata.get(key, None) for key in ('id', 'title', 'mimeType', 'fileSize', 'md5Checksum')}
+    file_path.parent.mkdir(parents=True, exist_ok=True)
+    temp_file_path = file_path.with_name(f'.{file_path.name}.sdr-tmp')
+    with temp_file_path.open('wb') as temp_file:
+        temp_file.write(constants.STUB_HEADER + json.dumps(stub, sort_keys=True).encode() + b'\n')
+    os.replace(temp_file_path, file_path)
+
+
+def read_stub(file_path: Path) -> Optional[Dict[str, Any]]:
+    # returns the recorded metadata, or None for anything that isn't an intact placeholder
+    try:
+        with file_path.open('rb') as file:
+            contents = file.read(constants.STUB_MAX_SIZE + 1)
+    except (FileNotFoundError, IsADirectoryError):
+        return None
+    if len(contents) > constants.STUB_MAX_SIZE or not contents.startswith(constants.STUB_HEADER):
+        return None
+    try:
+        return json.loads(contents[len(constants.STUB_HEADER):])
+    except ValueError:
+        return None
+
+
+def select_paths(
+        drive_files: Dict[str, Dict[str, Any]],
+        pulled: Dict[str, Dict[str, Any]],
+        patterns: Iterable[str],
+        hydrated: bool
+    ) -> List[str]:
+    """
+    Returns the pulled files matching any of `patterns` whose hydration state is `hydrated`. Patterns are globs matched
+    like pull filters, so `*.psd` matches at any depth and a folder's path selects everything inside it.
+    """
+    pattern_filter = PullFilter(include=patterns)
+    return sorted(
+        path for (path, entry) in pulled.items()
+        if path in drive_files and is_hydrated(entry) == hydrated and pattern_filter.matches(path, drive_files[path])
+    )
@@ -0,0 +1,90 @@
+import json
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Any, List, Optional
+
+
+_SCHEMA_VERSION = 1
+
+
+class ListingCache:
+    """
+    Folder listings shared by every repository of the user. Entries are kept per Google account, since folder IDs such as
+    `root` name a different folder for each account, and one account mustn't see another's files.
+    """
+    def __init__(self, cache_path: Path, account_id: str, ttl: float, max_entries: int):
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        self._account_id = account_id
+        self._ttl = ttl
+        self._max_entries = max_entries
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(str(cache_path), check_same_thread=False)
+        with self._connection:
+            if self._connection.execute('PRAGMA user_version').fetchone()[0] < _SCHEMA_VERSION:
+                # listings cached before they were keyed by account can't be attributed to one, so they are dropped
+                self._connection.execute('DROP TABLE IF EXISTS listings')
+                self._connection.execute(f'PRAGMA user_version = {_SCHEMA_VERSION}')
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS listings (account_id TEXT NOT NULL, folder_id TEXT NOT NULL, '
+                'listing TEXT NOT NULL, fetched_at REAL NOT NULL, accessed_at REAL NOT NULL, PRIMARY KEY (account_id, folder_id))'
+            )
+            self._connection.execute('CREATE INDEX IF NOT EXISTS listings_accessed_at ON listings (accessed_at)')
+
+    def get(self, folder_id: str) -> Optional[List[Dict[str, Any]]]:
+        now = time.time()
+        with self._lock, self._connection:
+            row = self._connection.execute(
+                'SELECT listing, fetched_at FROM listings WHERE account_id = ? AND folder_id = ?', (self._account_id, folder_id)
+            ).fetchone()
+            if row is None:
+                return None
+            if now - row[1] > self._ttl:
+                self._connection.execute(
+                    'DELETE FROM listings WHERE account_id = ? AND folder_id = ?', (self._account_id, folder_id)
+                )
+                return None
+            self._connection.execute(
+                'UPDATE listings SET accessed_at = ? WHERE account_id = ? AND folder_id = ?', (now, self._account_id, folder_id)
+            )
+        return json.loads(row[0])
+
+    def get_all(self) -> Dict[str, List[Dict[str, Any]]]:
+        # a read-only snapshot of every unexpired listing, which doesn't count as a use for eviction
+        with self._lock:
+            rows = self._connection.execute(
+                'SELECT folder_id, listing FROM listings WHERE account_id = ? AND fetched_at >= ?',
+                (self._account_id, time.time() - self._ttl)
+            ).fetchall()
+        return {folder_id: json.loads(listing) for (folder_id, listing) in rows}
+
+    def put(self, folder_id: str, listing: List[Dict[str, Any]]) -> None:
+        self.put_many({folder_id: listing})
+
+    def put_many(self, listings: Dict[str, List[Dict[str, Any]]]) -> None:
+        # a whole batch of listings is written in one transaction
+        if not listings:
+            return
+        now = time.time()
+        with self._lock, self._connection:
+            self._connection.executemany(
+                'INSERT OR REPLACE INTO listings VALUES (?, ?, ?, ?, ?)',
+                [(self._account_id, folder_id, json.dumps(listing), now, now) for (folder_id, listing) in listings.items()]
+            )
+            # evict the least recently used listings beyond the size bound, whichever account they belong to
+            excess_count = self._connection.execute('SELECT COUNT(*) FROM listings').fetchone()[0] - self._max_entries
+            if excess_count > 0:
+                self._connection.execute(
+                    'DELETE FROM listings WHERE rowid IN (SELECT rowid FROM listings ORDER BY accessed_at LIMIT ?)',
+                    (excess_count,)
+                )
+
+    def invalidate(self, folder_id: str) -> None:
+        with self._lock, self._connection:
+            self._connection.execute(
+                'DELETE FROM listings WHERE account_id = ? AND folder_id = ?', (self._account_id, folder_id)
+            )
+
+    def close(self) -> None:
+        self._connection.close()
@@ -0,0 +1,139 @@
+import hashlib
+import mmap
+import os
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, Any, List, Set, Tuple
+import constants
+from hydration import is_hydrated, read_stub
+from pull_filter import PullFilter
+from utils import get_local_file_paths
+
+
+FileStat = Tuple[int, int, int]
+
+
+def get_file_stat(local_stat: os.stat_result) -> FileStat:
+    return (local_stat.st_size, local_stat.st_mtime_ns, local_stat.st_ino)
+
+
+def hash_file(file_path: str) -> str:
+    with open(file_path, 'rb') as file:
+        if os.fstat(file.fileno()).st_size == 0: # empty files can't be mapped
+            return hashlib.md5().hexdigest()
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped_file:
+            return hashlib.md5(mapped_file).hexdigest()
+
+
+def hash_files(file_paths: List[Path], jobs: int) -> List[str]:
+    if len(file_paths) < constants.PARALLEL_HASH_THRESHOLD or jobs == 1: # not worth starting worker processes
+        return [hash_file(str(file_path)) for file_path in file_paths]
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        return list(executor.map(hash_file, map(str, file_paths), chunksize=constants.HASH_CHUNK_SIZE))
+
+
+def _get_tracked_file_paths(
+        target_dir_path: Path,
+        drive_files: Dict[str, Dict[str, Any]],
+        pulled: Dict[str, Dict[str, Any]]
+    ) -> Dict[str, List[Path]]:
+
+    # the first local path is the one the pulled entry describes; the rest are additional export formats
+    return {
+        path: [
+            file_path for (_, file_path) in get_local_file_paths(
+                target_dir_path, path, drive_files[path], {drive_files[path]['mimeType']: entry.get('exports', [])}
+            )
+        ][:None if is_hydrated(entry) else 1]
+        for (path, entry) in pulled.items()
+        if path in drive_files
+    }
+
+
+def get_status(
+        target_dir_path: Path,
+        drive_files: Dict[str, Dict[str, Any]],
+        pulled: Dict[str, Dict[str, Any]],
+        hashes: Dict[str, Tuple[FileStat, str]],
+        pull_filter: PullFilter
+    ) -> Dict[str, List[str]]:
+    """
+    Compares the working copy against the manifest using only file metadata; files whose stat changed are
+    still reported clean when the stat cache holds a matching checksum for their current state.
+    """
+    tracked_file_paths = _get_tracked_file_paths(target_dir_path, drive_files, pulled)
+    status: Dict[str, List[str]] = {'modified': [], 'missing': [], 'untracked': [], 'not pulled': []}
+    for path, file_paths in tracked_file_paths.items():
+        entry = pulled[path]
+        try:
+            local_stat = file_paths[0].stat()
+        except FileNotFoundError:
+            status['missing'].append(path)
+            continue
+        if local_stat.st_size == entry['size'] and local_stat.st_mtime_ns == entry['mtime']:
+            continue
+        if not is_hydrated(entry) and read_stub(file_paths[0]) is not None: # a touched placeholder
+            continue
+        file_stat, md5 = hashes.get(path, (None, None))
+        if not (entry.get('md5Checksum', None) and file_stat == get_file_stat(local_stat) and md5 == entry['md5Checksum']):
+            status['modified'].append(path)
+
+    # new or changed on Drive since the last pull (as far as the manifest knows)
+    status['not pulled'] = sorted(
+        path for (path, metadata) in drive_files.items()
+        if metadata['mimeType'] != constants.FOLDER_MIMETYPE
+        and pull_filter.matches(path, metadata)
+        and any(metadata.get(key, None) != pulled.get(path, {}).get(key, None) for key in constants.REVISION_KEYS)
+    )
+
+    known_file_paths: Set[Path] = {file_path for file_paths in tracked_file_paths.values() for file_path in file_paths}
+    for dir_path, dir_names, file_names in os.walk(target_dir_path):
+        dir_names[:] = [dir_name for dir_name in dir_names if dir_name != constants.SDR_RELPATH]
+        for file_name in file_names:
+            file_path = Path(dir_path) / file_name
+            if file_path not in known_file_paths and not file_name.endswith('.sdr-tmp'):
+                status['untracked'].append('/' + file_path.relative_to(target_dir_path).as_posix())
+    status['untracked'].sort()
+    return status
+
+
+def verify_files(
+        target_dir_path: Path,
+        drive_files: Dict[str, Dict[str, Any]],
+        pulled: Dict[str, Dict[str, Any]],
+        hashes: Dict[str, Tuple[FileStat, str]],
+        jobs: int
+    ) -> Tuple[Dict[str, str], Dict[str, Tuple[FileStat, str]], int]:
+    """
+    Checks every pulled file's content against the checksum Drive reported for it, or its size where Drive has no checksum
+    (exported documents). Placeholders left by lazy pulls are only checked for presence. Returns the problems found by path,
+    the refreshed stat cache entries and the number of files hashed.
+    """
+    problems: Dict[str, str] = {}
+    updated_hashes: Dict[str, Tuple[FileStat, str]] = {}
+    unhashed: List[Tuple[str, Path, FileStat]] = []
+    for path, file_paths in _get_tracked_file_paths(target_dir_path, drive_files, pulled).items():
+        entry = pulled[path]
+        missing_file_paths = [file_path for file_path in file_paths if not file_path.exists()]
+        if missing_file_paths:
+            problems[path] = 'missing'
+            continue
+        if not is_hydrated(entry):
+            continue
+        local_stat = file_paths[0].stat()
+        if not entry.get('md5Checksum', None):
+            if local_stat.st_size != entry['size']:
+                problems[path] = 'size differs'
+            continue
+        file_stat, md5 = hashes.get(path, (None, None))
+        if file_stat == get_file_stat(local_stat): # unchanged since it was last hashed
+            if md5 != entry['md5Checksum']:
+                problems[path] = 'checksum differs'
+            continue
+        unhashed.append((path, file_paths[0], get_file_stat(local_stat)))
+
+    for (path, _, file_stat), md5 in zip(unhashed, hash_files([file_path for (_, file_path, _) in unhashed], jobs)):
+        updated_hashes[path] = (file_stat, md5)
+        if md5 != pulled[path]['md5Checksum']:
+            problems[path] = 'checksum differs'
+    return (problems, updated_hashes, len(unhashed))
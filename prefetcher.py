@@ -0,0 +1,87 @@
+import asyncio
+import threading
+from typing import Dict, Any, List, Optional
+import constants
+from drive_client import AsyncDriveClient
+from listing_cache import ListingCache
+
+
+class Prefetcher:
+    def __init__(
+            self,
+            client: AsyncDriveClient,
+            depth: int,
+            budget: int,
+            listing_cache: Optional[ListingCache] = None
+        ):
+
+        self._client = client
+        self._depth = depth
+        self._budget = budget
+        self._listing_cache = listing_cache
+        self._listings: Dict[str, List[Dict[str, Any]]] = {}
+        self._lock = threading.Lock()
+        self._cancelled = threading.Event()
+        self._threads: List[threading.Thread] = []
+
+    def get(self, folder_id: str) -> Optional[List[Dict[str, Any]]]:
+        with self._lock:
+            return self._listings.get(folder_id, None)
+
+    def invalidate(self, folder_id: str) -> None:
+        with self._lock:
+            self._listings.pop(folder_id, None)
+
+    def prefetch(self, folder_ids: List[str]) -> None:
+        # the previous run is only told to stop, so the prompt never waits for a listing still in flight
+        self.cancel()
+        self._cancelled = threading.Event()
+        thread = threading.Thread(target=asyncio.run, args=(self._prefetch(folder_ids, self._cancelled),), daemon=True)
+        self._threads = [running_thread for running_thread in self._threads if running_thread.is_alive()] + [thread]
+        thread.start()
+
+    def cancel(self) -> None:
+        self._cancelled.set()
+
+    def close(self) -> None:
+        # waits for cancelled runs to finish their last request before the client is closed under them
+        self.cancel()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def _get_known_listing(self, folder_id: str) -> Optional[List[Dict[str, Any]]]:
+        listing = self.get(folder_id)
+        if listing is None and self._listing_cache:
+            listing = self._listing_cache.get(folder_id)
+        return listing
+
+    async def _prefetch(self, folder_ids: List[str], cancelled: threading.Event) -> None:
+        # breadth-first over the likely next targets, spending at most `budget` list requests
+        budget = self._budget
+        level = list(dict.fromkeys(folder_ids))
+        for _ in range(self._depth):
+            listings = {folder_id: self._get_known_listing(folder_id) for folder_id in level}
+            unknown_ids = [folder_id for (folder_id, listing) in listings.items() if listing is None]
+            batches = [
+                unknown_ids[i:i + constants.ENUMERATION_BATCH_SIZE]
+                for i in range(0, len(unknown_ids), constants.ENUMERATION_BATCH_SIZE)
+            ][:budget]
+            budget -= len(batches)
+            if cancelled.is_set():
+                return
+            for batch_children in await asyncio.gather(*(self._client.list_children(batch) for batch in batches)):
+                with self._lock:
+                    if cancelled.is_set(): # a newer run has taken over
+                        return
+                    self._listings.update(batch_children)
+                if self._listing_cache:
+                    self._listing_cache.put_many(batch_children)
+                listings.update(batch_children)
+            level = [
+                item['id']
+                for listing in listings.values() if listing is not None
+                for item in listing if item['mimeType'] == constants.FOLDER_MIMETYPE
+            ]
+            if cancelled.is_set() or budget <= 0 or not level:
+                return
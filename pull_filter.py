@@ -0,0 +1,145 @@
+import fnmatch
+from pathlib import PurePosixPath
+from typing import Dict, Any, Callable, Iterable, List, Optional, Tuple
+import click
+import constants
+from utils import quote_query_value
+
+
+def _parse_size(context: click.Context, parameter: click.Parameter, value: Optional[str]) -> Optional[int]:
+    if value is None:
+        return None
+    units = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3, 'T': 1024 ** 4}
+    try:
+        if value[-1:].upper() in units:
+            return int(float(value[:-1]) * units[value[-1:].upper()])
+        return int(value)
+    except ValueError:
+        raise click.BadParameter(f'`{value}` is not a size such as 500K, 20M or 1G')
+
+
+class PullFilter:
+    """
+    Decides which Drive files a repository pulls. Glob patterns are matched against repository-relative paths
+    from the right (so `*.mp4` matches at any depth), and a pattern that matches a folder applies to everything inside it.
+    """
+    def __init__(
+            self,
+            include: Iterable[str] = (),
+            exclude: Iterable[str] = (),
+            mimetypes: Iterable[str] = (),
+            exclude_mimetypes: Iterable[str] = (),
+            max_size: Optional[int] = None
+        ):
+
+        self.include = list(include)
+        self.exclude = list(exclude)
+        self.mimetypes = list(mimetypes)
+        self.exclude_mimetypes = list(exclude_mimetypes)
+        self.max_size = max_size
+
+    @classmethod
+    def from_config(cls, sdr_config: Dict[str, Any]) -> 'PullFilter':
+        filters: Dict[str, Any] = sdr_config.get(constants.PULL_FILTERS_KEY, {})
+        return cls(
+            filters.get('include', []),
+            filters.get('exclude', []),
+            filters.get('mimetypes', []),
+            filters.get('exclude_mimetypes', []),
+            filters.get('max_size', None)
+        )
+
+    def to_config(self) -> Dict[str, Any]:
+        return {
+            'include': self.include,
+            'exclude': self.exclude,
+            'mimetypes': self.mimetypes,
+            'exclude_mimetypes': self.exclude_mimetypes,
+            'max_size': self.max_size
+        }
+
+    def updated(
+            self,
+            include: Tuple[str, ...],
+            exclude: Tuple[str, ...],
+            mimetypes: Tuple[str, ...],
+            exclude_mimetypes: Tuple[str, ...],
+            max_size: Optional[int],
+            is_reset: bool = False
+        ) -> 'PullFilter':
+
+        # options that weren't given keep their configured values
+        base = PullFilter() if is_reset else self
+        return PullFilter(
+            include or base.include,
+            exclude or base.exclude,
+            mimetypes or base.mimetypes,
+            exclude_mimetypes or base.exclude_mimetypes,
+            max_size if max_size is not None else base.max_size
+        )
+
+    def is_narrower_than(self, other: 'PullFilter') -> bool:
+        """
+        Whether this filter can only admit files that `other` admits too. Files a filter rejects may never have been
+        listed into the manifest, so a filter that isn't narrower needs the folder to be listed again.
+        """
+        return (
+            set(other.exclude) <= set(self.exclude)
+            and set(other.exclude_mimetypes) <= set(self.exclude_mimetypes)
+            and (not other.include or (bool(self.include) and set(self.include) <= set(other.include)))
+            and (not other.mimetypes or (bool(self.mimetypes) and set(self.mimetypes) <= set(other.mimetypes)))
+            and (other.max_size is None or (self.max_size is not None and self.max_size <= other.max_size))
+        )
+
+    @staticmethod
+    def _matches_any(path: str, patterns: List[str]) -> bool:
+        relative_path = PurePosixPath(path.strip('/'))
+        return any(
+            candidate.match(pattern)
+            for candidate in [relative_path, *relative_path.parents][:-1]
+            for pattern in patterns
+        )
+
+    def is_excluded_dir(self, path: str) -> bool:
+        return bool(self.exclude) and self._matches_any(path, self.exclude)
+
+    def matches(self, path: str, metadata: Dict[str, Any]) -> bool:
+        if self.is_excluded_dir(path):
+            return False
+        mimetype: str = metadata.get('mimeType', '')
+        if mimetype == constants.FOLDER_MIMETYPE: # included files may be anywhere inside
+            return True
+        if self.include and not self._matches_any(path, self.include):
+            return False
+        if self.mimetypes and not any(fnmatch.fnmatchcase(mimetype, pattern) for pattern in self.mimetypes):
+            return False
+        if any(fnmatch.fnmatchcase(mimetype, pattern) for pattern in self.exclude_mimetypes):
+            return False
+        return self.max_size is None or int(metadata.get('fileSize', 0)) <= self.max_size
+
+    def get_query_clause(self) -> str:
+        # only exact mimetypes can be expressed in a Drive query; globs, paths and sizes are filtered locally
+        clauses = [
+            f'mimeType != \'{quote_query_value(mimetype)}\''
+            for mimetype in self.exclude_mimetypes
+            if not any(char in mimetype for char in '*?[') and mimetype != constants.FOLDER_MIMETYPE
+        ]
+        if self.mimetypes and not any(char in mimetype for mimetype in self.mimetypes for char in '*?['):
+            clauses.append('(' + ' or '.join(
+                f'mimeType = \'{quote_query_value(mimetype)}\'' for mimetype in [constants.FOLDER_MIMETYPE, *self.mimetypes]
+            ) + ')')
+        return ' and '.join(clauses)
+
+
+def filter_options(command: Callable[..., Any]) -> Callable[..., Any]:
+    options = [
+        click.option('--include', multiple=True, help='Only pull paths matching this glob (repeatable)'),
+        click.option('--exclude', multiple=True, help='Never pull paths matching this glob (repeatable)'),
+        click.option('--mimetype', 'mimetypes', multiple=True, help='Only pull files of this mimetype, e.g. `image/*`'),
+        click.option('--exclude-mimetype', 'exclude_mimetypes', multiple=True, help='Never pull files of this mimetype'),
+        click.option('--max-size', callback=_parse_size, help='Skip files larger than this, e.g. 500M'),
+        click.option('--reset-filters', 'is_filter_reset', is_flag=True, help='Drop the configured filters first')
+    ]
+    for option in reversed(options):
+        command = option(command)
+    return command
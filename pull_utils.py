@@ -0,0 +1,294 @@
+import asyncio
+import time
+from pathlib import Path
+from typing import Dict, Any, Awaitable, Callable, List, Optional, Tuple, Union
+import constants
+import stats
+from drive_client import AsyncDriveClient
+from content_store import ContentStore, SharedContentStore, materialise_file
+from export_cache import ExportCache
+from hydration import is_hydrated
+from pull_filter import PullFilter
+from utils import get_local_file_path, get_local_file_paths, get_virtual_file_name
+
+
+def get_export_formats(sdr_config: Dict[str, Any]) -> Dict[str, List[str]]:
+    # the default export comes first and names the file the manifest tracks
+    extra_export_types: Dict[str, List[str]] = sdr_config.get(constants.EXTRA_EXPORT_TYPES_KEY, {})
+    return {
+        mimetype: [export_mimetype] + [
+            extra_mimetype for extra_mimetype in extra_export_types.get(mimetype, []) if extra_mimetype != export_mimetype
+        ]
+        for (mimetype, export_mimetype) in sdr_config['export_types'].items()
+    }
+
+
+def build_manifest_entry(
+        metadata: Dict[str, Any],
+        local_file_path: Path,
+        export_mimetypes: Optional[List[str]] = None,
+        hydrated: bool = True
+    ) -> Dict[str, Any]:
+
+    local_stat = local_file_path.stat()
+    entry = {
+        **{key: metadata.get(key, None) for key in constants.REVISION_KEYS},
+        'size': local_stat.st_size,
+        'mtime': local_stat.st_mtime_ns
+    }
+    if export_mimetypes:
+        entry['exports'] = export_mimetypes
+    if not hydrated: # the local file is a placeholder written by a lazy pull
+        entry['hydrated'] = False
+    return entry
+
+
+def is_up_to_date(
+        metadata: Dict[str, Any],
+        manifest_entry: Dict[str, Any],
+        local_file_paths: List[Tuple[Optional[str], Path]]
+    ) -> bool:
+
+    if not manifest_entry:
+        return False
+    if any(metadata.get(key, None) != manifest_entry.get(key, None) for key in constants.REVISION_KEYS):
+        return False
+    export_mimetypes = [export_mimetype for (export_mimetype, _) in local_file_paths if export_mimetype]
+    if manifest_entry.get('exports', []) != export_mimetypes:
+        return False
+    try:
+        local_stat = local_file_paths[0][1].stat()
+    except FileNotFoundError:
+        return False
+    # placeholders only stand in for the default export
+    return (
+        local_stat.st_size == manifest_entry['size']
+        and local_stat.st_mtime_ns == manifest_entry['mtime']
+        and (not is_hydrated(manifest_entry) or all(file_path.exists() for (_, file_path) in local_file_paths[1:]))
+    )
+
+
+def remove_stale_exports(
+        target_dir_path: Path,
+        drive_file_path: str,
+        metadata: Dict[str, Any],
+        manifest_entry: Dict[str, Any],
+        export_formats: Dict[str, List[str]]
+    ) -> None:
+
+    # formats dropped with `sdr configure` would otherwise linger next to the current ones
+    previous_exports: List[str] = manifest_entry.get('exports', [])
+    if not previous_exports:
+        return
+    current_file_paths = {
+        file_path for (_, file_path) in get_local_file_paths(target_dir_path, drive_file_path, metadata, export_formats)
+    }
+    for _, file_path in get_local_file_paths(target_dir_path, drive_file_path, metadata, {metadata['mimeType']: previous_exports}):
+        if file_path not in current_file_paths:
+            file_path.unlink(missing_ok=True)
+
+
+def get_stale_drive_files(
+        drive_files: Dict[str, Dict[str, Any]],
+        manifest: Dict[str, Dict[str, Any]],
+        target_dir_path: Path,
+        export_formats: Dict[str, List[str]]
+    ) -> Dict[str, Dict[str, Any]]:
+
+    stale_drive_files: Dict[str, Dict[str, Any]] = {}
+    for path, metadata in drive_files.items():
+        if metadata['mimeType'] == constants.FOLDER_MIMETYPE:
+            continue
+        is_fresh = is_up_to_date(
+            metadata, manifest.get(path, {}), get_local_file_paths(target_dir_path, path, metadata, export_formats)
+        )
+        stats.count_cache_lookup('pull_manifest', is_fresh)
+        if not is_fresh:
+            stale_drive_files[path] = metadata
+    return stale_drive_files
+
+
+def group_by_content(drive_files: Dict[str, Dict[str, Any]]) -> List[List[str]]:
+    # files sharing an md5Checksum are identical blobs; native files have none and are exported one by one
+    groups: Dict[str, List[str]] = {}
+    for path, metadata in drive_files.items():
+        if metadata['mimeType'] == constants.FOLDER_MIMETYPE:
+            continue
+        groups.setdefault(metadata.get('md5Checksum', None) or f'path:{path}', []).append(path)
+    return list(groups.values())
+
+
+class DriveFileDownloader:
+    # fetches files into the working copy, reusing local copies, the content store and the export cache where it can
+    def __init__(
+            self,
+            client: AsyncDriveClient,
+            target_dir_path: Path,
+            export_formats: Dict[str, List[str]],
+            jobs: int,
+            dedup_mode: str = constants.DEFAULT_DEDUP_MODE,
+            content_store: Optional[Union[ContentStore, SharedContentStore]] = None,
+            export_cache: Optional[ExportCache] = None
+        ):
+
+        self.failures: Dict[str, Exception] = {}
+        self._client = client
+        self._target_dir_path = target_dir_path
+        self._export_formats = export_formats
+        self._semaphore = asyncio.Semaphore(max(jobs, 1))
+        self._dedup_mode = dedup_mode
+        self._content_store = content_store
+        self._export_cache = export_cache
+        self._streamed_blobs: Dict[str, 'asyncio.Future[Optional[Path]]'] = {}
+
+    async def export(self, path: str, metadata: Dict[str, Any]) -> None:
+        export_cache = self._export_cache
+        async with self._semaphore:
+            start = time.perf_counter()
+            try: # every format of a document is exported in the same pass
+                for export_mimetype, file_path in get_local_file_paths(self._target_dir_path, path, metadata, self._export_formats):
+                    export_path = export_cache.get(metadata, export_mimetype) if export_cache and export_mimetype else None
+                    if export_cache and export_mimetype:
+                        stats.count_cache_lookup('export_cache', export_path is not None)
+                    if export_path is not None:
+                        await asyncio.to_thread(materialise_file, export_path, file_path, self._dedup_mode)
+                        continue
+                    await self._client.download(
+                        metadata, file_path, self._target_dir_path / constants.PARTIAL_DOWNLOADS_RELPATH, export_mimetype
+                    )
+                    if export_cache and export_mimetype:
+                        await asyncio.to_thread(export_cache.add, metadata, export_mimetype, file_path)
+            except Exception as e: # report the failure without aborting the remaining downloads
+                self.failures[path] = e
+                return
+            if stats.is_enabled():
+                stats.record_file(path, time.perf_counter() - start, file_path.stat().st_size)
+
+    async def download(self, paths: List[str], metadata: Dict[str, Any]) -> None:
+        content_store = self._content_store
+        md5_checksum: Optional[str] = metadata.get('md5Checksum', None)
+        file_paths = [get_local_file_path(self._target_dir_path, path) for path in paths]
+        async with self._semaphore:
+            start = time.perf_counter()
+            try:
+                is_stored = bool(content_store and md5_checksum)
+                # a shared store may wait here for another repository that is already fetching the blob
+                blob_path = await content_store.get(md5_checksum) if is_stored else None
+                if is_stored:
+                    stats.count_cache_lookup('content_store', blob_path is not None)
+                if blob_path is not None:
+                    await asyncio.to_thread(materialise_file, blob_path, file_paths[0], self._dedup_mode)
+                else:
+                    try:
+                        await self._client.download(
+                            metadata, file_paths[0], self._target_dir_path / constants.PARTIAL_DOWNLOADS_RELPATH
+                        )
+                        if is_stored:
+                            await asyncio.to_thread(content_store.add, md5_checksum, file_paths[0])
+                    except Exception:
+                        if is_stored:
+                            content_store.release(md5_checksum)
+                        raise
+                # the remaining copies are materialised locally instead of downloaded again
+                for file_path in file_paths[1:]:
+                    await asyncio.to_thread(materialise_file, file_paths[0], file_path, self._dedup_mode)
+            except Exception as e: # report the failure without aborting the remaining downloads
+                self.failures.update({path: e for path in paths})
+                return
+            if stats.is_enabled():
+                seconds = time.perf_counter() - start
+                for path, file_path in zip(paths, file_paths):
+                    stats.record_file(path, seconds, file_path.stat().st_size)
+
+    async def fetch(self, path: str, metadata: Dict[str, Any]) -> None:
+        # files arrive one at a time while streaming, so identical content is matched against what is already in flight
+        if metadata['mimeType'] in self._export_formats:
+            await self.export(path, metadata)
+            return
+        md5_checksum: Optional[str] = metadata.get('md5Checksum', None)
+        if md5_checksum in self._streamed_blobs:
+            first_file_path = await self._streamed_blobs[md5_checksum]
+            if first_file_path is not None:
+                try:
+                    await asyncio.to_thread(
+                        materialise_file, first_file_path, get_local_file_path(self._target_dir_path, path), self._dedup_mode
+                    )
+                except Exception as e:
+                    self.failures[path] = e
+                return
+        elif md5_checksum:
+            self._streamed_blobs[md5_checksum] = asyncio.get_running_loop().create_future()
+        await self.download([path], metadata)
+        if md5_checksum and not self._streamed_blobs[md5_checksum].done():
+            self._streamed_blobs[md5_checksum].set_result(
+                None if path in self.failures else get_local_file_path(self._target_dir_path, path)
+            )
+
+
+async def download_drive_files(
+        client: AsyncDriveClient,
+        drive_files: Dict[str, Dict[str, Any]],
+        target_dir_path: Path,
+        export_formats: Dict[str, List[str]],
+        jobs: int,
+        dedup_mode: str = constants.DEFAULT_DEDUP_MODE,
+        content_store: Optional[Union[ContentStore, SharedContentStore]] = None,
+        export_cache: Optional[ExportCache] = None
+    ) -> Dict[str, Exception]:
+
+    downloader = DriveFileDownloader(client, target_dir_path, export_formats, jobs, dedup_mode, content_store, export_cache)
+    await asyncio.gather(*(
+        downloader.export(paths[0], drive_files[paths[0]]) if drive_files[paths[0]]['mimeType'] in export_formats
+        else downloader.download(paths, drive_files[paths[0]])
+        for paths in group_by_content(drive_files)
+    ))
+    return downloader.failures
+
+
+async def enumerate_drive_files(
+        client: AsyncDriveClient,
+        root_dir_id: str,
+        export_defaults: Dict[str, str],
+        pull_filter: PullFilter,
+        on_file: Callable[[str, Dict[str, Any]], Awaitable[None]]
+    ) -> Dict[str, Dict[str, Any]]:
+    """
+    Lists every folder under `root_dir_id`, keeping a few batched listings in flight and handing each file to `on_file`
+    as soon as its folder has been listed. A folder's subfolders are listed without waiting for the rest of its level.
+    Returns everything listed, by path.
+    """
+    drive_files: Dict[str, Dict[str, Any]] = {}
+    query_clause = pull_filter.get_query_clause()
+    pending_dirs: 'asyncio.Queue[Tuple[str, str]]' = asyncio.Queue()
+
+    async def list_dirs() -> None:
+        while True:
+            batch = [await pending_dirs.get()]
+            while len(batch) < constants.ENUMERATION_BATCH_SIZE and not pending_dirs.empty():
+                batch.append(pending_dirs.get_nowait())
+            try:
+                children = await client.list_children([dir_id for (dir_id, _) in batch], query_clause)
+                for dir_id, dir_path in batch:
+                    for metadata in children.get(dir_id, []):
+                        path = f'{dir_path}/{get_virtual_file_name(metadata, export_defaults)}'
+                        drive_files[path] = metadata
+                        if metadata['mimeType'] != constants.FOLDER_MIMETYPE:
+                            await on_file(path, metadata)
+                        elif not pull_filter.is_excluded_dir(path): # excluded subtrees are never listed
+                            pending_dirs.put_nowait((metadata['id'], path))
+            finally:
+                for _ in batch:
+                    pending_dirs.task_done()
+
+    pending_dirs.put_nowait((root_dir_id, ''))
+    listers = [asyncio.create_task(list_dirs()) for _ in range(constants.ENUMERATION_JOBS)]
+    joined = asyncio.create_task(pending_dirs.join())
+    try:
+        await asyncio.wait([joined, *listers], return_when=asyncio.FIRST_COMPLETED)
+        for lister in listers: # listers only finish early by failing
+            if lister.done():
+                lister.result()
+    finally:
+        for task in [joined, *listers]:
+            task.cancel()
+    return drive_files
@@ -0,0 +1,163 @@
+import asyncio
+import mimetypes
+import time
+from pathlib import Path
+from typing import Dict, Any, List, Optional, Tuple
+from googleapiclient.errors import HttpError
+import constants
+import stats
+from drive_client import AsyncDriveClient
+from hydration import read_stub
+from local_status import FileStat, get_file_stat, get_status, hash_files
+from pull_filter import PullFilter
+from utils import get_local_file_path
+
+
+def _get_parent_path(path: str) -> str:
+    return path.rsplit('/', 1)[0]
+
+
+def get_push_candidates(
+        target_dir_path: Path,
+        drive_files: Dict[str, Dict[str, Any]],
+        pulled: Dict[str, Dict[str, Any]],
+        hashes: Dict[str, Tuple[FileStat, str]],
+        pull_filter: PullFilter,
+        jobs: int
+    ) -> Tuple[Dict[str, Optional[str]], List[str], Dict[str, Tuple[FileStat, str]]]:
+    """
+    Finds the local files whose content differs from the last pull, plus new files the pull filter would accept.
+    Returns the Drive file ID to update for each path (None for new files), the modified documents that can't be pushed
+    because Drive only holds them as exports, and the refreshed stat cache entries.
+    """
+    repo_status = get_status(target_dir_path, drive_files, pulled, hashes, pull_filter)
+    skipped = [
+        path for path in repo_status['modified']
+        if drive_files[path]['mimeType'].startswith(constants.GDRIVE_NATIVE_MIMETYPE_PREFIX)
+    ]
+
+    # a changed stat alone isn't enough: files that were only touched keep the content Drive already has
+    modified = [path for path in repo_status['modified'] if path not in skipped]
+    file_paths = [get_local_file_path(target_dir_path, path) for path in modified]
+    updated_hashes: Dict[str, Tuple[FileStat, str]] = {}
+    candidates: Dict[str, Optional[str]] = {}
+    for path, file_path, md5 in zip(modified, file_paths, hash_files(file_paths, jobs)):
+        updated_hashes[path] = (get_file_stat(file_path.stat()), md5)
+        if md5 != pulled[path].get('md5Checksum', None):
+            candidates[path] = drive_files[path]['id']
+
+    for path in repo_status['untracked']:
+        if path in drive_files and path not in pulled: # filtered out of earlier pulls, but present on Drive
+            candidates[path] = drive_files[path]['id']
+            continue
+        file_path = get_local_file_path(target_dir_path, path)
+        metadata = {'mimeType': guess_mimetype(file_path), 'fileSize': file_path.stat().st_size}
+        if path not in drive_files and pull_filter.matches(path, metadata) and read_stub(file_path) is None: # copied placeholders
+            candidates[path] = None
+    return (candidates, skipped, updated_hashes)
+
+
+def guess_mimetype(file_path: Path) -> str:
+    return mimetypes.guess_type(file_path.name)[0] or constants.DEFAULT_UPLOAD_MIMETYPE
+
+
+async def find_conflicts(
+        client: AsyncDriveClient,
+        candidates: Dict[str, Optional[str]],
+        pulled: Dict[str, Dict[str, Any]],
+        jobs: int
+    ) -> Dict[str, str]:
+
+    # the remote content must still be what was pulled, otherwise pushing would discard someone else's edit
+    conflicts: Dict[str, str] = {}
+    semaphore = asyncio.Semaphore(max(jobs, 1))
+
+    async def check(path: str, file_id: str) -> None:
+        if path not in pulled:
+            conflicts[path] = 'exists on Drive but was never pulled'
+            return
+        async with semaphore:
+            try:
+                metadata = await client.get_metadata(file_id)
+            except HttpError as e:
+                if e.resp.status != 404:
+                    raise
+                conflicts[path] = 'deleted on Drive'
+                return
+        if metadata.get('md5Checksum', None) != pulled[path].get('md5Checksum', None):
+            conflicts[path] = 'changed on Drive since the last pull'
+
+    await asyncio.gather(*(check(path, file_id) for (path, file_id) in candidates.items() if file_id))
+    return conflicts
+
+
+async def create_parent_folders(
+        client: AsyncDriveClient,
+        paths: List[str],
+        drive_files: Dict[str, Dict[str, Any]],
+        chosen_dir_id: str
+    ) -> Tuple[Dict[str, str], Dict[str, Dict[str, Any]]]:
+    """
+    Returns the folder ID for each directory holding one of `paths`, and the metadata of the folders that had to be created.
+    """
+    folder_ids = {
+        path: metadata['id'] for (path, metadata) in drive_files.items() if metadata['mimeType'] == constants.FOLDER_MIMETYPE
+    }
+    folder_ids[''] = chosen_dir_id
+    missing: Dict[str, None] = {}
+    for path in paths:
+        dir_path = _get_parent_path(path)
+        while dir_path not in folder_ids and dir_path not in missing:
+            missing[dir_path] = None
+            dir_path = _get_parent_path(dir_path)
+
+    # a folder needs its parent's ID, so each level waits for the one above it
+    created: Dict[str, Dict[str, Any]] = {}
+    for depth in sorted({dir_path.count('/') for dir_path in missing}):
+        level = [dir_path for dir_path in missing if dir_path.count('/') == depth]
+        folders = await asyncio.gather(*(
+            client.create_folder(dir_path.rsplit('/', 1)[-1], folder_ids[_get_parent_path(dir_path)]) for dir_path in level
+        ))
+        for dir_path, metadata in zip(level, folders):
+            folder_ids[dir_path] = metadata['id']
+            created[dir_path] = metadata
+    return (folder_ids, created)
+
+
+async def upload_files(
+        client: AsyncDriveClient,
+        candidates: Dict[str, Optional[str]],
+        drive_files: Dict[str, Dict[str, Any]],
+        folder_ids: Dict[str, str],
+        target_dir_path: Path,
+        jobs: int
+    ) -> Tuple[Dict[str, Dict[str, Any]], Dict[str, Exception]]:
+
+    uploaded: Dict[str, Dict[str, Any]] = {}
+    failures: Dict[str, Exception] = {}
+    semaphore = asyncio.Semaphore(max(jobs, 1))
+
+    async def upload(path: str, file_id: Optional[str]) -> None:
+        file_path = get_local_file_path(target_dir_path, path)
+        if file_id:
+            file_metadata = {'mimeType': drive_files[path]['mimeType']}
+        else:
+            file_metadata = {
+                'title': file_path.name,
+                'mimeType': guess_mimetype(file_path),
+                'parents': [{'id': folder_ids[_get_parent_path(path)]}]
+            }
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                uploaded[path] = await client.upload(
+                    file_path, target_dir_path / constants.UPLOADS_RELPATH, file_metadata, file_id
+                )
+            except Exception as e: # report the failure without aborting the remaining uploads
+                failures[path] = e
+                return
+            if stats.is_enabled():
+                stats.record_file(path, time.perf_counter() - start, file_path.stat().st_size)
+
+    await asyncio.gather(*(upload(path, file_id) for (path, file_id) in candidates.items()))
+    return (uploaded, failures)
@@ -0,0 +1,435 @@
+import asyncio
+import threading
+from pathlib import Path
+from typing import Dict, Any, List, Optional, Set, Tuple
+import constants
+import stats
+from content_store import BlobIndex, SharedContentStore, get_content_store
+from drive_changes import get_changed_rows, apply_local_changes, move_local_file
+from drive_data_manager import DriveDataManager
+from drive_manifest import ManifestStore, cull_metadata, diff_rows
+from export_cache import ExportCache
+from hydration import is_hydrated, select_paths, write_stub
+from local_status import get_file_stat, hash_files
+from pull_filter import PullFilter
+from search_index import SearchIndex, matches_query
+from pull_utils import (
+    DriveFileDownloader, download_drive_files, enumerate_drive_files, build_manifest_entry, get_stale_drive_files,
+    get_export_formats, is_up_to_date, remove_stale_exports
+)
+from utils import get_local_file_paths
+
+
+def _get_ancestor_paths(path: str) -> List[str]:
+    # the path itself, then each enclosing folder up to (not including) the repository root
+    parts = path.split('/')
+    return ['/'.join(parts[:i]) for i in range(len(parts), 1, -1)]
+
+
+def _is_in_subtree(path: str, path_prefix: str) -> bool:
+    return not path_prefix or path == path_prefix or path.startswith(f'{path_prefix}/')
+
+
+class SharedSyncState:
+    # lets repositories synced in one process reuse each other's changes feed pages and downloaded blobs
+    def __init__(self):
+        self.blob_index = BlobIndex()
+        self._changes: Dict[str, Tuple[List[Dict[str, Any]], str]] = {}
+        self._lock = threading.Lock()
+        self._page_locks: Dict[str, threading.Lock] = {}
+
+    def list_changes(self, ddm: DriveDataManager, page_token: str) -> Tuple[List[Dict[str, Any]], str]:
+        # the feed covers the whole drive, so repositories pulled together share page tokens
+        with self._lock:
+            page_lock = self._page_locks.setdefault(page_token, threading.Lock())
+        with page_lock:
+            if page_token not in self._changes:
+                self._changes[page_token] = ddm.client.run(ddm.client.list_changes(page_token))
+            return self._changes[page_token]
+
+
+class RepositorySync:
+    # keeps a repository's manifest in memory once a whole-repository pull has loaded it, so repeated pulls only pay
+    # for what changed; pulls of a subtree and the changes feed only read the rows they touch
+    def __init__(
+            self,
+            target_dir_path: Path,
+            sdr_config: Dict[str, Any],
+            jobs: int,
+            shared_state: Optional[SharedSyncState] = None
+        ):
+
+        self._target_dir_path = target_dir_path
+        self._export_defaults: Dict[str, str] = sdr_config['export_types']
+        self._export_formats = get_export_formats(sdr_config)
+        self._jobs = jobs
+        self._chosen_dir_id: Optional[str] = sdr_config.get(constants.CHOSEN_GDRIVE_DIR_ID_KEY, None)
+        self._dedup_mode = sdr_config.get(constants.DEDUP_MODE_KEY, constants.DEFAULT_DEDUP_MODE)
+        self._content_store = get_content_store(
+            target_dir_path, sdr_config.get(constants.CONTENT_STORE_KEY, None), self._dedup_mode
+        )
+        self._shared_state = shared_state
+        if shared_state:
+            self._content_store = SharedContentStore(shared_state.blob_index, self._content_store)
+        self._export_cache = ExportCache(target_dir_path / constants.EXPORT_CACHE_RELPATH, self._dedup_mode)
+        self._failed_paths: Set[str] = set()
+        self._pull_filter = PullFilter.from_config(sdr_config)
+        self._is_lazy: bool = sdr_config.get(constants.LAZY_PULL_KEY, False)
+        self._file_count = 0
+        self._placeholder_count = 0
+        self._written_placeholder_count = 0
+        self._store = ManifestStore(target_dir_path)
+        self._drive_files: Optional[Dict[str, Dict[str, Any]]] = None
+        self._pulled: Optional[Dict[str, Dict[str, Any]]] = None
+        self._page_token = self._store.get_page_token()
+        legacy_page_token: Optional[str] = sdr_config.get(constants.CHANGES_PAGE_TOKEN_KEY, None)
+        if self._page_token is None and legacy_page_token: # kept in the config before the manifest held it
+            self._page_token = legacy_page_token
+            self._store.update_page_token(legacy_page_token)
+
+    @property
+    def target_dir_path(self) -> Path:
+        return self._target_dir_path
+
+    @property
+    def file_count(self) -> int:
+        # files covered by the last pull
+        return self._file_count
+
+    @property
+    def placeholder_count(self) -> int:
+        return self._placeholder_count
+
+    @property
+    def written_placeholder_count(self) -> int:
+        # stale files the last pull wrote placeholders for instead of downloading
+        return self._written_placeholder_count
+
+    def _load_manifest(self) -> Tuple[Dict[str, Dict[str, Any]], Dict[str, Dict[str, Any]]]:
+        if self._drive_files is None or self._pulled is None:
+            with stats.phase('load_manifest'):
+                self._drive_files = self._store.get_files()
+                self._pulled = self._store.get_pulled()
+        return (self._drive_files, self._pulled)
+
+    def _update_pulled(self, upserts: Dict[str, Dict[str, Any]], deletions: List[str]) -> None:
+        self._store.update_pulled(upserts, deletions)
+        if self._pulled is not None:
+            for path in deletions:
+                self._pulled.pop(path, None)
+            self._pulled.update(upserts)
+
+    def _get_trusted_entry(self, manifest: Dict[str, Dict[str, Any]], path: str, is_forced: bool) -> Dict[str, Any]:
+        # the entry a candidate's freshness is judged by: none when forced, and placeholders left by earlier lazy pulls
+        # are downloaded unless the repository is still lazy. Entries of paths that aren't candidates are never touched
+        entry = manifest.get(path, {})
+        return entry if not is_forced and (self._is_lazy or is_hydrated(entry)) else {}
+
+    def _is_stub_wanted(self, path: str, manifest: Dict[str, Dict[str, Any]]) -> bool:
+        # lazy pulls keep hydrated files current and only write placeholders for the rest
+        entry = manifest.get(path, None)
+        return self._is_lazy and (entry is None or not is_hydrated(entry))
+
+    def _write_stub(self, path: str, metadata: Dict[str, Any]) -> None:
+        write_stub(get_local_file_paths(self._target_dir_path, path, metadata, self._export_formats)[0][1], metadata)
+
+    def _apply_changes(self, ddm: DriveDataManager) -> Tuple[int, List[str]]:
+        # bring the drive files up to date from the changes feed since the last pull
+        if not (self._page_token and self._chosen_dir_id):
+            self._page_token = ddm.client.run(ddm.client.get_start_page_token())
+            return (0, list(self._load_manifest()[0]))
+        if self._shared_state:
+            changes, self._page_token = self._shared_state.list_changes(ddm, self._page_token)
+        else:
+            changes, self._page_token = ddm.client.run(ddm.client.list_changes(self._page_token))
+        if not changes:
+            return (0, [])
+        upserts, deletions, old_rows = get_changed_rows(self._store, changes, self._chosen_dir_id, self._export_defaults)
+        moves = apply_local_changes(old_rows, upserts, self._target_dir_path)
+        # pulled entries follow their files, and go with the ones that left the chosen folder
+        moved_entries: Dict[str, Dict[str, Any]] = {}
+        for old_path, new_path in moves.items():
+            entry = self._store.get_pulled(old_path).get(old_path, None)
+            if entry is not None and new_path is not None:
+                moved_entries[new_path] = entry
+        self._update_pulled(moved_entries, [path for path in moves if path not in moved_entries])
+        self._store.update_files(upserts, deletions)
+        if self._drive_files is not None:
+            for path in deletions:
+                self._drive_files.pop(path, None)
+            self._drive_files.update(upserts)
+        return (len(changes), list(upserts))
+
+    def _fetch(
+            self,
+            ddm: DriveDataManager,
+            manifest: Dict[str, Dict[str, Any]],
+            is_forced: bool = False,
+            search_query: Optional[str] = None,
+            path_prefix: str = ''
+        ) -> Tuple[Dict[str, Dict[str, Any]], Dict[str, Dict[str, Any]], Dict[str, Exception]]:
+
+        # re-list the chosen folder, handing stale files to the download workers as soon as their folder is listed
+        old_drive_files, _ = self._load_manifest()
+        old_paths = {
+            metadata['id']: path for (path, metadata) in old_drive_files.items() if metadata['mimeType'] != constants.FOLDER_MIMETYPE
+        }
+        stale_drive_files: Dict[str, Dict[str, Any]] = {}
+
+        async def fetch() -> Tuple[Dict[str, Dict[str, Any]], Dict[str, Exception]]:
+            downloader = DriveFileDownloader(
+                ddm.client, self._target_dir_path, self._export_formats, self._jobs,
+                self._dedup_mode, self._content_store, self._export_cache
+            )
+            queue: 'asyncio.Queue[Tuple[str, Dict[str, Any]]]' = asyncio.Queue(maxsize=constants.PIPELINE_QUEUE_SIZE)
+
+            async def on_file(path: str, metadata: Dict[str, Any]) -> None:
+                old_path = old_paths.get(metadata['id'], None)
+                if old_path is not None and old_path != path: # renamed or moved on Drive
+                    move_local_file(self._target_dir_path, old_path, path)
+                    if old_path in manifest:
+                        manifest[path] = manifest.pop(old_path)
+                if not (_is_in_subtree(path, path_prefix) and self._pull_filter.matches(path, metadata)):
+                    return
+                if search_query and not any(
+                    matches_query(search_query, ancestor_path) for ancestor_path in _get_ancestor_paths(path)
+                ):
+                    return
+                is_fresh = is_up_to_date(
+                    metadata,
+                    self._get_trusted_entry(manifest, path, is_forced),
+                    get_local_file_paths(self._target_dir_path, path, metadata, self._export_formats)
+                )
+                stats.count_cache_lookup('pull_manifest', is_fresh)
+                if not is_fresh:
+                    stale_drive_files[path] = metadata
+                    if self._is_stub_wanted(path, manifest):
+                        self._write_stub(path, metadata)
+                    else:
+                        await queue.put((path, metadata)) # listing pauses while the download workers are behind
+
+            async def download_worker() -> None:
+                while True:
+                    path, metadata = await queue.get()
+                    try:
+                        await downloader.fetch(path, metadata)
+                    finally:
+                        queue.task_done()
+
+            workers = [asyncio.create_task(download_worker()) for _ in range(self._jobs)]
+            try:
+                drive_files = await enumerate_drive_files(
+                    ddm.client, self._chosen_dir_id, self._export_defaults, self._pull_filter, on_file
+                )
+                await queue.join()
+            finally:
+                for worker in workers:
+                    worker.cancel()
+            return (drive_files, downloader.failures)
+
+        drive_files, failures = ddm.client.run(fetch())
+        # moves were applied while listing, so only deletions and emptied folders are left to clean up
+        listed_ids = {metadata['id'] for metadata in drive_files.values()}
+        apply_local_changes(
+            {
+                path: metadata for (path, metadata) in old_drive_files.items()
+                if metadata['mimeType'] == constants.FOLDER_MIMETYPE or metadata['id'] not in listed_ids
+            },
+            drive_files,
+            self._target_dir_path
+        )
+        return (drive_files, stale_drive_files, failures)
+
+    def pull(
+            self,
+            ddm: DriveDataManager,
+            is_forced: bool = False,
+            changed_only: bool = False,
+            fetch: bool = False,
+            search_query: Optional[str] = None,
+            path_prefix: str = ''
+        ) -> Tuple[int, int, Dict[str, Exception]]:
+        """
+        Returns the number of remote changes applied, the number of files that were stale and the failed downloads.
+        With `changed_only`, only files touched by remote changes (or that failed last time) are compared.
+        With `fetch`, the chosen folder is listed again instead of reading the changes feed, downloading while it is listed.
+        With `search_query`, only files matching it, or inside folders matching it, are pulled.
+        With `path_prefix`, only the files under that folder of the repository are compared and pulled.
+        In a lazy repository, files that haven't been hydrated are written as placeholders instead of downloaded.
+        """
+        if not self._page_token and self._chosen_dir_id:
+            # without a feed position edits made since the folder was listed can't be found, so it is listed again
+            fetch = True
+        previous_page_token = self._page_token
+        if fetch and self._chosen_dir_id:
+            with stats.phase('fetch'):
+                old_drive_files, pulled = self._load_manifest()
+                manifest = dict(pulled)
+                # taken before listing, so edits made while the folder is listed are picked up by the next pull
+                self._page_token = ddm.client.run(ddm.client.get_start_page_token())
+                listed_drive_files, stale_drive_files, failures = self._fetch(ddm, manifest, is_forced, search_query, path_prefix)
+                listed_drive_files = {path: cull_metadata(metadata) for (path, metadata) in listed_drive_files.items()}
+                upserts, deletions = diff_rows(old_drive_files, listed_drive_files)
+                self._store.update_files(upserts, deletions)
+                self._drive_files = listed_drive_files
+                drive_files = {path: metadata for (path, metadata) in listed_drive_files.items() if _is_in_subtree(path, path_prefix)}
+                change_count = len(upserts) + len(deletions)
+                manifest = {path: entry for (path, entry) in manifest.items() if path in listed_drive_files}
+        else:
+            with stats.phase('changes'):
+                change_count, changed_paths = self._apply_changes(ddm)
+
+            # only fetch files whose remote revision or local copy differs from the last pull
+            with stats.phase('compare'):
+                if path_prefix: # a subtree's rows are read on their own
+                    drive_files = self._store.get_files(path_prefix)
+                    pulled = self._store.get_pulled(path_prefix)
+                else:
+                    drive_files, pulled = self._load_manifest()
+                manifest = dict(pulled)
+                candidate_paths = (set(changed_paths) | self._failed_paths) if changed_only else drive_files.keys()
+                if search_query:
+                    index = SearchIndex()
+                    index.add_files(drive_files)
+                    hit_paths = {hit.path for hit in index.search(search_query, limit=None)}
+                    candidate_paths = [
+                        path for path in candidate_paths
+                        if any(ancestor_path in hit_paths for ancestor_path in _get_ancestor_paths(path))
+                    ]
+                candidate_drive_files = {
+                    path: drive_files[path]
+                    for path in candidate_paths
+                    if path in drive_files and self._pull_filter.matches(path, drive_files[path])
+                }
+                stale_drive_files = get_stale_drive_files(
+                    candidate_drive_files,
+                    {path: self._get_trusted_entry(manifest, path, is_forced) for path in candidate_drive_files},
+                    self._target_dir_path,
+                    self._export_formats
+                )
+                manifest = {path: entry for (path, entry) in manifest.items() if path in drive_files}
+
+            with stats.phase('stubs'):
+                stub_drive_files = {
+                    path: metadata for (path, metadata) in stale_drive_files.items() if self._is_stub_wanted(path, manifest)
+                }
+                for path, metadata in stub_drive_files.items():
+                    self._write_stub(path, metadata)
+
+            with stats.phase('download'):
+                failures = ddm.client.run(download_drive_files(
+                    ddm.client,
+                    {path: metadata for (path, metadata) in stale_drive_files.items() if path not in stub_drive_files},
+                    self._target_dir_path,
+                    self._export_formats,
+                    self._jobs,
+                    self._dedup_mode,
+                    self._content_store,
+                    self._export_cache
+                ))
+        with stats.phase('save_manifest'):
+            stub_paths = {path for path in stale_drive_files if self._is_stub_wanted(path, manifest)}
+            for path, metadata in stale_drive_files.items():
+                if path not in failures:
+                    remove_stale_exports(self._target_dir_path, path, metadata, manifest.get(path, {}), self._export_formats)
+                    local_file_paths = get_local_file_paths(self._target_dir_path, path, metadata, self._export_formats)
+                    manifest[path] = build_manifest_entry(
+                        metadata,
+                        local_file_paths[0][1],
+                        [export_mimetype for (export_mimetype, _) in local_file_paths if export_mimetype],
+                        hydrated=path not in stub_paths
+                    )
+            if (stale_drive_files or change_count) and not path_prefix: # a subtree doesn't show which exports are unused
+                self._export_cache.prune(self._load_manifest()[0].values())
+            self._update_pulled(*diff_rows(pulled, manifest))
+            if self._page_token != previous_page_token:
+                self._store.update_page_token(self._page_token)
+        self._failed_paths = set(failures)
+        self._written_placeholder_count = len(stub_paths)
+        self._file_count = sum(metadata['mimeType'] != constants.FOLDER_MIMETYPE for metadata in drive_files.values())
+        self._placeholder_count = sum(
+            not is_hydrated(entry) for (path, entry) in manifest.items() if _is_in_subtree(path, path_prefix)
+        )
+        return (change_count, len(stale_drive_files), failures)
+
+    def hydrate(self, ddm: DriveDataManager, patterns: List[str]) -> Tuple[List[str], Dict[str, Exception]]:
+        """
+        Downloads the real contents of placeholders matching `patterns`. Returns the paths selected and the failed downloads.
+        """
+        all_drive_files, pulled = self._load_manifest()
+        paths = select_paths(all_drive_files, pulled, patterns, hydrated=False)
+        drive_files = {path: all_drive_files[path] for path in paths}
+        with stats.phase('download'):
+            failures = ddm.client.run(download_drive_files(
+                ddm.client,
+                drive_files,
+                self._target_dir_path,
+                self._export_formats,
+                self._jobs,
+                self._dedup_mode,
+                self._content_store,
+                self._export_cache
+            ))
+        with stats.phase('save_manifest'):
+            hydrated_entries: Dict[str, Dict[str, Any]] = {}
+            for path, metadata in drive_files.items():
+                if path not in failures:
+                    local_file_paths = get_local_file_paths(self._target_dir_path, path, metadata, self._export_formats)
+                    hydrated_entries[path] = build_manifest_entry(
+                        metadata,
+                        local_file_paths[0][1],
+                        [export_mimetype for (export_mimetype, _) in local_file_paths if export_mimetype]
+                    )
+            self._update_pulled(hydrated_entries, [])
+        return (paths, failures)
+
+    def dehydrate(self, patterns: List[str], is_forced: bool = False) -> Tuple[List[str], List[str]]:
+        """
+        Replaces hydrated files matching `patterns` with placeholders. Files edited since they were pulled are kept unless
+        forced. Returns the paths dehydrated and the modified paths that were kept.
+        """
+        drive_files, pulled = self._load_manifest()
+        paths = select_paths(drive_files, pulled, patterns, hydrated=True)
+        hashes = self._store.get_hashes()
+        # a changed stat alone doesn't make a file modified; its checksum has to differ from the pulled one too
+        unchanged: List[str] = []
+        unhashed: List[Tuple[str, Path]] = []
+        modified: List[str] = []
+        for path in paths:
+            entry = pulled[path]
+            file_path = get_local_file_paths(self._target_dir_path, path, drive_files[path], self._export_formats)[0][1]
+            try:
+                local_stat = file_path.stat()
+            except FileNotFoundError: # nothing left to lose
+                unchanged.append(path)
+                continue
+            file_stat, md5 = hashes.get(path, (None, None))
+            if is_forced or (local_stat.st_size == entry['size'] and local_stat.st_mtime_ns == entry['mtime']):
+                unchanged.append(path)
+            elif entry.get('md5Checksum', None) and file_stat == get_file_stat(local_stat):
+                (unchanged if md5 == entry['md5Checksum'] else modified).append(path)
+            elif entry.get('md5Checksum', None):
+                unhashed.append((path, file_path))
+            else: # exported documents have no checksum to compare against
+                modified.append(path)
+        for (path, _), md5 in zip(unhashed, hash_files([file_path for (_, file_path) in unhashed], self._jobs)):
+            (unchanged if md5 == pulled[path]['md5Checksum'] else modified).append(path)
+
+        dehydrated_entries: Dict[str, Dict[str, Any]] = {}
+        for path in unchanged:
+            metadata = drive_files[path]
+            local_file_paths = get_local_file_paths(self._target_dir_path, path, metadata, self._export_formats)
+            for _, file_path in local_file_paths[1:]:
+                file_path.unlink(missing_ok=True)
+            self._write_stub(path, metadata)
+            # the revision keys stay those of the pulled contents, so the next pull still notices remote edits
+            local_stat = local_file_paths[0][1].stat()
+            dehydrated_entries[path] = {
+                **pulled[path], 'size': local_stat.st_size, 'mtime': local_stat.st_mtime_ns, 'hydrated': False
+            }
+        self._update_pulled(dehydrated_entries, [])
+        self._store.update_hashes({}, list(dehydrated_entries))
+        return (sorted(unchanged), sorted(modified))
+
+    def close(self) -> None:
+        self._store.close()
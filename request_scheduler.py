@@ -0,0 +1,108 @@
+import random
+import threading
+import time
+from typing import Dict, Any, Callable, Tuple, TypeVar
+import httplib2
+from googleapiclient.errors import HttpError
+import constants
+import stats
+
+
+T = TypeVar('T')
+
+
+class ThrottledError(Exception):
+    pass
+
+
+class TransientError(Exception):
+    pass
+
+
+def _classify_error(error: Exception) -> Tuple[bool, bool]:
+    """Returns whether the error signals throttling, and whether it is worth retrying."""
+    if isinstance(error, ThrottledError):
+        return (True, True)
+    if isinstance(error, TransientError):
+        return (False, True)
+    if isinstance(error, HttpError):
+        status = error.resp.status
+        content = error.content.decode('utf-8', errors='ignore') if isinstance(error.content, bytes) else str(error.content)
+        if status == 429 or (status == 403 and any(reason in content for reason in constants.RATE_LIMIT_REASONS)):
+            return (True, True)
+        return (False, status >= 500)
+    if isinstance(error, (httplib2.HttpLib2Error, OSError)):
+        return (False, True)
+    return (False, False)
+
+
+class RequestScheduler:
+    def __init__(self, requests_per_second: float, burst: int, max_concurrency: int):
+        self._rate = requests_per_second
+        self._burst = burst
+        self._tokens = float(burst)
+        self._last_refill = time.monotonic()
+        self._max_concurrency = max_concurrency
+        self._concurrency_limit = float(max_concurrency)
+        self._last_decrease = float('-inf')
+        self._in_flight = 0
+        self._condition = threading.Condition()
+
+    @property
+    def concurrency_limit(self) -> int:
+        return int(self._concurrency_limit)
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self._burst, self._tokens + (now - self._last_refill) * self._rate)
+        self._last_refill = now
+
+    def _acquire(self) -> float:
+        # returns when the request was let through, so its response can be matched against the last back-off
+        with self._condition:
+            while True:
+                self._refill()
+                if self._in_flight < int(self._concurrency_limit) and self._tokens >= 1:
+                    self._tokens -= 1
+                    self._in_flight += 1
+                    return time.monotonic()
+                self._condition.wait(timeout=(1 - self._tokens) / self._rate if self._tokens < 1 else None)
+
+    def _release(self, started_at: float, is_throttled: bool) -> None:
+        with self._condition:
+            self._in_flight -= 1
+            # AIMD: back off multiplicatively on throttling, otherwise grow by roughly one slot per window. Requests
+            # sent before the last back-off were throttled at the old limit, so they don't halve it again
+            if is_throttled:
+                if started_at >= self._last_decrease:
+                    self._concurrency_limit = max(1.0, self._concurrency_limit / 2)
+                    self._last_decrease = time.monotonic()
+            else:
+                self._concurrency_limit = min(self._max_concurrency, self._concurrency_limit + 1 / self._concurrency_limit)
+            self._condition.notify_all()
+
+    def execute(self, kind: str, request: Callable[[], T]) -> T:
+        for attempt in range(constants.REQUEST_RETRIES):
+            started_at = self._acquire()
+            try:
+                result = request()
+            except Exception as e:
+                is_throttled, is_retryable = _classify_error(e)
+                self._release(started_at, is_throttled)
+                if not is_retryable or attempt == constants.REQUEST_RETRIES - 1:
+                    raise
+                stats.count_retry(kind)
+                # exponential backoff with full jitter
+                time.sleep(random.uniform(0, min(constants.MAX_BACKOFF_SECONDS, 2 ** attempt)))
+                continue
+            self._release(started_at, False)
+            return result
+        raise AssertionError('unreachable')
+
+
+def create_request_scheduler(sdr_config: Dict[str, Any]) -> RequestScheduler:
+    return RequestScheduler(
+        sdr_config.get(constants.REQUESTS_PER_SECOND_KEY, constants.DEFAULT_REQUESTS_PER_SECOND),
+        sdr_config.get(constants.REQUEST_BURST_KEY, constants.DEFAULT_REQUEST_BURST),
+        sdr_config.get(constants.MAX_CONCURRENCY_KEY, constants.DEFAULT_MAX_CONCURRENCY)
+    )
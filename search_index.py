@@ -0,0 +1,193 @@
+import asyncio
+import bisect
+import heapq
+from typing import Dict, Any, Iterable, List, NamedTuple, Optional, Set, Tuple
+import constants
+from drive_client import AsyncDriveClient
+from utils import get_virtual_file_name, quote_query_value
+
+
+class SearchHit(NamedTuple):
+    path: str
+    metadata: Dict[str, Any]
+
+    @property
+    def is_dir(self) -> bool:
+        return self.metadata.get('mimeType', None) == constants.FOLDER_MIMETYPE
+
+
+def _get_name(path: str) -> str:
+    return path.rsplit('/', 1)[-1]
+
+
+def _get_trigrams(text: str) -> Set[str]:
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def _split_query(query: str) -> Tuple[str, str]:
+    # `plan/meet` finds `meeting.pdf` in folders whose names end in `plan`; a query without `/` is matched anywhere in names
+    query = query.strip().lower().rstrip('/')
+    if '/' not in query:
+        return ('', query)
+    head, tail = query.rsplit('/', 1)
+    return (f'{head}/', tail)
+
+
+def matches_query(query: str, path: str) -> bool:
+    head, tail = _split_query(query)
+    name = _get_name(path).lower()
+    if not head:
+        return tail in name
+    return name.startswith(tail) and path[:len(path) - len(name)].lower().endswith(head)
+
+
+class SearchIndex:
+    """
+    Finds Drive files by name or path without contacting Drive. Name queries are answered from a trigram index over
+    lower-cased names, and path queries (or names too short for a trigram) from a sorted list of names.
+    """
+    def __init__(self):
+        self._paths: List[str] = []
+        self._metadata: List[Dict[str, Any]] = []
+        self._entries_by_id: Dict[str, int] = {}
+        self._name_postings: Dict[str, Set[int]] = {}
+        self._names: List[Tuple[str, int]] = []
+        self._are_names_sorted = True
+        self._listed_folder_ids: Set[str] = set()
+
+    def __len__(self) -> int:
+        return len(self._paths)
+
+    def add(self, path: str, metadata: Dict[str, Any]) -> None:
+        # a file with several parents is indexed under the first path it was seen at
+        file_id = metadata.get('id', None)
+        if file_id is None or 'mimeType' not in metadata or file_id in self._entries_by_id:
+            return
+        entry = len(self._paths)
+        self._paths.append(path)
+        self._metadata.append(metadata)
+        self._entries_by_id[file_id] = entry
+        name = _get_name(path).lower()
+        for trigram in _get_trigrams(name):
+            self._name_postings.setdefault(trigram, set()).add(entry)
+        self._names.append((name, entry))
+        self._are_names_sorted = False
+
+    def add_files(self, drive_files: Dict[str, Dict[str, Any]], base_path: str = '') -> None:
+        for path, metadata in drive_files.items():
+            self.add(f'{base_path}{path}', metadata)
+
+    def add_listings(
+            self,
+            listings: Dict[str, List[Dict[str, Any]]],
+            root_dir_id: str,
+            root_dir_path: str,
+            export_defaults: Dict[str, str]
+        ) -> None:
+
+        # cached listings are keyed by folder, so paths are rebuilt by walking down from the root
+        level = [(root_dir_id, root_dir_path)]
+        while level:
+            next_level = []
+            for dir_id, dir_path in level:
+                if dir_id not in listings or dir_id in self._listed_folder_ids:
+                    continue
+                self._listed_folder_ids.add(dir_id)
+                for metadata in listings[dir_id]:
+                    path = f'{dir_path}/{get_virtual_file_name(metadata, export_defaults)}'
+                    self.add(path, metadata)
+                    if metadata['mimeType'] == constants.FOLDER_MIMETYPE:
+                        next_level.append((metadata['id'], self.get_path(metadata['id'])))
+            level = next_level
+
+    def mark_listed(self, folder_ids: Iterable[str]) -> None:
+        self._listed_folder_ids.update(folder_ids)
+
+    def get_path(self, file_id: str) -> Optional[str]:
+        entry = self._entries_by_id.get(file_id, None)
+        return None if entry is None else self._paths[entry]
+
+    @property
+    def is_complete(self) -> bool:
+        # every indexed folder has had its contents indexed too
+        return all(
+            metadata['id'] in self._listed_folder_ids
+            for metadata in self._metadata
+            if metadata['mimeType'] == constants.FOLDER_MIMETYPE
+        )
+
+    def _get_candidates(self, head: str, tail: str) -> Iterable[int]:
+        if not head and len(tail) >= 3:
+            postings = sorted((self._name_postings.get(trigram, set()) for trigram in _get_trigrams(tail)), key=len)
+            return set.intersection(*postings)
+        # a path query's last part begins the name; short name queries are matched as prefixes too
+        if not self._are_names_sorted:
+            self._names.sort()
+            self._are_names_sorted = True
+        start = bisect.bisect_left(self._names, (tail, -1))
+        end = bisect.bisect_left(self._names, (tail + '\uffff', -1))
+        return [entry for (_, entry) in self._names[start:end]]
+
+    def search(self, query: str, limit: Optional[int] = constants.SEARCH_RESULT_LIMIT) -> List[SearchHit]:
+        head, tail = _split_query(query)
+        if not tail:
+            return []
+        entries = [entry for entry in self._get_candidates(head, tail) if matches_query(query, self._paths[entry])]
+
+        # exact names first, then name prefixes, then shallower paths
+        def rank(entry: int) -> Tuple[int, int, str]:
+            name = _get_name(self._paths[entry]).lower()
+            return (0 if name == tail else 1 if name.startswith(tail) else 2, self._paths[entry].count('/'), self._paths[entry])
+        entries = sorted(entries, key=rank) if limit is None else heapq.nsmallest(limit, entries, key=rank)
+        return [SearchHit(self._paths[entry], self._metadata[entry]) for entry in entries]
+
+
+async def search_drive(
+        client: AsyncDriveClient,
+        query: str,
+        index: SearchIndex,
+        root_dir_path: str,
+        export_defaults: Dict[str, str],
+        limit: int = constants.SEARCH_RESULT_LIMIT
+    ) -> List[SearchHit]:
+    """
+    Asks Drive for files whose title contains the last component of `query` and which aren't indexed yet. Their paths are
+    resolved through their parents, which are added to the index along the way; files outside My Drive are left out.
+    """
+    title = query.strip().strip('/').rsplit('/', 1)[-1]
+    if not title:
+        return []
+    items = await client.list_files(constants.GDRIVE_TITLE_SEARCH_QUERY.format(quote_query_value(title)))
+    parent_lookups: Dict[str, 'asyncio.Task[Optional[str]]'] = {}
+
+    async def resolve_parent_path(parent_id: str, depth: int) -> Optional[str]:
+        return await resolve_path(await client.get_metadata(parent_id), depth + 1)
+
+    async def resolve_path(metadata: Dict[str, Any], depth: int = 0) -> Optional[str]:
+        known_path = index.get_path(metadata['id'])
+        if known_path is not None:
+            return known_path
+        parents: List[Dict[str, Any]] = metadata.get('parents', [])
+        if not parents or depth > constants.SEARCH_MAX_PARENT_DEPTH:
+            return None
+        if parents[0].get('isRoot', False):
+            parent_path: Optional[str] = root_dir_path
+        else:
+            parent_path = index.get_path(parents[0]['id'])
+            if parent_path is None: # hits sharing a folder share its lookup
+                if parents[0]['id'] not in parent_lookups:
+                    parent_lookups[parents[0]['id']] = asyncio.create_task(resolve_parent_path(parents[0]['id'], depth))
+                parent_path = await parent_lookups[parents[0]['id']]
+        if parent_path is None:
+            return None
+        index.add(f'{parent_path}/{get_virtual_file_name(metadata, export_defaults)}', metadata)
+        return index.get_path(metadata['id'])
+
+    # files already indexed were part of the local results
+    unindexed_items = [metadata for metadata in items if index.get_path(metadata['id']) is None]
+    paths = await asyncio.gather(*(resolve_path(metadata) for metadata in unindexed_items))
+    hits = [
+        SearchHit(path, metadata) for (path, metadata) in zip(paths, unindexed_items)
+        if path is not None and matches_query(query, path)
+    ]
+    return hits[:limit]
@@ -6,7 +6,6 @@ setup(
     py_modules=['sourcedrive'],
     install_requires=[
         'Click',
-        'FS',
         'PyDrive'
     ],
     entry_points='''
@@ -1,79 +1,491 @@
 # TODO: use constants for error messages and dictionary keys
 
-import os
-
-from fs.tempfs import TempFS
-from gdrive_utils import get_drive_instance, dir_enumerate
 from json.decoder import JSONDecodeError
 import click
 from pathlib import Path
-from gdrive_repl import run_repl
 from click.core import Context
-from utils import get_path, get_input, no_stdout
+from utils import get_path, get_input, update_sdr_config, find_repositories, find_repository_root, no_stdout, get_local_file_path
+from pull_filter import PullFilter, filter_options
 import json
 import constants
-from typing import Dict, Any
+import stats
+from typing import Dict, Any, List, Optional, Tuple
+
+# Drive, filesystem and REPL modules are imported by the commands that use them, keeping startup fast
 
 
 @click.group()
-def sdr() -> None:
+@click.option('--stats', 'stats_format', type=click.Choice(['text', 'json']), help='Report timings and API usage on exit')
+@click.option('--trace', 'trace_path', type=click.Path(dir_okay=False), help='Write a Chrome trace of the run to this file')
+@click.pass_context
+def sdr(context: Context, stats_format: str, trace_path: str) -> None:
     """Top-level SourceDrive command"""
+    if not stats_format and not trace_path:
+        return
+    stats.enable(is_tracing=bool(trace_path))
 
+    def report() -> None:
+        if stats_format == 'json':
+            click.echo(json.dumps(stats.get_report(), indent=4), err=True)
+        elif stats_format == 'text':
+            click.echo(stats.format_report(stats.get_report()), err=True)
+        if trace_path:
+            stats.write_trace(trace_path)
+    context.call_on_close(report)
 
-@sdr.command()
-@click.argument('dir', required=False)
-@click.option('-s, --search', 'should_search', is_flag=True)
-@click.option('-f, --force', 'is_forced', is_flag=True)
-@click.option('-i, --interactive', 'is_interactive', is_flag=True)
-@click.option('--fetch/--no-fetch', default=True)
-def pull(dir: str, should_search: bool, is_forced: bool, is_interactive: bool, fetch: bool) -> None:
-    """
-    Safe-sync the specified directory if it is marked as a SourceDrive repository.
-    If no directory is provided, the current directory is used.
-    """
-    target_dir_path: Path = get_path(dir)
 
+def _read_sdr_config(target_dir_path: Path) -> Optional[Dict[str, Any]]:
     sdr_config: Dict[str, Any] = {}
-    export_defaults: Dict[str, str] = {}
-    chosen_gdrive_dir_path: str
     with (target_dir_path / constants.SDR_CONFIG_RELPATH).open('r') as sdr_config_file:
         try:
             sdr_config = json.load(sdr_config_file)
         except JSONDecodeError:
             click.echo('Could not parse SourceDrive configurations from `config.json`. \
                 Run `sdr configure` to attempt to fix configurations.')
-            return
+            return None
+    if constants.CHOSEN_GDRIVE_DIR_PATH_KEY not in sdr_config:
+        click.echo('Error: Could not read targeted Google Drive directory from `config.json`. \
+            Run `sdr init` to initialise a repository.')
+        return None
+    if 'export_types' not in sdr_config:
+        click.echo('Error: Could not read default export types from `config.json`. \
+            Run `sdr configure` to attempt to fix configurations.')
+        return None
+    return sdr_config
+
+
+@sdr.command()
+@click.argument('dir', required=False)
+@click.option('-s', '--search', 'search_query', help='Only pull files whose name contains this, or that sit in folders whose name does')
+@click.option('-f', '--force', 'is_forced', is_flag=True, help='Ignore the manifest and pull every file again')
+@click.option('-i', '--interactive', 'is_interactive', is_flag=True)
+@click.option('-j', '--jobs', 'jobs', type=click.IntRange(min=1))
+@click.option('--fetch/--no-fetch', default=False, help='List the whole folder again instead of reading the changes feed, downloading as it is listed')
+@click.option('--lazy/--eager', 'is_lazy', default=None, help='Write placeholders for files until `sdr hydrate` fetches them (remembered)')
+@filter_options
+def pull(
+        dir: str,
+        search_query: Optional[str],
+        is_forced: bool,
+        is_interactive: bool,
+        jobs: int,
+        fetch: bool,
+        is_lazy: Optional[bool],
+        include: Tuple[str, ...],
+        exclude: Tuple[str, ...],
+        mimetypes: Tuple[str, ...],
+        exclude_mimetypes: Tuple[str, ...],
+        max_size: Optional[int],
+        is_filter_reset: bool
+    ) -> None:
+    """
+    Safe-sync the specified directory if it is marked as a SourceDrive repository, or only the specified folder if it
+    is inside one. If no directory is provided, the current directory is used.
+    """
+    from drive_data_manager import DriveDataManager
+    from drive_client import set_request_scheduler
+    from request_scheduler import create_request_scheduler
+    from repo_sync import RepositorySync
+    target_dir_path: Path = get_path(dir)
+    path_prefix = ''
+    repo_path = find_repository_root(target_dir_path.resolve())
+    if repo_path is not None and repo_path != target_dir_path.resolve():
+        path_prefix = '/' + target_dir_path.resolve().relative_to(repo_path).as_posix()
+        target_dir_path = repo_path
+
+    sdr_config = _read_sdr_config(target_dir_path)
+    if sdr_config is None:
+        return
+
+    if jobs is None:
+        jobs = sdr_config.get(constants.PULL_JOBS_KEY, constants.DEFAULT_PULL_JOBS)
+    else:
+        update_sdr_config(target_dir_path, {constants.PULL_JOBS_KEY: jobs})
+    if include or exclude or mimetypes or exclude_mimetypes or max_size is not None or is_filter_reset:
+        previous_pull_filter = PullFilter.from_config(sdr_config)
+        pull_filter = previous_pull_filter.updated(
+            include, exclude, mimetypes, exclude_mimetypes, max_size, is_filter_reset
+        )
+        if not fetch and not pull_filter.is_narrower_than(previous_pull_filter):
+            # files the old filters kept out were never listed, and the changes feed only reports them once they change
+            click.echo('The filters now admit files that may not have been listed, so the folder is listed again.')
+            fetch = True
+        sdr_config[constants.PULL_FILTERS_KEY] = pull_filter.to_config()
+        update_sdr_config(target_dir_path, {constants.PULL_FILTERS_KEY: pull_filter.to_config()})
+    if is_lazy is not None:
+        sdr_config[constants.LAZY_PULL_KEY] = is_lazy
+        update_sdr_config(target_dir_path, {constants.LAZY_PULL_KEY: is_lazy})
+
+    set_request_scheduler(create_request_scheduler(sdr_config))
+    ddm = DriveDataManager(target_dir_path=target_dir_path)
+
+    sync = RepositorySync(target_dir_path, sdr_config, jobs)
+    try:
+        _, stale_count, failures = sync.pull(ddm, is_forced, fetch=fetch, search_query=search_query, path_prefix=path_prefix)
+    finally:
+        ddm.close()
+        sync.close()
+
+    pulled_count = stale_count - sync.written_placeholder_count - len(failures)
+    if search_query:
+        click.echo(f'Pulled {pulled_count} file(s) matching `{search_query}`.')
+    else:
+        click.echo(f'Pulled {pulled_count} file(s), {sync.file_count - stale_count} already up to date.')
+    if sync.written_placeholder_count:
+        click.echo(f'Wrote {sync.written_placeholder_count} placeholder(s).')
+    if sync.placeholder_count:
+        click.echo(f'{sync.placeholder_count} file(s) are placeholders. Run `sdr hydrate` to download them.')
+    for path, error in failures.items():
+        click.echo(f'Error: Failed to pull `{path}`: {error}')
+    if failures:
+        click.echo(f'{len(failures)} file(s) could not be pulled. Re-run `sdr pull` to retry.')
+
+
+@sdr.command()
+@click.argument('dir', required=False)
+def status(dir: str) -> None:
+    """
+    Show how the working copy differs from the last pull, without contacting Google Drive.
+    """
+    from drive_manifest import ManifestStore
+    from hydration import is_hydrated
+    from local_status import get_status
+    target_dir_path: Path = get_path(dir)
+
+    sdr_config = _read_sdr_config(target_dir_path)
+    if sdr_config is None:
+        return
+    store = ManifestStore(target_dir_path)
+    pulled = store.get_pulled()
+    repo_status = get_status(
+        target_dir_path, store.get_files(), pulled, store.get_hashes(), PullFilter.from_config(sdr_config)
+    )
+    store.close()
+
+    if not any(repo_status.values()):
+        click.echo('Working copy matches the last pull.')
+    for label, paths in repo_status.items():
+        if paths:
+            click.echo(f'{label.capitalize()} ({len(paths)}):')
+            click.echo('\n'.join(f'  {path}' for path in paths))
+    placeholder_count = sum(not is_hydrated(entry) for entry in pulled.values())
+    if placeholder_count:
+        click.echo(f'{placeholder_count} file(s) are placeholders. Run `sdr hydrate` to download them.')
+
+
+@sdr.command()
+@click.argument('dir', required=False)
+@click.option('-j', '--jobs', 'jobs', type=click.IntRange(min=1), help='Hashing processes (defaults to the CPU count)')
+@click.pass_context
+def verify(context: Context, dir: str, jobs: int) -> None:
+    """
+    Check every pulled file's contents against the checksums recorded by Google Drive.
+    Files unchanged since they were last verified are not hashed again.
+    """
+    import os
+    from drive_manifest import ManifestStore
+    from local_status import verify_files
+    target_dir_path: Path = get_path(dir)
+
+    if _read_sdr_config(target_dir_path) is None:
+        return
+    store = ManifestStore(target_dir_path)
+    pulled = store.get_pulled()
+    hashes = store.get_hashes()
+    with stats.phase('verify'):
+        problems, updated_hashes, hashed_count = verify_files(
+            target_dir_path, store.get_files(), pulled, hashes, jobs or os.cpu_count() or 1
+        )
+    store.update_hashes(updated_hashes, [path for path in hashes if path not in pulled])
+    store.close()
+
+    for path, problem in sorted(problems.items()):
+        click.echo(f'{problem}: {path}')
+    click.echo(f'Verified {len(pulled) - len(problems)} of {len(pulled)} file(s), hashing {hashed_count}.')
+    if problems:
+        context.exit(1)
+
+
+@sdr.command()
+@click.argument('dir', required=False)
+@click.option('-j', '--jobs', 'jobs', type=click.IntRange(min=1))
+@click.option('-f', '--force', 'is_forced', is_flag=True, help='Overwrite files that changed on Drive since the last pull')
+@click.pass_context
+def push(context: Context, dir: str, jobs: int, is_forced: bool) -> None:
+    """
+    Upload local edits and new files in the specified repository to Google Drive. Only files whose contents differ
+    from the last pull are sent, and files that also changed on Drive are refused unless forced.
+    """
+    from drive_data_manager import DriveDataManager
+    from drive_client import set_request_scheduler
+    from drive_manifest import ManifestStore
+    from request_scheduler import create_request_scheduler
+    from local_status import get_file_stat
+    from pull_utils import build_manifest_entry
+    from push_utils import get_push_candidates, find_conflicts, create_parent_folders, upload_files
+    target_dir_path: Path = get_path(dir)
+
+    sdr_config = _read_sdr_config(target_dir_path)
+    if sdr_config is None:
+        return
+    jobs = jobs or sdr_config.get(constants.PULL_JOBS_KEY, constants.DEFAULT_PULL_JOBS)
+    store = ManifestStore(target_dir_path)
+    drive_files = store.get_files()
+    pulled = store.get_pulled()
+    with stats.phase('compare'):
+        candidates, skipped, updated_hashes = get_push_candidates(
+            target_dir_path, drive_files, pulled, store.get_hashes(), PullFilter.from_config(sdr_config), jobs
+        )
+    store.update_hashes(updated_hashes, [])
+    # files that were only touched match Drive again, so their pulled entries take the new stat
+    store.update_pulled({
+        path: {**pulled[path], 'size': file_stat[0], 'mtime': file_stat[1]}
+        for (path, (file_stat, _)) in updated_hashes.items()
+        if path not in candidates
+    }, [])
+    for path in skipped:
+        click.echo(f'Skipping `{path}`: Google Docs files can only be edited on Drive.')
+    if not candidates:
+        store.close()
+        click.echo('Nothing to push.')
+        return
+
+    set_request_scheduler(create_request_scheduler(sdr_config))
+    ddm = DriveDataManager(target_dir_path=target_dir_path)
+    try:
+        with stats.phase('conflicts'):
+            conflicts = ddm.client.run(find_conflicts(ddm.client, candidates, pulled, jobs))
+        if not is_forced:
+            candidates = {path: file_id for (path, file_id) in candidates.items() if path not in conflicts}
+        else: # files deleted remotely are pushed again as new ones
+            candidates.update({path: None for (path, reason) in conflicts.items() if reason == 'deleted on Drive'})
+        with stats.phase('upload'):
+            folder_ids, created_folders = ddm.client.run(create_parent_folders(
+                ddm.client, [path for (path, file_id) in candidates.items() if not file_id],
+                drive_files, sdr_config[constants.CHOSEN_GDRIVE_DIR_ID_KEY]
+            ))
+            uploaded, failures = ddm.client.run(upload_files(
+                ddm.client, candidates, drive_files, folder_ids, target_dir_path, jobs
+            ))
+    finally:
+        ddm.close()
+
+    # the pushed revisions become the pulled ones, so the next pull doesn't download them back
+    with stats.phase('save_manifest'):
+        pushed_entries: Dict[str, Dict[str, Any]] = {}
+        pushed_hashes: Dict[str, Any] = {}
+        for path, metadata in uploaded.items():
+            file_path = get_local_file_path(target_dir_path, path)
+            pushed_entries[path] = build_manifest_entry(metadata, file_path)
+            pushed_hashes[path] = (get_file_stat(file_path.stat()), metadata.get('md5Checksum', None))
+        store.update_files({**created_folders, **uploaded}, [])
+        store.update_pulled(pushed_entries, [])
+        store.update_hashes(pushed_hashes, [])
+        store.close()
+
+    click.echo(f'Pushed {len(uploaded)} file(s).')
+    for path, reason in sorted(conflicts.items()):
+        click.echo(f'{"Overwrote" if is_forced else "Conflict"}: `{path}` {reason}.')
+    for path, error in failures.items():
+        click.echo(f'Error: Failed to push `{path}`: {error}')
+    if conflicts and not is_forced:
+        click.echo(f'{len(conflicts)} file(s) were not pushed. Pull first, or re-run with `--force` to overwrite them.')
+    if failures:
+        click.echo(f'{len(failures)} file(s) could not be pushed. Re-run `sdr push` to resume.')
+    if failures or (conflicts and not is_forced):
+        context.exit(1)
+
+
+@sdr.command()
+@click.argument('patterns', nargs=-1, required=True)
+@click.option('-d', '--dir', 'dir', help='Repository to hydrate (defaults to the current directory)')
+@click.option('-j', '--jobs', 'jobs', type=click.IntRange(min=1))
+@click.pass_context
+def hydrate(context: Context, patterns: Tuple[str, ...], dir: str, jobs: int) -> None:
+    """
+    Download the real contents of placeholders written by `sdr pull --lazy`. Patterns are globs matched against
+    repository paths like pull filters, so `*.psd` matches at any depth and a folder's path selects everything inside it.
+    """
+    from drive_data_manager import DriveDataManager
+    from drive_client import set_request_scheduler
+    from request_scheduler import create_request_scheduler
+    from repo_sync import RepositorySync
+    target_dir_path: Path = get_path(dir)
+
+    sdr_config = _read_sdr_config(target_dir_path)
+    if sdr_config is None:
+        return
+    set_request_scheduler(create_request_scheduler(sdr_config))
+    ddm = DriveDataManager(target_dir_path=target_dir_path)
+    sync = RepositorySync(target_dir_path, sdr_config, jobs or sdr_config.get(constants.PULL_JOBS_KEY, constants.DEFAULT_PULL_JOBS))
+    try:
+        paths, failures = sync.hydrate(ddm, list(patterns))
+    finally:
+        ddm.close()
+        sync.close()
+
+    if not paths:
+        click.echo('No placeholders match.')
+        return
+    click.echo(f'Hydrated {len(paths) - len(failures)} file(s).')
+    for path, error in failures.items():
+        click.echo(f'Error: Failed to hydrate `{path}`: {error}')
+    if failures:
+        click.echo(f'{len(failures)} file(s) could not be hydrated. Run `sdr pull` if they changed on Drive, then retry.')
+        context.exit(1)
+
+
+@sdr.command()
+@click.argument('patterns', nargs=-1, required=True)
+@click.option('-d', '--dir', 'dir', help='Repository to dehydrate (defaults to the current directory)')
+@click.option('-f', '--force', 'is_forced', is_flag=True, help='Discard local edits to the matching files')
+def dehydrate(patterns: Tuple[str, ...], dir: str, is_forced: bool) -> None:
+    """
+    Replace pulled files with placeholders to free local space; `sdr hydrate` fetches them again.
+    Files edited since the last pull are kept unless forced.
+    """
+    from repo_sync import RepositorySync
+    target_dir_path: Path = get_path(dir)
+
+    sdr_config = _read_sdr_config(target_dir_path)
+    if sdr_config is None:
+        return
+    sync = RepositorySync(target_dir_path, sdr_config, sdr_config.get(constants.PULL_JOBS_KEY, constants.DEFAULT_PULL_JOBS))
+    try:
+        dehydrated, modified = sync.dehydrate(list(patterns), is_forced)
+    finally:
+        sync.close()
+
+    click.echo(f'Dehydrated {len(dehydrated)} file(s).')
+    for path in modified:
+        click.echo(f'Kept `{path}`: it was edited since the last pull.')
+    if modified:
+        click.echo(f'{len(modified)} file(s) were kept. Push them first, or re-run with `--force` to discard the edits.')
+
+
+@sdr.command(name='pull-all')
+@click.argument('repos', nargs=-1, type=click.Path(file_okay=False, exists=True))
+@click.option('-r', '--repo-list', 'repo_list_file', type=click.File('r'), help='File listing repository paths, one per line')
+@click.option('--scan', 'scan_dir', type=click.Path(file_okay=False, exists=True), help='Pull every repository under this directory')
+@click.option('-j', '--jobs', 'jobs', type=click.IntRange(min=1), help='Concurrent downloads per repository')
+@click.option('-p', '--parallel', default=4, show_default=True, type=click.IntRange(min=1), help='Repositories pulled at once')
+def pull_all(repos: List[str], repo_list_file: Any, scan_dir: str, jobs: int, parallel: int) -> None:
+    """
+    Pull several SourceDrive repositories in one process. Repositories signed in to the same Google account share a
+    Drive session, connection pool and changes feed, and all of them share a rate limiter. If no repositories are given,
+    the working directory is scanned for them.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    from drive_data_manager import DriveDataManager
+    from drive_client import set_request_scheduler, get_drive_instance, get_account_id
+    from request_scheduler import create_request_scheduler
+    from repo_sync import RepositorySync, SharedSyncState
+
+    repo_paths = [Path(repo) for repo in repos]
+    if repo_list_file:
+        repo_paths += [Path(line.strip()) for line in repo_list_file if line.strip()]
+    if scan_dir or not repo_paths:
+        repo_paths += find_repositories(get_path(scan_dir))
+    sdr_configs: Dict[Path, Dict[str, Any]] = {}
+    for repo_path in dict.fromkeys(repo_path.resolve() for repo_path in repo_paths):
+        sdr_config = _read_sdr_config(repo_path) if (repo_path / constants.SDR_CONFIG_RELPATH).exists() else None
+        if sdr_config is None:
+            click.echo(f'Skipping `{repo_path}`.')
+            continue
+        sdr_configs[repo_path] = sdr_config
+    if not sdr_configs:
+        click.echo('No SourceDrive repositories to pull.')
+        return
+
+    # the first repository's rate limits serve every repository
+    set_request_scheduler(create_request_scheduler(sdr_configs[next(iter(sdr_configs))]))
+    # the changes feed and folder IDs such as `root` belong to an account, so each account gets its own session
+    account_sessions: Dict[str, Tuple[DriveDataManager, SharedSyncState]] = {}
+    repo_sessions: Dict[Path, Tuple[DriveDataManager, SharedSyncState]] = {}
+    failed_repo_count = 0
+    for repo_path in sdr_configs:
         try:
-            chosen_gdrive_dir_path = sdr_config[constants.CHOSEN_GDRIVE_DIR_PATH_KEY]
-        except KeyError:
-            click.echo('Error: Could not read targeted Google Drive directory from `config.json`. \
-                Run `sdr init` to initialise a repository.')
-            return
+            with stats.phase('auth'), no_stdout():
+                drive = get_drive_instance(repo_path)
+                account_id = get_account_id(drive)
+        except Exception as e:
+            click.echo(f'Error: Failed to sign in for `{repo_path}`: {e}')
+            failed_repo_count += 1
+            continue
+        if account_id not in account_sessions:
+            account_sessions[account_id] = (DriveDataManager(drive=drive), SharedSyncState())
+        repo_sessions[repo_path] = account_sessions[account_id]
+
+    def pull_repository(repo_path: Path) -> Tuple[int, int, int, Dict[str, Exception]]:
+        # each repository keeps at most `jobs` requests queued on the shared pool, so the pool serves them in turn
+        sdr_config = sdr_configs[repo_path]
+        ddm, shared_state = repo_sessions[repo_path]
+        sync = RepositorySync(
+            repo_path, sdr_config, jobs or sdr_config.get(constants.PULL_JOBS_KEY, constants.DEFAULT_PULL_JOBS), shared_state
+        )
         try:
-            export_defaults = ['export_types']
-        except KeyError:
-            click.echo('Error: Could not read default export types from `config.json`. \
-                Run `sdr configure` to attempt to fix configurations.')
-            return
+            _, stale_count, failures = sync.pull(ddm)
+            return (sync.file_count, stale_count, sync.written_placeholder_count, failures)
+        finally:
+            sync.close()
 
-    with no_stdout():
-        drive = get_drive_instance()
-    
-    if fetch:
-        tree = TempFS()           # re-enumerate files in targeted directory
-            
-    # read out the drive files' configs
-    drive_files: Dict[str, Any] = {}
-    with (target_dir_path / constants.DRIVE_FILES_RELPATH).open('r') as drive_files_file:
-        drive_files = json.load(drive_files_file)
-
-    for path, drive_file_metadata in drive_files.items():
-        if drive_file_metadata['mimeType'] == constants.FOLDER_MIMETYPE:
-            continue
-        current_file = drive.CreateFile(metadata=drive_file_metadata)
-        abs_file_path = Path(path.strip(os.sep)).resolve()
-        abs_file_path.parent.mkdir(parents=True, exist_ok=True)
-        current_file.GetContentFile(str(abs_file_path), mimetype=export_defaults.get(current_file['mimeType'], None))
+    with ThreadPoolExecutor(max_workers=parallel, thread_name_prefix='sdr-repo') as executor:
+        futures = {repo_path: executor.submit(pull_repository, repo_path) for repo_path in repo_sessions}
+        for repo_path, future in futures.items():
+            try:
+                file_count, stale_count, written_placeholder_count, failures = future.result()
+            except Exception as e:
+                click.echo(f'Error: Failed to pull `{repo_path}`: {e}')
+                failed_repo_count += 1
+                continue
+            click.echo(
+                f'{repo_path}: pulled {stale_count - written_placeholder_count - len(failures)} file(s), '
+                f'{file_count - stale_count} already up to date'
+                + (f', wrote {written_placeholder_count} placeholder(s).' if written_placeholder_count else '.')
+            )
+            for path, error in failures.items():
+                click.echo(f'  Error: Failed to pull `{path}`: {error}')
+            failed_repo_count += bool(failures)
+    for (ddm, _) in account_sessions.values():
+        ddm.close()
+    if failed_repo_count:
+        click.echo(f'{failed_repo_count} repository(s) could not be fully pulled. Re-run `sdr pull-all` to retry.')
+
+
+@sdr.command()
+@click.argument('dir', required=False)
+@click.option('--interval', type=click.FloatRange(min=1), help='Seconds between polls while changes keep arriving')
+@click.option('--max-interval', type=click.FloatRange(min=1), help='Longest wait between polls while Drive is idle')
+@click.option('-j', '--jobs', 'jobs', type=click.IntRange(min=1))
+def watch(dir: str, interval: float, max_interval: float, jobs: int) -> None:
+    """
+    Keep the specified repository mirrored by polling Google Drive for changes and pulling them as they appear.
+    Health and metrics are written to `.sdr/watch_status.json`. Stop with Ctrl-C.
+    """
+    from drive_data_manager import DriveDataManager
+    from drive_client import set_request_scheduler
+    from request_scheduler import create_request_scheduler
+    from repo_sync import RepositorySync
+    from watcher import watch_repository
+    target_dir_path: Path = get_path(dir)
+
+    sdr_config = _read_sdr_config(target_dir_path)
+    if sdr_config is None:
+        return
+    interval = interval or sdr_config.get(constants.WATCH_INTERVAL_KEY, constants.DEFAULT_WATCH_INTERVAL)
+    max_interval = max(interval, max_interval or sdr_config.get(constants.WATCH_MAX_INTERVAL_KEY, constants.DEFAULT_WATCH_MAX_INTERVAL))
+
+    set_request_scheduler(create_request_scheduler(sdr_config))
+    ddm = DriveDataManager(target_dir_path=target_dir_path)
+    sync = RepositorySync(target_dir_path, sdr_config, jobs or sdr_config.get(constants.PULL_JOBS_KEY, constants.DEFAULT_PULL_JOBS))
+    click.echo(f'Watching `{sdr_config[constants.CHOSEN_GDRIVE_DIR_PATH_KEY]}` for changes...')
+    try:
+        watch_repository(sync, ddm, interval, max_interval)
+    except KeyboardInterrupt:
+        click.echo('Stopped watching.')
+    finally:
+        ddm.close()
+        sync.close()
 
 
 @sdr.command()
@@ -116,6 +528,30 @@ def configure(dir: str) -> None:
             click.echo('Skipping...')
         config['export_types'] = new_exports
 
+        # configure additional export types, written alongside the default ones
+        click.echo('\nConfiguring additional export formats')
+        extra_exports: Dict[str, List[str]] = {}
+        for key, value in constants.DRIVE_EXPORT_MIMETYPES.items():
+            alternatives = [mimetype for mimetype in value['exports'] if mimetype != new_exports[key]]
+            if not alternatives:
+                continue
+            current_extras = [
+                mimetype for mimetype in config.get(constants.EXTRA_EXPORT_TYPES_KEY, {}).get(key, []) if mimetype in alternatives
+            ]
+            click.echo(f'\nAdditional formats for google {value["name"]}s: '
+                + (', '.join(f'.{value["exports"][mimetype]}' for mimetype in current_extras) or 'none'))
+            click.echo('Update additional export formats (y/n)?')
+            if get_input().lower() == 'y':
+                click.echo('\n'.join([f'{j}: .{value["exports"][mimetype]} ({mimetype})' for (j, mimetype) in enumerate(alternatives)]))
+                click.echo('Select export types by comma-separated numbers (or enter for none):')
+                try:
+                    current_extras = [alternatives[int(selection)] for selection in get_input().split(',') if selection.strip()]
+                except Exception:
+                    click.echo('Skipping...')
+            if current_extras:
+                extra_exports[key] = current_extras
+        config[constants.EXTRA_EXPORT_TYPES_KEY] = extra_exports
+
         # write out
         config_file.seek(0)
         config_file.write(json.dumps(config, indent=4, sort_keys=True))
@@ -134,6 +570,10 @@ def init(context: Context, creds: str, dir: str, should_pull: bool, should_confi
     If no directory is provided, the working directory is used. 
     Opens a REPL for navigation through your Google Drive file-system to select a folder for SourceDrive to sync from
     """
+    import yaml
+    from gdrive_repl import run_repl
+    from drive_client import get_gauth_settings
+    from drive_manifest import ManifestStore
     target_dir_path: Path = get_path(dir)
 
     # fetch google OAuth credentials
@@ -166,7 +606,7 @@ def init(context: Context, creds: str, dir: str, should_pull: bool, should_confi
 
     # write out GAuth settings
     with (target_dir_path / constants.GAUTH_SETTINGS_RELPATH).open(mode='w') as gauth_settings_file:
-        gauth_settings_file.write(constants.GAUTH_SETTINGS)
+        gauth_settings_file.write(yaml.dump(get_gauth_settings()))
 
     # write out GAuth credentials (secrets)
     with (target_dir_path / constants.GAUTH_CREDENTIALS_RELPATH).open(mode='w') as gauth_credentials_file:
@@ -176,7 +616,23 @@ def init(context: Context, creds: str, dir: str, should_pull: bool, should_confi
     with (target_dir_path / constants.SDR_CONFIG_RELPATH).open(mode='w') as config_file:
         config_file.write(
             json.dumps(
-                {'export_types': {key:value['default_export'] for (key, value) in constants.DRIVE_EXPORT_MIMETYPES.items()}}
+                {
+                    'export_types': {key:value['default_export'] for (key, value) in constants.DRIVE_EXPORT_MIMETYPES.items()},
+                    constants.PULL_JOBS_KEY: constants.DEFAULT_PULL_JOBS,
+                    constants.LISTING_CACHE_TTL_KEY: constants.DEFAULT_LISTING_CACHE_TTL,
+                    constants.LISTING_CACHE_MAX_ENTRIES_KEY: constants.DEFAULT_LISTING_CACHE_MAX_ENTRIES,
+                    constants.PREFETCH_DEPTH_KEY: constants.DEFAULT_PREFETCH_DEPTH,
+                    constants.PREFETCH_BUDGET_KEY: constants.DEFAULT_PREFETCH_BUDGET,
+                    constants.REQUESTS_PER_SECOND_KEY: constants.DEFAULT_REQUESTS_PER_SECOND,
+                    constants.REQUEST_BURST_KEY: constants.DEFAULT_REQUEST_BURST,
+                    constants.MAX_CONCURRENCY_KEY: constants.DEFAULT_MAX_CONCURRENCY,
+                    constants.DEDUP_MODE_KEY: constants.DEFAULT_DEDUP_MODE,
+                    constants.CONTENT_STORE_KEY: False,
+                    constants.EXTRA_EXPORT_TYPES_KEY: {},
+                    constants.WATCH_INTERVAL_KEY: constants.DEFAULT_WATCH_INTERVAL,
+                    constants.WATCH_MAX_INTERVAL_KEY: constants.DEFAULT_WATCH_MAX_INTERVAL,
+                    constants.PULL_FILTERS_KEY: PullFilter().to_config()
+                }
                 ,indent=4
                 ,sort_keys=True
             )
@@ -185,17 +641,19 @@ def init(context: Context, creds: str, dir: str, should_pull: bool, should_confi
     if should_configure:
         context.invoke(configure, dir=dir)
 
-    chosen_gdrive_dir_path, gdrive_data = run_repl(target_dir_path)
+    chosen_gdrive_dir_path, chosen_gdrive_dir_id, gdrive_data, start_page_token = run_repl(target_dir_path)
     if gdrive_data:
         # write out path
-        with (target_dir_path / constants.SDR_CONFIG_RELPATH).open(mode='r+') as sdr_config_file:
-            sdr_config: Dict[str, Any] = json.load(sdr_config_file)
-            sdr_config.update({constants.CHOSEN_GDRIVE_DIR_PATH_KEY: chosen_gdrive_dir_path})
-            sdr_config_file.seek(0)
-            sdr_config_file.write(json.dumps(sdr_config, indent=4, sort_keys=True))
+        update_sdr_config(target_dir_path, {
+            constants.CHOSEN_GDRIVE_DIR_PATH_KEY: chosen_gdrive_dir_path,
+            constants.CHOSEN_GDRIVE_DIR_ID_KEY: chosen_gdrive_dir_id
+        })
 
         # write out data
-        with (target_dir_path / constants.DRIVE_FILES_RELPATH).open(mode='w') as gdrive_fs_file:
-            gdrive_fs_file.write(json.dumps(gdrive_data))
+        store = ManifestStore(target_dir_path)
+        store.update_files(gdrive_data, [])
+        if start_page_token:
+            store.update_page_token(start_page_token)
+        store.close()
         if should_pull:
-            context.invoke(pull, dir=dir, should_search=False, is_forced=False, is_interactive=False)
+            context.invoke(pull, dir=dir, search_query=None, is_forced=False, is_interactive=False)
@@ -0,0 +1,155 @@
+import contextlib
+import heapq
+import json
+import os
+import threading
+import time
+from typing import Dict, Any, List, Iterator, Optional, Tuple
+
+
+_lock = threading.Lock()
+_enabled = False
+_is_tracing = False
+_start_time = time.perf_counter()
+_phases: Dict[str, float] = {}
+_requests: Dict[str, int] = {}
+_retries: Dict[str, int] = {}
+_bytes_transferred = 0
+_cache_lookups: Dict[str, List[int]] = {}
+_file_timings: List[Tuple[float, str, int]] = []
+_first_file_seconds: Optional[float] = None
+_trace_events: List[Dict[str, Any]] = []
+
+
+def enable(is_tracing: bool = False) -> None:
+    global _enabled, _is_tracing, _start_time
+    _enabled = True
+    _is_tracing = is_tracing
+    _start_time = time.perf_counter()
+
+
+def is_enabled() -> bool:
+    return _enabled
+
+
+def _add_trace_event(name: str, category: str, start: float, duration: float, args: Dict[str, Any] = None) -> None:
+    if not _is_tracing:
+        return
+    _trace_events.append({
+        'name': name,
+        'cat': category,
+        'ph': 'X',
+        'ts': (start - _start_time) * 1e6,
+        'dur': duration * 1e6,
+        'pid': os.getpid(),
+        'tid': threading.get_ident(),
+        'args': args or {}
+    })
+
+
+@contextlib.contextmanager
+def phase(name: str) -> Iterator[None]:
+    if not _enabled:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        duration = time.perf_counter() - start
+        with _lock:
+            _phases[name] = _phases.get(name, 0.0) + duration
+            _add_trace_event(name, 'phase', start, duration)
+
+
+@contextlib.contextmanager
+def request(kind: str) -> Iterator[None]:
+    if not _enabled:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        with _lock:
+            _requests[kind] = _requests.get(kind, 0) + 1
+            _add_trace_event(kind, 'request', start, time.perf_counter() - start)
+
+
+def count_retry(kind: str) -> None:
+    if not _enabled:
+        return
+    with _lock:
+        _retries[kind] = _retries.get(kind, 0) + 1
+
+
+def add_bytes(byte_count: int) -> None:
+    global _bytes_transferred
+    if not _enabled:
+        return
+    with _lock:
+        _bytes_transferred += byte_count
+
+
+def count_cache_lookup(cache_name: str, is_hit: bool) -> None:
+    if not _enabled:
+        return
+    with _lock:
+        lookups = _cache_lookups.setdefault(cache_name, [0, 0])
+        lookups[0 if is_hit else 1] += 1
+
+
+def record_file(path: str, seconds: float, size: int) -> None:
+    global _first_file_seconds
+    if not _enabled:
+        return
+    with _lock:
+        _file_timings.append((seconds, path, size))
+        if _first_file_seconds is None:
+            _first_file_seconds = time.perf_counter() - _start_time
+
+
+def get_report(slowest_file_count: int = 10) -> Dict[str, Any]:
+    with _lock:
+        return {
+            'wall_seconds': time.perf_counter() - _start_time,
+            'phases': dict(_phases),
+            'requests': dict(_requests),
+            'retries': dict(_retries),
+            'bytes_transferred': _bytes_transferred,
+            'first_file_seconds': _first_file_seconds,
+            'cache_hit_rates': {
+                name: {'hits': hits, 'misses': misses, 'hit_rate': hits / (hits + misses) if hits + misses else None}
+                for (name, (hits, misses)) in _cache_lookups.items()
+            },
+            'slowest_files': [
+                {'path': path, 'seconds': seconds, 'size': size}
+                for (seconds, path, size) in heapq.nlargest(slowest_file_count, _file_timings)
+            ]
+        }
+
+
+def format_report(report: Dict[str, Any]) -> str:
+    lines = [f'Total wall time: {report["wall_seconds"]:.3f}s', 'Phases:']
+    lines += [f'  {name}: {seconds:.3f}s' for (name, seconds) in report['phases'].items()]
+    lines += ['API requests:'] + [f'  {kind}: {count}' for (kind, count) in sorted(report['requests'].items())]
+    lines += ['Retries:'] + [f'  {kind}: {count}' for (kind, count) in sorted(report['retries'].items())]
+    lines.append(f'Bytes transferred: {report["bytes_transferred"]}')
+    if report['first_file_seconds'] is not None:
+        lines.append(f'First file written after: {report["first_file_seconds"]:.3f}s')
+    lines.append('Cache hit rates:')
+    lines += [
+        f'  {name}: {lookups["hits"]}/{lookups["hits"] + lookups["misses"]}'
+        + (f' ({lookups["hit_rate"]:.0%})' if lookups['hit_rate'] is not None else '')
+        for (name, lookups) in report['cache_hit_rates'].items()
+    ]
+    lines.append('Slowest files:')
+    lines += [f'  {file["seconds"]:.3f}s {file["path"]} ({file["size"]} bytes)' for file in report['slowest_files']]
+    return '\n'.join(lines)
+
+
+def write_trace(trace_path: str) -> None:
+    with _lock:
+        events = list(_trace_events)
+    with open(trace_path, 'w') as trace_file:
+        trace_file.write(json.dumps({'traceEvents': events, 'displayTimeUnit': 'ms'}))
@@ -1,9 +1,10 @@
 import os
 from pathlib import Path
-from fs.base import FS
-from fs.subfs import SubFS
 import contextlib
 import sys
+import json
+from typing import Dict, Any, List, Optional, Tuple
+import constants
 
 def get_path(dir: str = "") -> Path:
     return Path(dir) if dir else Path.cwd()
@@ -13,12 +14,6 @@ def get_input() -> str:
     return input('> ')
 
 
-def get_sub_dir_path(dir: SubFS[FS]) -> str:
-    try:
-        return get_sub_dir_path(dir._wrap_fs) + dir._sub_dir
-    except AttributeError:
-        return ''
-
 def sanitise_fname(path: str) -> str:
     return path.replace(os.sep, '+')
 
@@ -28,4 +23,71 @@ def no_stdout():
     old_stdout = sys.stdout
     sys.stdout = open(os.devnull, 'w')
     yield
-    sys.stdout = old_stdout
\ No newline at end of file
+    sys.stdout = old_stdout
+
+
+def quote_query_value(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('\'', '\\\'')
+
+
+def update_sdr_config(target_dir_path: Path, updates: Dict[str, Any]) -> None:
+    with (target_dir_path / constants.SDR_CONFIG_RELPATH).open(mode='r+') as sdr_config_file:
+        sdr_config: Dict[str, Any] = json.load(sdr_config_file)
+        sdr_config.update(updates)
+        sdr_config_file.seek(0)
+        sdr_config_file.write(json.dumps(sdr_config, indent=4, sort_keys=True))
+        sdr_config_file.truncate()
+
+
+def find_repositories(root_dir_path: Path) -> List[Path]:
+    repo_paths: List[Path] = []
+    for dir_path, dir_names, _ in os.walk(root_dir_path):
+        if (Path(dir_path) / constants.SDR_CONFIG_RELPATH).exists():
+            repo_paths.append(Path(dir_path))
+            dir_names[:] = [] # repositories don't nest
+        else:
+            dir_names[:] = [dir_name for dir_name in dir_names if not dir_name.startswith('.')]
+    return sorted(repo_paths)
+
+
+def find_repository_root(dir_path: Path) -> Optional[Path]:
+    # the repository holding `dir_path`, which may be one of its folders
+    for path in [dir_path, *dir_path.parents]:
+        if (path / constants.SDR_CONFIG_RELPATH).exists():
+            return path
+    return None
+
+
+def get_virtual_file_name(metadata: Dict[str, Any], file_export_format_defaults: Dict[str, str]) -> str:
+    return f'{sanitise_fname(metadata["title"])}{get_export_extension(metadata["mimeType"], file_export_format_defaults)}'
+
+
+def get_export_extension(file_mimetype: str, file_export_format_defaults: Dict[str, str]) -> str:
+    if file_mimetype == constants.FOLDER_MIMETYPE:
+        return ''
+    export_extension = (constants.DRIVE_EXPORT_MIMETYPES 
+        .get(file_mimetype, {}) 
+        .get('exports', {}) 
+        .get(file_export_format_defaults.get(file_mimetype, None), ''))
+    return (f'.{export_extension}' if export_extension else '')
+
+
+def get_local_file_path(target_dir_path: Path, drive_file_path: str) -> Path:
+    return target_dir_path / drive_file_path.strip(os.sep)
+
+
+def get_local_file_paths(
+        target_dir_path: Path,
+        drive_file_path: str,
+        metadata: Dict[str, Any],
+        export_formats: Dict[str, List[str]]
+    ) -> List[Tuple[Optional[str], Path]]:
+
+    local_file_path = get_local_file_path(target_dir_path, drive_file_path)
+    export_mimetypes = export_formats.get(metadata['mimeType'], None)
+    if not export_mimetypes:
+        return [(None, local_file_path)]
+    return [
+        (export_mimetype, local_file_path.with_name(get_virtual_file_name(metadata, {metadata['mimeType']: export_mimetype})))
+        for export_mimetype in export_mimetypes
+    ]
@@ -0,0 +1,73 @@
+import json
+import os
+import time
+from pathlib import Path
+from typing import Dict, Any
+import constants
+import stats
+from drive_data_manager import DriveDataManager
+from repo_sync import RepositorySync
+
+
+def write_watch_status(status_path: Path, status: Dict[str, Any]) -> None:
+    # replaced atomically so health checks never read a partial file
+    temp_status_path = status_path.with_name(status_path.name + '.tmp')
+    temp_status_path.write_text(json.dumps(status, indent=4, sort_keys=True))
+    os.replace(temp_status_path, status_path)
+
+
+def watch_repository(sync: RepositorySync, ddm: DriveDataManager, interval: float, max_interval: float) -> None:
+    """
+    Polls the changes feed until interrupted, pulling whatever changed. Polling slows down exponentially
+    (up to `max_interval`) while Drive is idle or unreachable, and returns to `interval` once changes appear.
+    """
+    status_path = sync.target_dir_path / constants.WATCH_STATUS_RELPATH
+    status: Dict[str, Any] = {
+        'pid': os.getpid(),
+        'started_at': time.time(),
+        'healthy': True,
+        'last_poll_at': None,
+        'last_change_at': None,
+        'last_error': None,
+        'polls': 0,
+        'errors': 0,
+        'changes': 0,
+        'pulled_files': 0,
+        'failed_files': 0,
+        'poll_interval': interval
+    }
+    poll_interval = interval
+    try:
+        while True:
+            start = time.time()
+            try:
+                change_count, stale_count, failures = sync.pull(ddm, changed_only=True)
+            except Exception as e: # the next poll resumes from the last saved page token
+                status.update({'healthy': False, 'last_error': repr(e), 'errors': status['errors'] + 1})
+                poll_interval = min(max_interval, poll_interval * 2)
+            else:
+                status.update({
+                    'healthy': True,
+                    'last_error': None,
+                    'changes': status['changes'] + change_count,
+                    'pulled_files': status['pulled_files'] + stale_count - len(failures),
+                    'failed_files': len(failures)
+                })
+                if change_count:
+                    status['last_change_at'] = start
+                    poll_interval = interval
+                else:
+                    poll_interval = min(max_interval, poll_interval * 2)
+            status.update({
+                'last_poll_at': start,
+                'last_poll_seconds': time.time() - start,
+                'polls': status['polls'] + 1,
+                'poll_interval': poll_interval
+            })
+            if stats.is_enabled():
+                status['stats'] = stats.get_report()
+            write_watch_status(status_path, status)
+            time.sleep(poll_interval)
+    finally:
+        status.update({'healthy': False, 'stopped_at': time.time()})
+        write_watch_status(status_path, status)